@@ -9,6 +9,9 @@ from .logging_config import setup_logging
 from .utils.datetime_provider import BJJSONProvider
 from .exceptions.exceptions import CustomAPIException  # 你的自定义异常:contentReference[oaicite:0]{index=0}
 from .utils.config_inspector import dump_config
+from .services.storage import conversion_service, delete_queue, rendition_service, usage_service
+from .services import onlyoffice_save_service
+from .services.youtube import youtube_tasks
 
 
 def handle_custom_api_exception(e: CustomAPIException):
@@ -22,7 +25,20 @@ def handle_custom_api_exception(e: CustomAPIException):
     }), getattr(e, "status_code", 400)
 
 
-def create_app(config_name: str = "dev") -> Flask:
+def start_background_workers(app: Flask) -> None:
+    """
+    后台线程：MinIO 删除队列消费 / 缩略图生成 / 用量对账 / 格式转换 / OnlyOffice 保存 / YouTube 下载
+    只由 Web 入口（wsgi.py、manage.py 本地运行）启动；init_db 等脚本和独立 worker 不跑这些线程
+    """
+    delete_queue.start_worker(app)
+    rendition_service.start_worker(app)
+    usage_service.start_worker(app)
+    conversion_service.start_worker(app)
+    onlyoffice_save_service.start_worker(app)
+    youtube_tasks.start_workers(app)
+
+
+def create_app(config_name: str = "dev", start_workers: bool = False) -> Flask:
     setup_logging(level="DEBUG" if config_name == "dev" else "INFO")
     app = Flask(__name__)
 
@@ -52,6 +68,9 @@ def create_app(config_name: str = "dev") -> Flask:
     init_extensions(app)
     register_blueprints(app)
 
+    if start_workers:
+        start_background_workers(app)
+
     # ⭐ 在工厂函数里注册全局异常处理
     app.register_error_handler(CustomAPIException, handle_custom_api_exception)
 
@@ -2,6 +2,7 @@
 from flask import Blueprint, request, jsonify
 
 from ..services import document_service
+from ..exceptions.exceptions import CustomAPIException
 
 bp = Blueprint("file", __name__)
 
@@ -56,6 +57,36 @@ def get_download_url(document_id):
         return jsonify({"error": str(e)}), 400
 
 
+@bp.route("/<int:document_id>/convert", methods=["POST"])
+def convert_document(document_id):
+    """
+    导出为其他格式（默认 PDF）：受理后立即返回 status=pending，由后台生成
+    POST /api/file/<document_id>/convert   Body: { "format": "pdf" }
+    """
+    try:
+        result = document_service.convert_document(document_id)
+        return result
+    except CustomAPIException:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@bp.route("/<int:document_id>/convert", methods=["GET"])
+def get_conversion(document_id):
+    """
+    查询转换进度，前端轮询直到 ready（带 downloadUrl）
+    GET /api/file/<document_id>/convert?format=pdf
+    """
+    try:
+        result = document_service.get_conversion(document_id)
+        return result
+    except CustomAPIException:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @bp.route("/<int:document_id>", methods=["DELETE"])
 def delete_document(document_id):
     """
@@ -68,6 +99,70 @@ def delete_document(document_id):
         return jsonify({"error": str(e)}), 400
 
 
+@bp.route("/<int:document_id>/versions", methods=["GET"])
+def list_versions(document_id):
+    """
+    历史版本列表
+    GET /api/file/<document_id>/versions
+    """
+    try:
+        result = document_service.list_versions(document_id)
+        return result
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@bp.route("/<int:document_id>/versions/<int:version_no>/restore", methods=["POST"])
+def restore_version(document_id, version_no):
+    """
+    恢复到指定版本（只改元数据，不复制文件）
+    POST /api/file/<document_id>/versions/<version_no>/restore
+    """
+    try:
+        result = document_service.restore_version(document_id, version_no)
+        return result
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@bp.route("/renditions", methods=["GET"])
+def get_renditions():
+    """
+    批量获取缩略图 / 预览图
+    GET /api/file/renditions?ids=1,2,3
+    """
+    try:
+        result = document_service.get_renditions()
+        return result
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@bp.route("/usage", methods=["GET"])
+def get_storage_usage():
+    """
+    存储用量
+    GET /api/file/usage?fileType=DRAWING&businessId=xxx
+    """
+    try:
+        result = document_service.get_storage_usage()
+        return result
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@bp.route("/delete-queue/stats", methods=["GET"])
+def get_delete_queue_stats():
+    """
+    删除队列监控：队列深度 / 死信数量 / 积压时长
+    """
+    try:
+        result = document_service.get_delete_queue_stats()
+        return result
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
 @bp.route("/update/prepare", methods=["POST"])
 def prepare_update_upload():
     """
@@ -31,6 +31,8 @@ def download_proxy(document_id):
         # 这里不需要 @jwt_required，因为 OnlyOffice 无法携带前端的 JWT
         # 安全起见，如果需要鉴权，通常是在 URL 里带一个一次性 token，或者依靠内网隔离
         return onlyoffice_service.proxy_download_file(document_id)
+    except CustomAPIException as e:
+        return jsonify({"error": str(e)}), getattr(e, "status_code", 404)
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
@@ -40,16 +42,31 @@ def callback(document_id):
     return onlyoffice_service.onlyoffice_callback(document_id)
 
 
+@bp.route("/save-status/<int:document_id>", methods=["GET"])
+@jwt_required()
+def save_status(document_id):
+    try:
+        return onlyoffice_service.get_save_status(document_id)
+    except CustomAPIException as e:
+        return jsonify({"message": str(e), "code": getattr(e, "status_code", 400)}), getattr(e, "status_code", 400)
+
+
 @bp.route("/status", methods=["POST"])
+@jwt_required()
 def online_status():
     try:
         return onlyoffice_service.online_status()
+    except CustomAPIException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @bp.route("/force-save", methods=["POST"])
+@jwt_required()
 def force_save():
     try:
         return onlyoffice_service.force_save()
+    except CustomAPIException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 400
\ No newline at end of file
@@ -1,25 +1,125 @@
 # backend/app/api/youtube.py
-import json
+import mimetypes
 import os
-from flask import Blueprint, request, jsonify, send_file
+from datetime import timedelta
+from urllib.parse import quote
+
+from flask import Blueprint, Response, redirect, request, jsonify, send_file
+from yt_dlp.utils import DownloadError
 
 from ..config import Config
-from ..services.youtube.youtube_tasks import create_task, get_task
+from ..utils.minio_storage import generate_presigned_download_url
+from ..services.youtube import youtube_offload, youtube_probe, youtube_storage
+from ..services.youtube.youtube_service import expand_urls, resolve_profile
+from ..services.youtube.youtube_tasks import (
+    TASK_STATUSES,
+    cancel_batch,
+    cancel_task,
+    create_batch,
+    create_task,
+    get_batch,
+    get_profile_stats,
+    get_queue_position,
+    get_task,
+    list_tasks,
+)
 
 bp = Blueprint("youtube", __name__)
 
 
+@bp.get("/probe")
+def probe_video():
+    """
+    下载前预览：GET /youtube/probe?url=<url>[&refresh=true]
+    返回标题 / 时长 / 缩略图 / 可选清晰度 / 格式列表，结果按 video_id 缓存
+    """
+    url = request.args.get("url")
+    if not url:
+        return jsonify({"success": False, "error": "url is required"}), 400
+
+    refresh = request.args.get("refresh", "false").lower() == "true"
+    try:
+        info, cached = youtube_probe.get_info(url, refresh=refresh)
+    except DownloadError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    return jsonify({"success": True, "cached": cached, **youtube_probe.summarize(info)})
+
+
 @bp.post("/tasks")
 def create_download_task():
     data = request.get_json() or {}
     url = data.get("url")
     quality = data.get("quality", "720p")
+    profile = data.get("profile")
 
     if not url:
         return jsonify({"success": False, "error": "url is required"}), 400
 
-    task_id = create_task(url, quality)
-    return jsonify({"success": True, "task_id": task_id})
+    try:
+        profile, _ = resolve_profile(profile)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    task_id = create_task(url, quality, profile)
+    return jsonify({"success": True, "task_id": task_id, "queue_position": get_queue_position(task_id)})
+
+
+@bp.post("/batches")
+def create_batch_task():
+    """
+    批量下载：{"urls": [...]} 或 {"url": "<播放列表 / 频道>"}，可带 quality / profile
+    展开成子任务，已下载过的视频直接记为完成
+    """
+    data = request.get_json() or {}
+    urls = data.get("urls") or ([data["url"]] if data.get("url") else [])
+    quality = data.get("quality", "720p")
+
+    if not urls or not isinstance(urls, list):
+        return jsonify({"success": False, "error": "urls is required"}), 400
+
+    try:
+        profile, _ = resolve_profile(data.get("profile"))
+        videos = expand_urls(urls, max_items=Config.YOUTUBE_BATCH_MAX_ITEMS)
+    except (ValueError, DownloadError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    if not videos:
+        return jsonify({"success": False, "error": "no videos found"}), 400
+
+    batch_id = create_batch(videos, quality, profile)
+    return jsonify({"success": True, "batch_id": batch_id, "total": len(videos)})
+
+
+@bp.get("/batches/<batch_id>")
+def get_batch_task(batch_id):
+    batch = get_batch(batch_id)
+    if not batch:
+        return jsonify({"success": False, "error": "batch not found"}), 404
+    return jsonify({"success": True, **batch})
+
+
+@bp.post("/batches/<batch_id>/cancel")
+def cancel_batch_task(batch_id):
+    status = cancel_batch(batch_id)
+    if status is None:
+        return jsonify({"success": False, "error": "batch not found"}), 404
+    return jsonify({"success": True, "status": status})
+
+
+@bp.get("/tasks")
+def list_download_tasks():
+    """
+    任务列表：GET /youtube/tasks?status=pending|running|finished|error|cancelled&page=1&page_size=20
+    按创建时间倒序
+    """
+    status = request.args.get("status") or None
+    if status and status not in TASK_STATUSES:
+        return jsonify({"success": False, "error": "invalid status"}), 400
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = min(max(request.args.get("page_size", 20, type=int), 1), 100)
+    return jsonify({"success": True, **list_tasks(status, page, page_size)})
 
 
 @bp.get("/tasks/<task_id>")
@@ -28,11 +128,33 @@ def get_download_task(task_id):
     if not task:
         return jsonify({"success": False, "error": "task not found"}), 404
 
-    if task["status"] in ("pending", "running"):
+    if task.get("type") == "batch":
+        return get_batch_task(task_id)
+
+    if task["status"] == "pending":
         return jsonify({
             "success": True,
-            "status": task["status"],
+            "status": "pending",
+            "progress": 0,
+            "queue_position": get_queue_position(task_id),
+        })
+
+    if task["status"] == "running":
+        return jsonify({
+            "success": True,
+            "status": "running",
+            "stage": task.get("stage") or "downloading",
             "progress": task.get("progress", 0),
+            "downloaded_bytes": task.get("downloaded_bytes"),
+            "total_bytes": task.get("total_bytes"),
+            "speed": task.get("speed"),
+            "eta": task.get("eta"),
+        })
+
+    if task["status"] == "cancelled":
+        return jsonify({
+            "success": False,
+            "status": "cancelled",
         })
 
     if task["status"] == "error":
@@ -55,8 +177,34 @@ def get_download_task(task_id):
         "thumbnail": result.get("thumbnail"),
         "audio_path": result.get("audio_path"),
         "audio_size": result.get("audio_size"),
+        "cached": bool(task.get("cached")),
+        "download": result.get("download"),
+        "minio": result.get("minio"),
+        "minio_error": result.get("minio_error"),
+    })
+
+
+@bp.get("/profiles")
+def list_download_profiles():
+    """下载档位及各档位累计吞吐，用来对比不同参数的实际效果"""
+    stats = get_profile_stats()
+    return jsonify({
+        "success": True,
+        "default": Config.YOUTUBE_DOWNLOAD_PROFILE,
+        "profiles": [
+            {"name": name, "options": options, "stats": stats.get(name)}
+            for name, options in Config.YOUTUBE_DOWNLOAD_PROFILES.items()
+        ],
     })
 
+@bp.post("/tasks/<task_id>/cancel")
+def cancel_download_task(task_id):
+    status = cancel_task(task_id)
+    if status is None:
+        return jsonify({"success": False, "error": "task not found"}), 404
+    return jsonify({"success": True, "status": status})
+
+
 @bp.get("/download")
 def download_file():
     """
@@ -66,13 +214,10 @@ def download_file():
     约定：
     - 每个 video_id 对应一个目录：
         Config.YOUTUBE_DOWNLOAD_DIR / <video_id> /
-    - 目录下有 meta.json，里边有：
-        {
-          "video_id": "q1qCzx3sakA",
-          "video_path": "video.mp4",
-          "audio_path": "audio.m4a",
-          ... 其他信息
-        }
+    - video_id -> 文件路径走 Redis 索引（没有时读该目录下的 meta.json 回填）
+    - 支持 Range / ETag / If-None-Match，播放器可以直接拖动进度
+    - YOUTUBE_DOWNLOAD_SERVE_MODE=accel 时只返回 X-Accel-Redirect，由 nginx 出流
+    - 本地已淘汰但转存过 MinIO 时 302 到预签名地址
     """
     video_id = request.args.get("id")
     file_type = request.args.get("type", "video")
@@ -83,26 +228,32 @@ def download_file():
     if file_type not in ("video", "audio"):
         return jsonify({"success": False, "error": "invalid type"}), 400
 
-    meta_file = os.path.join(Config.YOUTUBE_DOWNLOAD_DIR, video_id, "meta.json")
-    if not os.path.exists(meta_file):
-        return jsonify({"success": False, "error": "not found"}), 404
-
-    # ⭐ 指定 encoding='utf-8'，避免 Windows 默认 gbk 导致 UnicodeDecodeError
-    with open(meta_file, "r", encoding="utf-8") as f:
-        meta = json.load(f)
-
-    key = f"{file_type}_path"     # video_path / audio_path
-    path = meta.get(key)
+    path = youtube_storage.lookup_file(video_id, file_type)
     if not path:
-        return jsonify({"success": False, "error": f"{key} not in meta"}), 404
+        doc = youtube_offload.find_document(video_id, file_type)
+        if not doc:
+            return jsonify({"success": False, "error": "not found"}), 404
+        url = generate_presigned_download_url(
+            bucket=doc.bucket,
+            object_key=doc.object_key,
+            ttl=timedelta(minutes=15),
+            download_filename=f"{video_id}{os.path.splitext(doc.object_key)[1]}",
+            request=request,
+        )
+        return redirect(url, code=302)
 
-    # 防御性处理：统一斜杠 & 相对路径
-    path = path.replace("\\", os.sep)
-    if not os.path.isabs(path):
-        # 放在该 video_id 的目录下
-        path = os.path.join(Config.YOUTUBE_DOWNLOAD_DIR, video_id, path.lstrip("\\/"))
+    youtube_storage.touch(video_id)
+    download_name = f"{video_id}{os.path.splitext(path)[1]}"
 
-    if not os.path.exists(path):
-        return jsonify({"success": False, "error": "file not exists"}), 404
+    if Config.YOUTUBE_DOWNLOAD_SERVE_MODE == "accel":
+        rel_path = os.path.relpath(path, os.path.abspath(Config.YOUTUBE_DOWNLOAD_DIR)).replace(os.sep, "/")
+        return Response(
+            status=200,
+            mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream",
+            headers={
+                "X-Accel-Redirect": f"{Config.YOUTUBE_ACCEL_LOCATION.rstrip('/')}/{quote(rel_path)}",
+                "Content-Disposition": f'attachment; filename="{download_name}"',
+            },
+        )
 
-    return send_file(path, as_attachment=True)
\ No newline at end of file
+    return send_file(path, as_attachment=True, download_name=download_name, conditional=True, etag=True)
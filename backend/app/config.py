@@ -1,4 +1,5 @@
 # backend/app/config.py
+import json
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -32,6 +33,25 @@ class Config:
     MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY", "StrongPass123!")
     MINIO_SECURE = os.environ.get("MINIO_SECURE", "false").lower() == "true"
     MINIO_BUCKET = os.environ.get("MINIO_BUCKET", "files")
+    # 代理下载时每次从 MinIO 读取并写给客户端的块大小（字节）
+    MINIO_STREAM_CHUNK_SIZE = int(os.environ.get("MINIO_STREAM_CHUNK_SIZE", 256 * 1024))
+    # 长度未知的流式上传（OnlyOffice 保存等）按这个大小分片 multipart，最小 5MB
+    MINIO_UPLOAD_PART_SIZE = int(os.environ.get("MINIO_UPLOAD_PART_SIZE", 10 * 1024 * 1024))
+    # 代理下载的本地磁盘缓存（LRU，按总字节数淘汰）
+    MINIO_CACHE_ENABLED = os.environ.get("MINIO_CACHE_ENABLED", "true").lower() == "true"
+    MINIO_CACHE_DIR = os.environ.get("MINIO_CACHE_DIR", os.path.join(os.getcwd(), "cache", "minio"))
+    MINIO_CACHE_MAX_BYTES = int(os.environ.get("MINIO_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+    MINIO_CACHE_MAX_OBJECT_BYTES = int(os.environ.get("MINIO_CACHE_MAX_OBJECT_BYTES", 256 * 1024 ** 2))
+    # 未命中时后台回源的线程数；缓存目录全量重扫间隔（秒，补齐其他 worker 的写入 / 淘汰）
+    MINIO_CACHE_FILL_WORKERS = int(os.environ.get("MINIO_CACHE_FILL_WORKERS", 2))
+    MINIO_CACHE_RESCAN_INTERVAL = float(os.environ.get("MINIO_CACHE_RESCAN_INTERVAL", 300))
+    # 删除对象走 Redis 队列，由后台线程批量 remove_objects（单批最多 1000）
+    MINIO_DELETE_QUEUE_ENABLED = os.environ.get("MINIO_DELETE_QUEUE_ENABLED", "true").lower() == "true"
+    MINIO_DELETE_BATCH_SIZE = int(os.environ.get("MINIO_DELETE_BATCH_SIZE", 1000))
+    MINIO_DELETE_MAX_ATTEMPTS = int(os.environ.get("MINIO_DELETE_MAX_ATTEMPTS", 5))
+    MINIO_DELETE_POLL_INTERVAL = float(os.environ.get("MINIO_DELETE_POLL_INTERVAL", 2))
+    # 删除时文档还在 OnlyOffice 里打开：当前对象最多推迟这么久再删（秒）
+    MINIO_DELETE_EDIT_HOLD_SECONDS = float(os.environ.get("MINIO_DELETE_EDIT_HOLD_SECONDS", 3600))
 
     BACKEND_PUBLIC= os.environ.get("BACKEND_PUBLIC", "http://192.168.31.138:5000")
 
@@ -51,13 +71,87 @@ class Config:
         "MyJWTSecretKey123"
     )
     ONLYOFFICE_VERIFY_INBOX=False
+    # 保存回调异步处理：回调只入队，后台 worker 下载并写回 MinIO
+    ONLYOFFICE_ASYNC_SAVE = os.environ.get("ONLYOFFICE_ASYNC_SAVE", "true").lower() == "true"
+    ONLYOFFICE_SAVE_MAX_ATTEMPTS = int(os.environ.get("ONLYOFFICE_SAVE_MAX_ATTEMPTS", 5))
+    ONLYOFFICE_SAVE_VISIBILITY_TIMEOUT = float(os.environ.get("ONLYOFFICE_SAVE_VISIBILITY_TIMEOUT", 900))
+    # 每次保存时是否一并保存 changesurl 修改记录包（版本历史里可回看修改）
+    ONLYOFFICE_STORE_CHANGES = os.environ.get("ONLYOFFICE_STORE_CHANGES", "false").lower() == "true"
+    # 已签名编辑器配置缓存（文档变化时自动失效，TTL 兜底用户名等变化）
+    ONLYOFFICE_EDITOR_CONFIG_CACHE = os.environ.get("ONLYOFFICE_EDITOR_CONFIG_CACHE", "true").lower() == "true"
+    ONLYOFFICE_EDITOR_CONFIG_TTL = int(os.environ.get("ONLYOFFICE_EDITOR_CONFIG_TTL", 3600))
+    # /api/onlyoffice/download 的出流方式：
+    #   proxy    —— Flask 从 MinIO 读流转发（默认，兼容原行为）
+    #   redirect —— 鉴权后 302 到短时效预签名 URL，Document Server 直接从 MinIO 拉
+    #   accel    —— 鉴权后返回 X-Accel-Redirect，由 nginx 内部 location 直连 MinIO 出流
+    ONLYOFFICE_DOWNLOAD_MODE = os.environ.get("ONLYOFFICE_DOWNLOAD_MODE", "proxy").lower()
+    ONLYOFFICE_DOWNLOAD_URL_TTL = int(os.environ.get("ONLYOFFICE_DOWNLOAD_URL_TTL", 300))
+    # redirect 模式默认跳 MinIO 内部地址（Document Server 在内网）；浏览器也要用时改成 true
+    ONLYOFFICE_DOWNLOAD_REDIRECT_PUBLIC = os.environ.get("ONLYOFFICE_DOWNLOAD_REDIRECT_PUBLIC", "false").lower() == "true"
+    ONLYOFFICE_ACCEL_LOCATION = os.environ.get("ONLYOFFICE_ACCEL_LOCATION", "/_minio_accel")
+    # proxy 模式是否也要求鉴权（redirect / accel 模式总是鉴权）
+    ONLYOFFICE_DOWNLOAD_AUTH = os.environ.get("ONLYOFFICE_DOWNLOAD_AUTH", "false").lower() == "true"
     DOCUMENT_SERVER_COMMAND_URL =os.environ.get("DOCUMENT_SERVER_COMMAND_URL", "http://192.168.31.145:8080/coauthoring/CommandService.ashx")
+    ONLYOFFICE_COMMAND_TIMEOUT = float(os.environ.get("ONLYOFFICE_COMMAND_TIMEOUT", 10))
+    ONLYOFFICE_COMMAND_WORKERS = int(os.environ.get("ONLYOFFICE_COMMAND_WORKERS", 8))
+    DOCUMENT_SERVER_CONVERT_URL = os.environ.get(
+        "DOCUMENT_SERVER_CONVERT_URL",
+        ONLYOFFICE_BASE_URL.rstrip("/") + "/ConvertService.ashx"
+    )
+    ONLYOFFICE_CONVERT_TIMEOUT = float(os.environ.get("ONLYOFFICE_CONVERT_TIMEOUT", 120))
+
+    # ========== 存储用量统计 ==========
+    STORAGE_USAGE_RECONCILE_ENABLED = os.environ.get("STORAGE_USAGE_RECONCILE_ENABLED", "true").lower() == "true"
+    STORAGE_USAGE_RECONCILE_INTERVAL = float(os.environ.get("STORAGE_USAGE_RECONCILE_INTERVAL", 6 * 3600))
+
+    # ========== 文档版本 ==========
+    # 每个文档最多保留的历史版本数（0 = 不限制）；超出的旧版本对象交给删除队列
+    DOCUMENT_VERSION_KEEP = int(os.environ.get("DOCUMENT_VERSION_KEEP", 20))
+
+    # ========== 缩略图 / 预览图 ==========
+    RENDITION_ENABLED = os.environ.get("RENDITION_ENABLED", "true").lower() == "true"
+    RENDITION_WORKERS = int(os.environ.get("RENDITION_WORKERS", 2))  # 进程池大小（全局只有一个消费进程）
+    # 取出后超过这个时间还没完成，认为消费进程已挂，任务放回队列（秒）
+    RENDITION_VISIBILITY_TIMEOUT = float(os.environ.get("RENDITION_VISIBILITY_TIMEOUT", 600))
+    RENDITION_THUMB_SIZE = int(os.environ.get("RENDITION_THUMB_SIZE", 256))
+    RENDITION_PREVIEW_SIZE = int(os.environ.get("RENDITION_PREVIEW_SIZE", 1024))
     YOUTUBE_DOWNLOAD_DIR = os.environ.get(
         "YOUTUBE_DOWNLOAD_DIR",
         os.path.join(os.getcwd(), "downloads", "youtube")
     )
     os.makedirs(YOUTUBE_DOWNLOAD_DIR, exist_ok=True)
     PROXY_URL= os.environ.get("PROXY_URL")
+    # 下载任务队列：embedded = Web 进程内起下载线程；external = 由 youtube_worker.py 独立进程消费
+    YOUTUBE_WORKER_MODE = os.environ.get("YOUTUBE_WORKER_MODE", "embedded").lower()
+    YOUTUBE_MAX_CONCURRENCY = int(os.environ.get("YOUTUBE_MAX_CONCURRENCY", 2))   # 全局同时下载数
+    YOUTUBE_WORKER_THREADS = int(os.environ.get("YOUTUBE_WORKER_THREADS", 0))     # 每进程线程数，0 = 同全局并发
+    YOUTUBE_PROGRESS_INTERVAL = float(os.environ.get("YOUTUBE_PROGRESS_INTERVAL", 1.0))  # 进度写 Redis 的最小间隔（秒）
+    # 任务租约：心跳每 20 秒续期，超过租约时间没续期视为 worker 已挂，恢复巡检放回队列续传
+    YOUTUBE_TASK_LEASE_SECONDS = int(os.environ.get("YOUTUBE_TASK_LEASE_SECONDS", 60))
+    YOUTUBE_TASK_MAX_ATTEMPTS = int(os.environ.get("YOUTUBE_TASK_MAX_ATTEMPTS", 3))
+    # 下载目录容量上限（字节，0 = 不限制）；超出时按最近访问时间淘汰整个 <video_id> 目录
+    YOUTUBE_DISK_QUOTA_BYTES = int(os.environ.get("YOUTUBE_DISK_QUOTA_BYTES", 0))
+    YOUTUBE_DOWNLOAD_RESERVE_BYTES = int(os.environ.get("YOUTUBE_DOWNLOAD_RESERVE_BYTES", 1024 ** 3))  # 每个新下载预留空间
+    # /api/youtube/download 的出流方式：send_file（Flask 出流，支持 Range）/ accel（X-Accel-Redirect 交给 nginx）
+    YOUTUBE_DOWNLOAD_SERVE_MODE = os.environ.get("YOUTUBE_DOWNLOAD_SERVE_MODE", "send_file").lower()
+    YOUTUBE_ACCEL_LOCATION = os.environ.get("YOUTUBE_ACCEL_LOCATION", "/_youtube_accel")
+    # probe 结果缓存时间（秒）；info 里的流地址几小时后失效，不要设太长
+    YOUTUBE_PROBE_TTL = int(os.environ.get("YOUTUBE_PROBE_TTL", 1800))
+    # 下载引擎参数档位（yt-dlp 参数名），创建任务时可按 profile 选择；
+    # 环境变量 YOUTUBE_DOWNLOAD_PROFILES 传 JSON 覆盖 / 新增档位
+    YOUTUBE_DOWNLOAD_PROFILES = {
+        "default": {"concurrent_fragment_downloads": 4, "http_chunk_size": 10 * 1024 * 1024, "buffersize": 1024 * 1024},
+        "fast": {"concurrent_fragment_downloads": 8, "http_chunk_size": 10 * 1024 * 1024, "buffersize": 4 * 1024 * 1024},
+        "gentle": {"concurrent_fragment_downloads": 1, "ratelimit": 2 * 1024 * 1024},   # 限速 2MB/s，不抢代理带宽
+        **json.loads(os.environ.get("YOUTUBE_DOWNLOAD_PROFILES") or "{}"),
+    }
+    YOUTUBE_DOWNLOAD_PROFILE = os.environ.get("YOUTUBE_DOWNLOAD_PROFILE", "default")
+    # 下载完成后转存 MinIO 并登记 Document；DELETE_LOCAL=true 时转存成功立即删除本地目录（否则交给 LRU 淘汰）
+    YOUTUBE_MINIO_OFFLOAD = os.environ.get("YOUTUBE_MINIO_OFFLOAD", "false").lower() == "true"
+    YOUTUBE_MINIO_DELETE_LOCAL = os.environ.get("YOUTUBE_MINIO_DELETE_LOCAL", "false").lower() == "true"
+    # 批量下载：每个批次同时排队 / 下载的子任务数；单次最多展开的视频数
+    YOUTUBE_BATCH_CONCURRENCY = int(os.environ.get("YOUTUBE_BATCH_CONCURRENCY", 2))
+    YOUTUBE_BATCH_MAX_ITEMS = int(os.environ.get("YOUTUBE_BATCH_MAX_ITEMS", 500))
     MINIO_INTERNAL_ENDPOINT =os.environ.get("MINIO_INTERNAL_ENDPOINT")
     MINIO_PUBLIC_PREFIX=os.environ.get("MINIO_PUBLIC_PREFIX")
 
@@ -2,7 +2,7 @@
 from backend.app.extensions import db
 
 from .user import User
-from .document import Document
+from .document import Document, DocumentVersion
 from .kb_models import KbFolder,KbFile,KbTag,KbFileTag
 from .menu import Menu
 
@@ -11,6 +11,7 @@ __all__ = [
     "db",
     "User",
     "Document",
+    "DocumentVersion",
     "KbFolder",
     "KbFile",
     "KbTag",
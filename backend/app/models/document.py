@@ -78,3 +78,42 @@ class Document(db.Model):
 
     def __repr__(self):
         return f"<Document id={self.id} name={self.file_name}>"
+
+
+class DocumentVersion(db.Model):
+    """
+    文档历史版本：每次保存 / 重新上传都写一个新对象，这里只记元数据
+    恢复版本 = 把 Document 指回旧对象，不复制文件
+    """
+    __tablename__ = "t_document_versions"
+    __table_args__ = (
+        db.UniqueConstraint("document_id", "version_no", name="uk_document_version"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    document_id = db.Column("document_id", db.BigInteger, nullable=False, index=True)
+    version_no = db.Column("version_no", db.Integer, nullable=False)
+
+    # 该版本对应的 MinIO 对象
+    file_name = db.Column("file_name", db.String(255))
+    bucket = db.Column("bucket", db.String(128))
+    object_key = db.Column("object_key", db.String(512), nullable=False)
+    content_type = db.Column("content_type", db.String(255))
+    size = db.Column("size", db.BigInteger)
+    sha256 = db.Column("sha256", db.String(64))
+
+    # OnlyOffice changesurl 的修改记录压缩包（可选）
+    changes_key = db.Column("changes_key", db.String(512))
+    changes_size = db.Column("changes_size", db.BigInteger)
+
+    # upload / onlyoffice
+    source = db.Column("source", db.String(32))
+    created_by = db.Column("created_by", db.String(64))
+    created_at = db.Column(
+        "created_at",
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    def __repr__(self):
+        return f"<DocumentVersion doc={self.document_id} v={self.version_no}>"
@@ -13,8 +13,10 @@ from ..models.document import Document, DocumentStatus, FileType
 from ..utils.minio_storage import (
     generate_presigned_upload_url,
     generate_presigned_download_url,
-    delete_object,
+    stat_object,
 )
+from . import onlyoffice_config_cache, onlyoffice_service
+from .storage import conversion_service, delete_queue, rendition_service, usage_service, version_service
 from ..models.result import ResponseTemplate
 from ..exceptions.exceptions import CustomAPIException
 
@@ -123,9 +125,24 @@ def confirm_upload():
         # 可以选择直接 return success，不抛错；这里按 Java 逻辑抛异常
         raise CustomAPIException("Document status is not UPLOADING, cannot confirm.", 400)
 
+    # 以 MinIO 里的真实大小为准（前端上报的 size 可能不准），取不到就沿用原值
+    try:
+        doc.size = stat_object(doc.bucket, doc.object_key).size
+    except Exception as e:
+        logger.warning(f"[Document] stat after upload failed | id={doc.id} | error={repr(e)}")
+
     doc.status = DocumentStatus.COMPLETED
+    # 新上传是 v1；更新上传（prepare_update_upload）时旧对象已补记为历史版本
+    version_service.record_version(doc, "upload")
     db.session.commit()
 
+    usage_service.record_added(doc.object_key, doc.size)
+    version_service.apply_retention(doc)
+    onlyoffice_config_cache.invalidate(doc.id)
+
+    # 缩略图 / 预览图异步生成，不阻塞确认
+    rendition_service.enqueue_rendition(doc)
+
     return ResponseTemplate.success(message="确认上传成功")
 
 
@@ -161,6 +178,35 @@ def generate_download_url(document_id: int):
     )
 
 
+def convert_document(document_id: int):
+    """
+    POST /api/file/<int:document_id>/convert
+    Request JSON: { "format": "pdf" }（也可放在 query string）
+    受理转换后立即返回；同一版本已转换过的直接返回预签名 URL
+    """
+    doc = Document.query.get(document_id)
+    if not doc:
+        raise CustomAPIException(f"Document not found: {document_id}", 404)
+
+    data = request.get_json(silent=True) or {}
+    fmt = data.get("format") or request.args.get("format", "pdf")
+    result = conversion_service.convert_document(doc, fmt, request=request)
+    return ResponseTemplate.success(data=result)
+
+
+def get_conversion(document_id: int):
+    """
+    GET /api/file/<int:document_id>/convert?format=pdf
+    查询转换进度（只读，不触发转换）
+    """
+    doc = Document.query.get(document_id)
+    if not doc:
+        raise CustomAPIException(f"Document not found: {document_id}", 404)
+
+    result = conversion_service.get_conversion(doc, request.args.get("format", "pdf"), request=request)
+    return ResponseTemplate.success(data=result)
+
+
 def delete_document(document_id: int):
     """
     DELETE /api/file/<int:document_id>
@@ -171,19 +217,131 @@ def delete_document(document_id: int):
 
     # TODO: 权限校验
 
-    # 先删 MinIO 对象（按 Java 逻辑）
-    try:
-        delete_object(bucket=doc.bucket, object_key=doc.object_key)
-    except Exception:
-        # 这里你可以记 log，然后继续软删除
-        pass
+    # MinIO 对象（含历史版本）交给删除队列异步批量删除，请求不再等 MinIO（失败会重试并记日志）
+    # 当前对象：有人还在 OnlyOffice 里编辑时由删除队列推迟删除（不在请求里调 Document Server）
+    delete_queue.schedule_delete(doc.bucket, doc.object_key, editing_key=onlyoffice_service.document_key(doc))
+    for key in version_service.drop_versions(doc):
+        delete_queue.schedule_delete(doc.bucket, key)
+    rendition_service.drop_renditions(doc)
+    conversion_service.drop_conversions(doc)
+
+    # 只有确认过的对象才计入过用量
+    if doc.status == DocumentStatus.COMPLETED:
+        usage_service.record_removed(doc.object_key, doc.size)
 
     # 软删：改状态
     doc.status = DocumentStatus.DELETED
     db.session.commit()
+    onlyoffice_config_cache.invalidate(doc.id)
 
     return ResponseTemplate.success(message="删除成功")
 
+def list_versions(document_id: int):
+    """
+    GET /api/file/<int:document_id>/versions
+    """
+    doc = Document.query.get(document_id)
+    if not doc:
+        raise CustomAPIException(f"Document not found: {document_id}", 404)
+
+    items = [
+        {
+            "versionNo": v.version_no,
+            "fileName": v.file_name,
+            "size": v.size,
+            "sha256": v.sha256,
+            "source": v.source,
+            "createdBy": v.created_by,
+            "createdAt": v.created_at,
+            "hasChanges": bool(v.changes_key),
+            "current": v.object_key == doc.object_key,
+        }
+        for v in version_service.list_versions(doc.id)
+    ]
+    return ResponseTemplate.success(data={"items": items})
+
+
+def restore_version(document_id: int, version_no: int):
+    """
+    POST /api/file/<int:document_id>/versions/<int:version_no>/restore
+    ?force=true → 跳过“正在编辑”检查
+    只把 Document 指回该版本的对象，不复制文件
+    """
+    doc = Document.query.get(document_id)
+    if not doc:
+        raise CustomAPIException(f"Document not found: {document_id}", 404)
+    if doc.status != DocumentStatus.COMPLETED:
+        raise CustomAPIException("Document is not ready", 400)
+
+    version = version_service.get_version(doc.id, version_no)
+    if not version:
+        raise CustomAPIException(f"Version not found: {version_no}", 404)
+    if version.object_key == doc.object_key:
+        return ResponseTemplate.success(message="已是当前版本")
+
+    # 编辑中恢复会被 Document Server 下一次保存覆盖掉
+    if request.args.get("force", "false").lower() != "true":
+        if onlyoffice_service.check_online([doc]).get(doc.id):
+            raise CustomAPIException("文档正在编辑中，无法恢复版本", 409)
+
+    version_service.restore_version(doc, version)
+    db.session.commit()
+
+    onlyoffice_config_cache.invalidate(doc.id)
+    rendition_service.enqueue_rendition(doc)
+    return ResponseTemplate.success(message="恢复成功")
+
+
+def get_renditions():
+    """
+    GET /api/file/renditions?ids=1,2,3
+    列表页批量获取缩略图 / 预览图：
+    {
+      "1": {"status": "ready", "thumbnailUrl": "...", "previewUrl": "..."},
+      "2": {"status": "pending"}
+    }
+    """
+    raw_ids = (request.args.get("ids") or "").strip()
+    if not raw_ids:
+        raise CustomAPIException("ids 不能为空", 400)
+
+    try:
+        ids = [int(x) for x in raw_ids.split(",") if x.strip()]
+    except ValueError:
+        raise CustomAPIException("Invalid ids", 400)
+    if len(ids) > 100:
+        raise CustomAPIException("一次最多查询 100 个文件", 400)
+
+    docs = Document.query.filter(Document.id.in_(ids)).all()
+    data = {
+        str(doc.id): rendition_service.describe_renditions(doc, request)
+        for doc in docs
+    }
+    return ResponseTemplate.success(data=data)
+
+
+def get_storage_usage():
+    """
+    GET /api/file/usage?fileType=DRAWING&businessId=xxx
+    按 fileType / businessId 返回字节数和对象数（Redis 计数，定期与 MinIO 对账）
+    两个参数都可省略，省略时返回所有匹配前缀及合计
+    """
+    file_type = (request.args.get("fileType") or "").strip() or None
+    business_id = (request.args.get("businessId") or "").strip() or None
+    if business_id and not file_type:
+        raise CustomAPIException("指定 businessId 时 fileType 不能为空", 400)
+
+    return ResponseTemplate.success(data=usage_service.get_usage(file_type, business_id))
+
+
+def get_delete_queue_stats():
+    """
+    GET /api/file/delete-queue/stats
+    删除队列监控：深度、死信数量、队头等待时长
+    """
+    return ResponseTemplate.success(data=delete_queue.get_queue_stats())
+
+
 def prepare_update_upload():
     """
     POST /api/file/update/prepare
@@ -214,13 +372,14 @@ def prepare_update_upload():
     date_path = datetime.now().strftime("%Y/%m/%d")
     uid = str(uuid.uuid4())
 
-    file_type = doc.file_type or "default"
-    business_id = doc.business_id or "noBiz"
+    # Document 上没有 businessId 字段，从原 objectKey 的前两段取
+    file_type, business_id = usage_service.prefix_of(doc.object_key)
 
     new_object_key = f"{file_type}/{business_id}/{date_path}/{uid}_{safe_filename}"
 
-    # 记录旧 objectKey（如果以后想 confirm 时顺便删老文件，可以加字段）
+    # 旧对象保留为历史版本（版本功能上线前的文档先补记 v1）
     old_object_key = doc.object_key
+    version_service.ensure_baseline(doc)
 
     # 更新 Document
     doc.object_key = new_object_key
@@ -229,6 +388,7 @@ def prepare_update_upload():
     doc.size = data.get("size")
     doc.status = DocumentStatus.UPLOADING
     db.session.commit()
+    onlyoffice_config_cache.invalidate(doc.id)
 
     upload_url = generate_presigned_upload_url(
         bucket=doc.bucket,
@@ -0,0 +1,112 @@
+# app/services/onlyoffice_command.py
+"""
+OnlyOffice CommandService 调用封装（info / forcesave / drop ...）
+
+- 进程内共用一个带连接池的 requests.Session，避免每次命令都重新建连
+- 请求体按 Document Server 要求 JWT 签名（body.token + Authorization 头）
+- send_batch 用线程池并发对多个 document key 执行同一命令
+- 与 onlyoffice_convert 一样不依赖 Flask current_app，配置由调用方传入
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional
+
+import jwt as pyjwt
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# https://api.onlyoffice.com/editors/command/#error-codes
+COMMAND_ERRORS = {
+    0: "No errors",
+    1: "Document key is missing or no document with such key could be found",
+    2: "Callback url not correct",
+    3: "Internal server error",
+    4: "No changes were applied to the document before the forcesave command was received",
+    5: "Command not correct",
+    6: "Invalid token",
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _get_session(pool_size: int = 32) -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def send_command(
+    command_url: str,
+    jwt_secret: Optional[str],
+    c: str,
+    key: Optional[str] = None,
+    *,
+    timeout: float = 10,
+    **extra: Any,
+) -> Dict[str, Any]:
+    """
+    执行一条命令，返回 Document Server 的原始响应 {"error": int, "key": str, ...}
+    error 非 0 不抛异常（例如 info 返回 1 只表示没人打开），由调用方按命令语义判断；
+    网络 / HTTP 错误照常抛出
+    """
+    body: Dict[str, Any] = {"c": c}
+    if key:
+        body["key"] = key
+    body.update(extra)
+
+    headers = {"Accept": "application/json"}
+    if jwt_secret:
+        token = pyjwt.encode(dict(body), jwt_secret, algorithm="HS256")
+        if isinstance(token, (bytes, bytearray)):
+            token = token.decode("utf-8")
+        body["token"] = token
+        headers["Authorization"] = f"Bearer {token}"
+
+    resp = _get_session().post(command_url, json=body, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.json()
+
+    error = data.get("error", 0)
+    if error not in (0, 1, 4):
+        logger.error(
+            f"[OnlyOffice] command failed | c={c} | key={key} | error={error} | {COMMAND_ERRORS.get(error, 'Unknown error')}"
+        )
+    return data
+
+
+def send_batch(
+    command_url: str,
+    jwt_secret: Optional[str],
+    c: str,
+    keys: Iterable[str],
+    *,
+    timeout: float = 10,
+    max_workers: int = 8,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    对多个 key 并发执行同一命令，返回 {key: 响应}；单个 key 出错记为 {"error": -1, "message": ...}
+    """
+    keys = list(dict.fromkeys(k for k in keys if k))
+    if not keys:
+        return {}
+
+    def _one(key: str) -> Dict[str, Any]:
+        try:
+            return send_command(command_url, jwt_secret, c, key, timeout=timeout)
+        except Exception as e:
+            logger.error(f"[OnlyOffice] command request failed | c={c} | key={key} | error={repr(e)}")
+            return {"error": -1, "key": key, "message": str(e)}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as pool:
+        return dict(zip(keys, pool.map(_one, keys)))
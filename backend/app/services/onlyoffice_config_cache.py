@@ -0,0 +1,93 @@
+# app/services/onlyoffice_config_cache.py
+"""
+已签名的 OnlyOffice 编辑器配置缓存
+
+- 缓存维度：文档 id + _doc_key + 用户 id + mode
+- 存储：hash oo_editor_cfg:<doc_id>:<gen>，field = "<user_id>:<mode>"，value = {"docKey", "config"}
+- 文档被保存 / 覆盖 / 删除时 INCR oo_editor_cfg:gen:<doc_id>，旧 hash 不再被读到，随 TTL 过期
+  （用代次而不是直接删 hash：并发生成配置的请求晚于失效写入时，只会写进旧代次）
+- Redis 不可用时只记日志，调用方照常现算
+"""
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from flask import current_app
+
+from .. import extensions
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "oo_editor_cfg:"
+GEN_KEY_PREFIX = "oo_editor_cfg:gen:"
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _gen_key(doc_id: int) -> str:
+    return f"{GEN_KEY_PREFIX}{doc_id}"
+
+
+def _cache_key(doc_id: int, gen: str) -> str:
+    return f"{CACHE_KEY_PREFIX}{doc_id}:{gen}"
+
+
+def lookup(
+    doc_id: int, user_id: str, mode: str, doc_key: Optional[str] = None
+) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    返回 (config, gen)；未命中时 config 为 None，gen 留给 store 使用
+    doc_key：调用方算出的当前 document key，缓存里的不一致也按未命中处理
+    """
+    if not _cfg("ONLYOFFICE_EDITOR_CONFIG_CACHE", True):
+        return None, ""
+    try:
+        r = _get_redis()
+        gen = r.get(_gen_key(doc_id)) or "0"
+        raw = r.hget(_cache_key(doc_id, gen), f"{user_id}:{mode}")
+        if raw:
+            entry = json.loads(raw)
+            if doc_key is None or entry.get("docKey") == doc_key:
+                return entry["config"], gen
+        return None, gen
+    except Exception as e:
+        logger.error(f"[OnlyOfficeConfigCache] lookup failed | doc_id={doc_id} | error={repr(e)}")
+        return None, ""
+
+
+def store(doc_id: int, gen: str, user_id: str, mode: str, doc_key: str, config: Dict[str, Any]) -> None:
+    if not gen:
+        return
+    try:
+        r = _get_redis()
+        key = _cache_key(doc_id, gen)
+        ttl = int(_cfg("ONLYOFFICE_EDITOR_CONFIG_TTL", 3600))
+        pipe = r.pipeline()
+        pipe.hset(key, f"{user_id}:{mode}", json.dumps({"docKey": doc_key, "config": config}))
+        pipe.expire(key, ttl)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"[OnlyOfficeConfigCache] store failed | doc_id={doc_id} | error={repr(e)}")
+
+
+def invalidate(doc_id: int) -> None:
+    """文档内容 / 元数据变化后调用（在 commit 之后）"""
+    try:
+        r = _get_redis()
+        pipe = r.pipeline()
+        pipe.incr(_gen_key(doc_id))
+        pipe.expire(_gen_key(doc_id), 30 * 24 * 3600)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"[OnlyOfficeConfigCache] invalidate failed | doc_id={doc_id} | error={repr(e)}")
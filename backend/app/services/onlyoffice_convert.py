@@ -0,0 +1,80 @@
+# app/services/onlyoffice_convert.py
+"""
+OnlyOffice ConvertService 调用封装
+
+不依赖 Flask current_app，参数全部显式传入，方便在进程池子进程里使用。
+"""
+import logging
+from typing import Any, Dict, Optional
+
+import jwt as pyjwt
+import requests
+
+logger = logging.getLogger(__name__)
+
+# https://api.onlyoffice.com/editors/conversionapi#error
+CONVERT_ERRORS = {
+    -1: "Unknown error",
+    -2: "Conversion timeout error",
+    -3: "Conversion error",
+    -4: "Error while downloading the document file to be converted",
+    -5: "Incorrect password",
+    -6: "Error while accessing the conversion result database",
+    -7: "Input error",
+    -8: "Invalid token",
+}
+
+
+def request_conversion(
+    convert_url: str,
+    jwt_secret: Optional[str],
+    *,
+    key: str,
+    url: str,
+    filetype: str,
+    outputtype: str,
+    title: Optional[str] = None,
+    thumbnail: Optional[Dict[str, Any]] = None,
+    is_async: bool = False,
+    timeout: float = 120,
+    session: Optional[requests.Session] = None,
+) -> Dict[str, Any]:
+    """
+    向 Document Server 提交一次转换请求
+
+    - key 相同的请求 Document Server 会复用转换结果，异步模式下重复提交即为“查询进度”
+    - 返回 {"endConvert": bool, "percent": int, "fileUrl": str, "fileType": str}
+    - Document Server 返回 error 时抛 RuntimeError
+    """
+    body: Dict[str, Any] = {
+        "async": is_async,
+        "filetype": filetype,
+        "key": key,
+        "outputtype": outputtype,
+        "url": url,
+    }
+    if title:
+        body["title"] = title
+    if thumbnail:
+        body["thumbnail"] = thumbnail
+
+    headers = {"Accept": "application/json"}
+    if jwt_secret:
+        token = pyjwt.encode(dict(body), jwt_secret, algorithm="HS256")
+        if isinstance(token, (bytes, bytearray)):
+            token = token.decode("utf-8")
+        body["token"] = token
+        headers["Authorization"] = f"Bearer {token}"
+
+    http = session or requests
+    resp = http.post(convert_url, json=body, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.json()
+
+    error = data.get("error")
+    if error:
+        message = CONVERT_ERRORS.get(error, "Unknown error")
+        logger.error(f"[OnlyOffice] convert failed | key={key} | error={error} | {message}")
+        raise RuntimeError(f"OnlyOffice convert failed: {error} {message}")
+
+    return data
@@ -0,0 +1,417 @@
+# app/services/onlyoffice_save_service.py
+"""
+OnlyOffice 保存回调的异步处理
+
+- 回调收到 status 2/6 后只把任务写进 Redis 队列，立即回 {"error": 0}
+- 后台线程用 BLMOVE 把任务从 queue 挪到 processing（可靠队列），执行下载 + 上传 MinIO + 更新 Document
+- 成功/失败都写入 oo_save:result:<doc_id>；进程在处理中途挂掉时，
+  processing 里超过可见性超时的任务会被挪回队列重新执行
+- 每次保存写到新的 objectKey 并记一条版本记录（见 storage/version_service）
+- autosave 会反复发同样的 status 6：按 key + changesurl（没有则用 history/url）做指纹去重，
+  指纹在任务入队成功后才记下（和入队在同一个 Lua 脚本里）
+- 同一文档的保存用 Redis 锁串行执行（同步兜底也拿同一把锁）；拿不到锁的任务挂到该文档的
+  等待列表，持锁方做完后按顺序放回队头
+- 每个任务入队时领一个文档内递增的序号，保存成功后记下已保存的最大序号；
+  重试 / 超时重跑的旧任务落在更新的保存之后时直接丢弃，不会用旧内容覆盖新内容
+"""
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from flask import current_app
+from redis.exceptions import LockError, RedisError
+
+from ..models.document import Document, DocumentStatus
+from ..utils import minio_storage
+from ..utils.background import start_background_worker
+from ..extensions import db
+from . import onlyoffice_config_cache
+from .storage import delete_queue, usage_service, version_service
+from .. import extensions
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "oo_save:queue"                 # LPUSH 入队，从右侧取（FIFO）
+PROCESSING_KEY = "oo_save:processing"       # 已取出、正在处理的任务
+CLAIMS_KEY = "oo_save:claims"               # hash：job_id -> 取出时间，用于判断处理超时
+DEAD_KEY = "oo_save:dead"                   # 重试多次仍失败的任务
+RESULT_KEY_PREFIX = "oo_save:result:"       # hash：每个文档最近一次保存的结果
+RESULT_TTL_SECONDS = 7 * 24 * 3600
+LAST_SWEEP_KEY = "oo_save:last_sweep"
+SEEN_KEY_PREFIX = "oo_save:seen:"           # 已受理过的回调指纹
+SEEN_TTL_SECONDS = 24 * 3600
+LOCK_KEY_PREFIX = "oo_save:lock:"           # 每个文档一把锁，保存串行执行
+PARKED_KEY_PREFIX = "oo_save:parked:"       # list：拿不到文档锁、等待前一个保存完成的任务
+PARKED_DOCS_KEY = "oo_save:parked_docs"     # set：有等待任务的文档
+SEQ_KEY = "oo_save:seq"                     # hash：doc_id -> 已分配的最大序号
+SAVED_SEQ_KEY = "oo_save:saved_seq"         # hash：doc_id -> 已保存的最大序号
+
+# 原子地：指纹没见过才分配序号、入队，入队后再记指纹；返回序号，重复回调返回 0
+_ENQUEUE_SCRIPT = """
+if redis.call('exists', KEYS[2]) == 1 then
+    return 0
+end
+local job = cjson.decode(ARGV[1])
+job['seq'] = redis.call('hincrby', KEYS[3], ARGV[2], 1)
+redis.call('lpush', KEYS[1], cjson.encode(job))
+redis.call('set', KEYS[2], 1, 'EX', ARGV[3])
+return job['seq']
+"""
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _result_key(doc_id: int) -> str:
+    return f"{RESULT_KEY_PREFIX}{doc_id}"
+
+
+def _seen_key(doc_id: int, fingerprint: str) -> str:
+    return f"{SEEN_KEY_PREFIX}{doc_id}:{fingerprint}"
+
+
+def _lock_key(doc_id: int) -> str:
+    return f"{LOCK_KEY_PREFIX}{doc_id}"
+
+
+def _parked_key(doc_id: int) -> str:
+    return f"{PARKED_KEY_PREFIX}{doc_id}"
+
+
+def _fingerprint(payload: Dict[str, Any]) -> str:
+    """
+    同一次修改的回调指纹：document key + changesurl
+    没有 changesurl 时退回 history（含 serverVersion / changes）或文件 url
+    """
+    version = payload.get("changesurl")
+    if not version:
+        history = payload.get("history")
+        version = json.dumps(history, sort_keys=True) if history else payload.get("url") or ""
+    base = f"{payload.get('key') or ''}|{version}"
+    return hashlib.sha1(base.encode("utf-8")).hexdigest()
+
+
+def save_document_from_url(
+    doc: Document,
+    url: str,
+    changes_url: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Tuple[int, str]:
+    """
+    把 Document Server 上编辑好的文件流式写到新的 objectKey（旧对象保留为历史版本），
+    更新 Document 并记一条版本记录；返回 (size, sha256)
+    """
+    new_key = version_service.new_object_key(doc)
+    size, sha256 = minio_storage.upload_from_url(url, doc.bucket, new_key, doc.content_type)
+
+    try:
+        # 上传完再补记 v1 / 分配版本号：Document 行锁只在这段短事务里持有
+        version_service.ensure_baseline(doc)
+        doc.object_key = new_key
+        doc.size = size
+        doc.updated_at = datetime.now()
+        if doc.status != DocumentStatus.COMPLETED:
+            doc.status = DocumentStatus.COMPLETED
+        version = version_service.record_version(doc, "onlyoffice", sha256=sha256, created_by=user_id)
+        db.session.commit()
+    except Exception:
+        # 元数据没写进去，新对象就是孤儿：交给删除队列
+        db.session.rollback()
+        delete_queue.schedule_delete(doc.bucket, new_key)
+        raise
+
+    usage_service.record_added(new_key, size)
+    version_service.apply_retention(doc)
+    # _doc_key 随 updated_at / size 变化，已缓存的编辑器配置作废
+    onlyoffice_config_cache.invalidate(doc.id)
+
+    if changes_url and _cfg("ONLYOFFICE_STORE_CHANGES", False):
+        version_service.store_changes(doc, version, changes_url)
+    return size, sha256
+
+
+def enqueue_save(doc_id: int, payload: Dict[str, Any]) -> Optional[str]:
+    """
+    回调入口：把保存任务写进队列，返回 job_id
+    同样的回调（指纹相同）已经受理过则直接忽略，返回 None
+    """
+    r = _get_redis()
+    fingerprint = _fingerprint(payload)
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "doc_id": doc_id,
+        "url": payload.get("url"),
+        "key": payload.get("key"),
+        "status": payload.get("status"),
+        "changesurl": payload.get("changesurl"),
+        "user_id": (payload.get("users") or [None])[0],
+        "fingerprint": fingerprint,
+        "enqueued_at": time.time(),
+        "attempts": 0,
+    }
+    seq = r.eval(
+        _ENQUEUE_SCRIPT, 3, QUEUE_KEY, _seen_key(doc_id, fingerprint), SEQ_KEY,
+        json.dumps(job), doc_id, SEEN_TTL_SECONDS,
+    )
+    if not seq:
+        logger.info(f"[OnlyOfficeSave] SKIP duplicate callback | doc_id={doc_id} | fingerprint={fingerprint}")
+        return None
+
+    pipe = r.pipeline()
+    pipe.hset(_result_key(doc_id), mapping={"job_id": job["job_id"], "state": "queued", "enqueued_at": job["enqueued_at"]})
+    pipe.expire(_result_key(doc_id), RESULT_TTL_SECONDS)
+    pipe.execute()
+    logger.info(
+        f"[OnlyOfficeSave] ENQUEUE | doc_id={doc_id} | job_id={job['job_id']} | seq={seq} | status={job['status']}"
+    )
+    return job["job_id"]
+
+
+def _record_result(job: Dict[str, Any], state: str, **fields) -> None:
+    r = _get_redis()
+    mapping = {
+        "job_id": job["job_id"],
+        "state": state,
+        "attempts": job.get("attempts", 0),
+        "finished_at": time.time(),
+        "error": "",
+    }
+    mapping.update({k: v for k, v in fields.items() if v is not None})
+    pipe = r.pipeline()
+    pipe.hset(_result_key(job["doc_id"]), mapping=mapping)
+    pipe.expire(_result_key(job["doc_id"]), RESULT_TTL_SECONDS)
+    pipe.execute()
+
+
+def _finish(raw: str, job: Dict[str, Any]) -> None:
+    r = _get_redis()
+    pipe = r.pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.hdel(CLAIMS_KEY, job["job_id"])
+    pipe.execute()
+
+
+def _is_stale(doc_id: int, seq: Optional[int]) -> bool:
+    """序号不大于已保存的最大序号：更新的内容已经落盘（升级前入队的任务没有序号，照常执行）"""
+    if not seq:
+        return False
+    saved = _get_redis().hget(SAVED_SEQ_KEY, doc_id)
+    return saved is not None and int(seq) <= int(saved)
+
+
+def _mark_saved(doc_id: int, seq: Optional[int]) -> None:
+    # 调用方持有文档锁，且已确认 seq 比已保存的新
+    if seq:
+        _get_redis().hset(SAVED_SEQ_KEY, doc_id, int(seq))
+
+
+def _handle_job(job: Dict[str, Any]) -> None:
+    # 同一份修改已经保存过（例如超时被重新入队的任务），不再重复下载覆盖
+    last = _get_redis().hmget(_result_key(job["doc_id"]), "state", "fingerprint")
+    if last[0] == "saved" and job.get("fingerprint") and last[1] == job["fingerprint"]:
+        logger.info(f"[OnlyOfficeSave] SKIP already saved | doc_id={job['doc_id']} | job_id={job['job_id']}")
+        return
+    # 重试中的旧保存晚于更新的保存：丢弃
+    if _is_stale(job["doc_id"], job.get("seq")):
+        logger.info(
+            f"[OnlyOfficeSave] SKIP superseded | doc_id={job['doc_id']} | job_id={job['job_id']} | seq={job.get('seq')}"
+        )
+        return
+
+    doc = Document.query.get(job["doc_id"])
+    if not doc:
+        raise RuntimeError(f"Document not found: {job['doc_id']}")
+    # 编辑期间文档已被删除：不再写回，避免把删掉的文档又存出一个新对象
+    if doc.status == DocumentStatus.DELETED:
+        logger.info(f"[OnlyOfficeSave] SKIP deleted | doc_id={doc.id} | job_id={job['job_id']}")
+        return
+
+    size, sha256 = save_document_from_url(doc, job["url"], job.get("changesurl"), job.get("user_id"))
+    _mark_saved(doc.id, job.get("seq"))
+    _record_result(job, "saved", size=size, sha256=sha256, fingerprint=job.get("fingerprint"))
+    logger.info(
+        f"[OnlyOfficeSave] SAVED | doc_id={doc.id} | job_id={job['job_id']} | size={size} | sha256={sha256}"
+    )
+
+
+def process_one() -> bool:
+    """
+    worker 循环体：阻塞最多 5 秒等一个任务，处理完返回 True
+    """
+    _requeue_stale_if_due()
+
+    r = _get_redis()
+    raw = r.blmove(QUEUE_KEY, PROCESSING_KEY, 5, "RIGHT", "LEFT")
+    if not raw:
+        return False
+
+    job = json.loads(raw)
+    if job.get("not_before", 0) > time.time():
+        # 还在重试退避期：放回队尾，本轮让 worker 歇一下
+        r.lpush(QUEUE_KEY, raw)
+        r.lrem(PROCESSING_KEY, 1, raw)
+        return False
+
+    # 同一文档同时只允许一个保存在执行；拿不到锁就挂到该文档的等待列表，
+    # 持锁方做完后按到达顺序放回队头（不计入重试次数，也不堵住其他文档）
+    timeout = float(_cfg("ONLYOFFICE_SAVE_VISIBILITY_TIMEOUT", 900))
+    lock = r.lock(_lock_key(job["doc_id"]), timeout=timeout)
+    if not lock.acquire(blocking=False):
+        pipe = r.pipeline()
+        pipe.rpush(_parked_key(job["doc_id"]), raw)
+        pipe.sadd(PARKED_DOCS_KEY, job["doc_id"])
+        pipe.lrem(PROCESSING_KEY, 1, raw)
+        pipe.execute()
+        # 挂上去之前锁可能刚好释放：自己放回去
+        if not r.exists(_lock_key(job["doc_id"])):
+            _release_parked(job["doc_id"])
+        return True
+
+    r.hset(CLAIMS_KEY, job["job_id"], time.time())
+    try:
+        _handle_job(job)
+    except Exception as e:
+        db.session.rollback()
+        job["attempts"] = int(job.get("attempts", 0)) + 1
+        max_attempts = int(_cfg("ONLYOFFICE_SAVE_MAX_ATTEMPTS", 5))
+        logger.error(
+            f"[OnlyOfficeSave] FAILED | doc_id={job['doc_id']} | job_id={job['job_id']} | "
+            f"attempts={job['attempts']} | error={repr(e)}"
+        )
+        state = "failed" if job["attempts"] >= max_attempts else "retrying"
+        job["not_before"] = time.time() + min(5 * 2 ** job["attempts"], 300)
+        _record_result(job, state, error=str(e))
+        r.lpush(DEAD_KEY if state == "failed" else QUEUE_KEY, json.dumps(job))
+        if state == "failed" and job.get("fingerprint"):
+            # 彻底失败后允许 Document Server 重发的同一回调再次受理
+            r.delete(_seen_key(job["doc_id"], job["fingerprint"]))
+    finally:
+        _finish(raw, job)
+        try:
+            lock.release()
+        except LockError:
+            pass
+        _release_parked(job["doc_id"])
+    return True
+
+
+def _release_parked(doc_id: int) -> None:
+    """把某个文档的等待任务按原顺序放回队头"""
+    r = _get_redis()
+    parked = _parked_key(doc_id)
+    # 等待列表右端是最新的；逐个挪到队列右端（队头），最早的最后挪、最先被取走
+    while r.lmove(parked, QUEUE_KEY, "RIGHT", "RIGHT"):
+        pass
+    r.srem(PARKED_DOCS_KEY, doc_id)
+    if r.llen(parked):
+        # srem 期间又有任务挂上来：留给下一次释放 / 巡检
+        r.sadd(PARKED_DOCS_KEY, doc_id)
+
+
+def _save_with_row_lock(doc: Document, payload: Dict[str, Any]) -> Tuple[int, str]:
+    """
+    Redis 不可用时的保存：拿不到 Redis 文档锁和序号，改用 Document 行锁串行
+    （行锁持有到 save_document_from_url 提交为止，包括上传这段时间）
+    """
+    locked = (
+        db.session.query(Document)
+        .filter(Document.id == doc.id)
+        .populate_existing()
+        .with_for_update()
+        .first()
+    )
+    if locked is None or locked.status == DocumentStatus.DELETED:
+        db.session.rollback()
+        return doc.size or 0, ""
+    return save_document_from_url(
+        locked, payload.get("url"), payload.get("changesurl"), (payload.get("users") or [None])[0]
+    )
+
+
+def save_now(doc: Document, payload: Dict[str, Any]) -> Tuple[int, str]:
+    """
+    同步兜底（回调里直接保存）：和后台 worker 拿同一把文档锁、用同一套序号，
+    队列里还没执行的更早的保存之后会被当作过期丢弃；
+    Redis 不可用（入队失败的常见原因）时退回 Document 行锁
+    """
+    try:
+        r = _get_redis()
+        seq = r.hincrby(SEQ_KEY, doc.id, 1)
+    except (RedisError, RuntimeError) as e:
+        logger.warning(f"[OnlyOfficeSave] redis unavailable, save under row lock | doc_id={doc.id} | error={repr(e)}")
+        return _save_with_row_lock(doc, payload)
+    timeout = float(_cfg("ONLYOFFICE_SAVE_VISIBILITY_TIMEOUT", 900))
+    with r.lock(_lock_key(doc.id), timeout=timeout, blocking_timeout=30):
+        if _is_stale(doc.id, seq) or doc.status == DocumentStatus.DELETED:
+            return doc.size or 0, ""
+        size, sha256 = save_document_from_url(
+            doc, payload.get("url"), payload.get("changesurl"), (payload.get("users") or [None])[0]
+        )
+        _mark_saved(doc.id, seq)
+    _release_parked(doc.id)
+    return size, sha256
+
+
+def _requeue_stale_if_due() -> None:
+    """
+    每分钟最多扫一次 processing：取出超过 ONLYOFFICE_SAVE_VISIBILITY_TIMEOUT 还没完成的任务
+    （说明处理它的进程已经挂了），放回队列头部优先执行
+    """
+    r = _get_redis()
+    now = time.time()
+    if not r.set(LAST_SWEEP_KEY, now, nx=True, ex=60):
+        return
+
+    timeout = float(_cfg("ONLYOFFICE_SAVE_VISIBILITY_TIMEOUT", 900))
+    for raw in r.lrange(PROCESSING_KEY, 0, -1):
+        try:
+            job = json.loads(raw)
+        except Exception:
+            r.lrem(PROCESSING_KEY, 1, raw)
+            continue
+
+        claimed_at = r.hget(CLAIMS_KEY, job["job_id"])
+        if claimed_at is None:
+            # 取出后还没来得及登记就挂了：从现在开始计时
+            r.hsetnx(CLAIMS_KEY, job["job_id"], now)
+            continue
+        if now - float(claimed_at) < timeout:
+            continue
+
+        pipe = r.pipeline()
+        pipe.lrem(PROCESSING_KEY, 1, raw)
+        pipe.hdel(CLAIMS_KEY, job["job_id"])
+        pipe.rpush(QUEUE_KEY, raw)
+        pipe.execute()
+        logger.warning(f"[OnlyOfficeSave] REQUEUE stale job | doc_id={job['doc_id']} | job_id={job['job_id']}")
+
+    # 持锁的进程挂掉时没人放回等待任务：锁已过期的文档在这里放回
+    for doc_id in r.smembers(PARKED_DOCS_KEY):
+        if not r.exists(_lock_key(doc_id)):
+            _release_parked(doc_id)
+
+
+def get_save_result(doc_id: int) -> Optional[Dict[str, Any]]:
+    data = _get_redis().hgetall(_result_key(doc_id))
+    return data or None
+
+
+def start_worker(app) -> None:
+    """在当前进程启动保存任务消费线程（create_app 时调用）"""
+    if not app.config.get("ONLYOFFICE_ASYNC_SAVE", True):
+        return
+    start_background_worker(app, "onlyoffice-save", process_one, interval=1.0)
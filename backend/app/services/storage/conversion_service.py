@@ -0,0 +1,338 @@
+# app/services/storage/conversion_service.py
+"""
+文档格式转换（导出 PDF 等），结果缓存为 MinIO 派生对象
+
+- POST 只受理：校验格式后把任务放进 Redis 队列立即返回；GET 只读索引报告进度，前端轮询 GET 即可
+- 后台线程调用 OnlyOffice ConvertService 异步模式（同一个 key 重复提交即查询进度），
+  未完成的任务稍后再放回队列；完成后把结果流式写入 conversions/<doc_id>/<document_key>.<format>
+- 取任务用 BLMOVE 移到 processing 列表，处理完才确认删除；进程挂掉留下的任务由巡检放回队头，
+  Document Server 连不上 / 超时按退避重试，直到任务截止时间后记为 failed
+- 每个文档在 Redis 里有一个 hash 索引：field = 目标格式，value = {version, status, objectKey, ...}
+  同一版本再次请求直接返回预签名 URL，不再调用 Document Server
+- 文档更新后旧版本的转换结果在新结果生成时清理；文档删除时全部清理
+"""
+import json
+import logging
+import mimetypes
+import os
+import time
+import uuid
+from datetime import timedelta
+from typing import Any, Dict
+
+import requests
+from flask import current_app
+
+from .. import onlyoffice_service
+from ...extensions import db
+from ..onlyoffice_convert import request_conversion
+from . import delete_queue
+from ...exceptions.exceptions import CustomAPIException
+from ...models.document import Document, DocumentStatus
+from ...utils import minio_storage
+from ...utils.background import start_background_worker
+from ... import extensions
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY_PREFIX = "conversion:doc:"
+QUEUE_KEY = "conversion:queue"              # LPUSH 入队，从右侧取（FIFO）
+PROCESSING_KEY = "conversion:processing"    # 已取出、正在处理的任务
+CLAIMS_KEY = "conversion:claims"            # hash：job_id -> 取出时间，用于判断处理超时
+LAST_SWEEP_KEY = "conversion:last_sweep"
+LOCK_KEY_PREFIX = "conversion:lock:"        # 每个 文档 + 格式 + 版本 同时只有一个任务
+POLL_INTERVAL_SECONDS = 2                   # 转换未完成时隔多久再查一次
+MAX_RETRY_DELAY_SECONDS = 30                # Document Server 请求失败时的最大退避
+FORCESAVE_KEY_PREFIX = "conversion:forcesave:"
+CONVERSION_PREFIX = "conversions"
+
+# documentType -> 支持导出的目标格式
+SUPPORTED_OUTPUTS = {
+    "word": {"pdf", "docx", "odt", "rtf", "txt"},
+    "cell": {"pdf", "xlsx", "ods", "csv"},
+    "slide": {"pdf", "pptx", "odp"},
+}
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _index_key(doc_id: int) -> str:
+    return f"{INDEX_KEY_PREFIX}{doc_id}"
+
+
+def _load_entry(doc_id: int, fmt: str) -> Dict[str, Any]:
+    raw = _get_redis().hget(_index_key(doc_id), fmt)
+    return json.loads(raw) if raw else {}
+
+
+def _save_entry(doc_id: int, fmt: str, entry: Dict[str, Any]) -> None:
+    entry["updatedAt"] = time.time()
+    _get_redis().hset(_index_key(doc_id), fmt, json.dumps(entry))
+
+
+def _ready_response(doc: Document, fmt: str, entry: Dict[str, Any], request=None) -> Dict[str, Any]:
+    base_name = os.path.splitext(doc.file_name or "document")[0]
+    url = minio_storage.generate_presigned_download_url(
+        bucket=doc.bucket,
+        object_key=entry["objectKey"],
+        ttl=timedelta(minutes=15),
+        download_filename=f"{base_name}.{fmt}",
+        request=request,
+    )
+    return {"status": "ready", "format": fmt, "size": entry.get("size"), "downloadUrl": url}
+
+
+def _check_format(doc: Document, fmt: str):
+    """校验源文件 / 目标格式，返回 (源扩展名, 目标格式)"""
+    if doc.status != DocumentStatus.COMPLETED:
+        raise CustomAPIException("Document is not ready", 400)
+
+    ext = os.path.splitext(doc.file_name or "")[1].lower()
+    if ext not in onlyoffice_service.ALLOWED_EXTS_MAP:
+        raise CustomAPIException(f"Unsupported source type: {ext or 'unknown'}", 400)
+    document_type, _ = onlyoffice_service.ALLOWED_EXTS_MAP[ext]
+    fmt = (fmt or "").lower().lstrip(".")
+    if fmt not in SUPPORTED_OUTPUTS[document_type] or fmt == ext.lstrip("."):
+        raise CustomAPIException(f"Unsupported target format: {fmt}", 400)
+    return ext, fmt
+
+
+def _lock_key(doc_id: int, fmt: str, version: str) -> str:
+    return f"{LOCK_KEY_PREFIX}{doc_id}:{fmt}:{version}"
+
+
+def get_conversion(doc: Document, fmt: str, request=None) -> Dict[str, Any]:
+    """
+    只读查询文档当前版本到 fmt 的转换进度，不触发转换
+    返回 {"status": "ready" | "pending" | "failed" | "none", ...}；ready 时带 downloadUrl
+    """
+    _, fmt = _check_format(doc, fmt)
+    version = onlyoffice_service.document_key(doc)
+    entry = _load_entry(doc.id, fmt)
+    if entry.get("version") != version:
+        return {"status": "none", "format": fmt}
+    if entry.get("status") == "ready":
+        return _ready_response(doc, fmt, entry, request)
+    if entry.get("status") == "failed":
+        return {"status": "failed", "format": fmt, "error": entry.get("error")}
+    if not _get_redis().exists(_lock_key(doc.id, fmt, version)):
+        # 处理它的进程挂了、任务锁已过期：需要重新 POST
+        return {"status": "none", "format": fmt}
+    return {"status": "pending", "format": fmt, "percent": entry.get("percent", 0)}
+
+
+def convert_document(doc: Document, fmt: str, request=None) -> Dict[str, Any]:
+    """
+    受理文档当前版本到 fmt 的转换：入队后立即返回，结果由后台线程生成
+    返回 {"status": "ready" | "pending" | "saving", ...}；ready 时带 downloadUrl
+    """
+    _, fmt = _check_format(doc, fmt)
+    version = onlyoffice_service.document_key(doc)
+    entry = _load_entry(doc.id, fmt)
+    if entry.get("version") == version and entry.get("status") == "ready":
+        return _ready_response(doc, fmt, entry, request)
+
+    r = _get_redis()
+    timeout = float(_cfg("ONLYOFFICE_CONVERT_TIMEOUT", 120))
+    if not r.set(_lock_key(doc.id, fmt, version), 1, nx=True, ex=int(timeout) + 60):
+        # 同一版本已经在转换
+        percent = entry.get("percent", 0) if entry.get("version") == version else 0
+        return {"status": "pending", "format": fmt, "percent": percent}
+
+    # 有人正在编辑时先让 Document Server 落盘（每个版本只触发一次，失败不影响转换）；
+    # 保存完成后 document_key 变化，前端再 POST 一次转换新版本
+    if r.set(f"{FORCESAVE_KEY_PREFIX}{doc.id}:{version}", 1, nx=True, ex=600):
+        try:
+            if onlyoffice_service.force_save_documents([doc]).get(doc.id) == "requested":
+                r.delete(_lock_key(doc.id, fmt, version))
+                return {"status": "saving", "format": fmt, "percent": 0}
+        except Exception as e:
+            logger.warning(f"[Conversion] force-save skipped | doc_id={doc.id} | error={repr(e)}")
+
+    _save_entry(doc.id, fmt, {
+        "version": version, "status": "pending", "percent": 0, "objectKey": entry.get("objectKey"),
+    })
+    job = {"job_id": uuid.uuid4().hex, "doc_id": doc.id, "format": fmt, "version": version, "deadline": time.time() + timeout}
+    r.lpush(QUEUE_KEY, json.dumps(job))
+    logger.info(f"[Conversion] ENQUEUE | doc_id={doc.id} | format={fmt}")
+    return {"status": "pending", "format": fmt, "percent": 0}
+
+
+def _fail(job: Dict[str, Any], entry: Dict[str, Any], error: str) -> None:
+    _save_entry(job["doc_id"], job["format"], {
+        "version": job["version"], "status": "failed", "error": error, "objectKey": entry.get("objectKey"),
+    })
+    _get_redis().delete(_lock_key(job["doc_id"], job["format"], job["version"]))
+    logger.error(f"[Conversion] FAILED | doc_id={job['doc_id']} | format={job['format']} | error={error}")
+
+
+def _run_job(job: Dict[str, Any]) -> bool:
+    """查询 / 推进一次转换；返回 False 表示还没转完，需要稍后再放回队列"""
+    doc_id, fmt, version = job["doc_id"], job["format"], job["version"]
+    entry = _load_entry(doc_id, fmt)
+    doc = Document.query.get(doc_id)
+    if not doc or doc.status != DocumentStatus.COMPLETED or onlyoffice_service.document_key(doc) != version:
+        # 文档已删除 / 已更新：这个版本的结果没人要了
+        _get_redis().delete(_lock_key(doc_id, fmt, version))
+        return True
+    if time.time() > job["deadline"]:
+        _fail(job, entry, "Conversion timeout")
+        return True
+
+    ext = os.path.splitext(doc.file_name or "")[1].lower()
+    timeout = float(_cfg("ONLYOFFICE_CONVERT_TIMEOUT", 120))
+    try:
+        data = request_conversion(
+            _cfg("DOCUMENT_SERVER_CONVERT_URL"),
+            _cfg("ONLYOFFICE_JWT_SECRET"),
+            key=f"{version}_{fmt}",
+            url=onlyoffice_service._download_url(doc),
+            filetype=ext.lstrip("."),
+            outputtype=fmt,
+            title=doc.file_name,
+            is_async=True,
+            timeout=timeout,
+        )
+    except RuntimeError as e:
+        # Document Server 明确返回了错误码
+        _fail(job, entry, str(e))
+        return True
+    except requests.RequestException as e:
+        # 连不上 / 超时 / 5xx：退避后重试，截止时间到了由上面记为 failed
+        job["attempts"] = int(job.get("attempts", 0)) + 1
+        job["retry_delay"] = min(POLL_INTERVAL_SECONDS * 2 ** job["attempts"], MAX_RETRY_DELAY_SECONDS)
+        logger.warning(
+            f"[Conversion] request failed, retry | doc_id={doc_id} | format={fmt} | "
+            f"attempts={job['attempts']} | error={repr(e)}"
+        )
+        return False
+
+    if not data.get("endConvert"):
+        entry.update({"version": version, "status": "pending", "percent": int(data.get("percent") or 0)})
+        _save_entry(doc_id, fmt, entry)
+        return False
+
+    object_key = f"{CONVERSION_PREFIX}/{doc_id}/{version}.{fmt}"
+    content_type = mimetypes.guess_type(f"file.{fmt}")[0] or "application/octet-stream"
+    try:
+        size, _ = minio_storage.upload_from_url(data["fileUrl"], doc.bucket, object_key, content_type, timeout=timeout)
+    except Exception as e:
+        _fail(job, entry, str(e))
+        return True
+
+    old_key = entry.get("objectKey")
+    if old_key and old_key != object_key:
+        delete_queue.schedule_delete(doc.bucket, old_key)
+
+    _save_entry(doc_id, fmt, {"version": version, "status": "ready", "objectKey": object_key, "size": size})
+    _get_redis().delete(_lock_key(doc_id, fmt, version))
+    logger.info(f"[Conversion] DONE | doc_id={doc_id} | format={fmt} | size={size}")
+    return True
+
+
+def _requeue_stale_if_due() -> None:
+    """
+    每分钟最多扫一次 processing：取出后超过一轮处理上限还没确认的任务
+    （说明处理它的进程已经挂了）放回队列头部
+    """
+    r = _get_redis()
+    now = time.time()
+    if not r.set(LAST_SWEEP_KEY, now, nx=True, ex=60):
+        return
+
+    # 一轮最多：一次转换请求 + 一次结果上传
+    timeout = 2 * float(_cfg("ONLYOFFICE_CONVERT_TIMEOUT", 120)) + 60
+    for raw in r.lrange(PROCESSING_KEY, 0, -1):
+        try:
+            job = json.loads(raw)
+        except Exception:
+            r.lrem(PROCESSING_KEY, 1, raw)
+            continue
+
+        job_id = job.get("job_id") or raw
+        claimed_at = r.hget(CLAIMS_KEY, job_id)
+        if claimed_at is None:
+            # 取出后还没来得及登记就挂了：从现在开始计时
+            r.hsetnx(CLAIMS_KEY, job_id, now)
+            continue
+        if now - float(claimed_at) < timeout:
+            continue
+
+        pipe = r.pipeline()
+        pipe.lrem(PROCESSING_KEY, 1, raw)
+        pipe.hdel(CLAIMS_KEY, job_id)
+        pipe.rpush(QUEUE_KEY, raw)
+        pipe.execute()
+        logger.warning(f"[Conversion] REQUEUE stale job | doc_id={job['doc_id']} | format={job['format']}")
+
+
+def _finish(raw: str, job: Dict[str, Any], requeue: bool) -> None:
+    """确认任务：从 processing 删掉；还要再查的放回队尾"""
+    pipe = _get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.hdel(CLAIMS_KEY, job.get("job_id") or raw)
+    if requeue:
+        pipe.lpush(QUEUE_KEY, json.dumps(job))
+    pipe.execute()
+
+
+def process_one() -> bool:
+    """worker 循环体：阻塞最多 5 秒等一个任务"""
+    _requeue_stale_if_due()
+
+    r = _get_redis()
+    raw = r.blmove(QUEUE_KEY, PROCESSING_KEY, 5, "RIGHT", "LEFT")
+    if not raw:
+        return False
+
+    job = json.loads(raw)
+    if job.get("not_before", 0) > time.time():
+        # 还没到下次查询时间：放回队尾，本轮让 worker 歇一下
+        pipe = r.pipeline()
+        pipe.lpush(QUEUE_KEY, raw)
+        pipe.lrem(PROCESSING_KEY, 1, raw)
+        pipe.execute()
+        return False
+
+    r.hset(CLAIMS_KEY, job.get("job_id") or raw, time.time())
+    requeue = False
+    try:
+        if not _run_job(job):
+            job["not_before"] = time.time() + job.pop("retry_delay", POLL_INTERVAL_SECONDS)
+            requeue = True
+    except Exception as e:
+        db.session.rollback()
+        _fail(job, _load_entry(job["doc_id"], job["format"]), str(e))
+    finally:
+        _finish(raw, job, requeue)
+    return True
+
+
+def drop_conversions(doc: Document) -> None:
+    """文档删除时一并清理转换结果和索引"""
+    try:
+        r = _get_redis()
+        index_key = _index_key(doc.id)
+        for raw in r.hvals(index_key):
+            object_key = json.loads(raw).get("objectKey")
+            if object_key:
+                delete_queue.schedule_delete(doc.bucket, object_key)
+        r.delete(index_key)
+    except Exception as e:
+        logger.error(f"[Conversion] drop failed | doc_id={doc.id} | error={repr(e)}")
+
+
+def start_worker(app) -> None:
+    """在当前进程启动转换任务消费线程（create_app 时调用）"""
+    start_background_worker(app, "conversion", process_one, interval=1.0)
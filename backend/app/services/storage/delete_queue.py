@@ -0,0 +1,299 @@
+# app/services/storage/delete_queue.py
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from flask import current_app
+
+from .. import onlyoffice_command
+from ...utils import minio_storage
+from ...utils.background import start_background_worker
+from ... import extensions
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "minio_delete:queue"          # 待删除对象（list，RPUSH 入队，从头部消费）
+DEAD_KEY = "minio_delete:dead"            # 重试多次仍失败的对象，留给人工处理
+LAST_DRAIN_KEY = "minio_delete:last_drain"
+BATCH_KEY_PREFIX = "minio_delete:batch:"  # list：某个 worker 已领取、正在处理的一批
+BATCHES_KEY = "minio_delete:batches"      # zset：batch_id -> 领取时间
+LAST_SWEEP_KEY = "minio_delete:last_sweep"
+BATCH_TIMEOUT = 600                       # 秒，领取后这么久还没处理完，认为 worker 已挂，整批放回队列
+
+MAX_BATCH_SIZE = 1000                     # S3 Multi-Object Delete 单次上限
+EDIT_RECHECK_SECONDS = 60                 # 文档仍在编辑时，隔多久再查一次
+
+# 原子地从队头领取一批，移到该批次自己的 list 里并登记领取时间；多个 worker 不会拿到同一批
+_CLAIM_SCRIPT = """
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items == 0 then
+    return items
+end
+redis.call('ltrim', KEYS[1], #items, -1)
+redis.call('rpush', KEYS[2], unpack(items))
+redis.call('zadd', KEYS[3], ARGV[3], ARGV[2])
+return items
+"""
+
+# 原子地把一个批次按原顺序放回队列头部（worker 挂掉后由巡检调用）
+_RESTORE_SCRIPT = """
+local items = redis.call('lrange', KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('lpush', KEYS[1], items[i])
+end
+redis.call('del', KEYS[2])
+redis.call('zrem', KEYS[3], ARGV[1])
+return #items
+"""
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def is_enabled() -> bool:
+    return bool(_cfg("MINIO_DELETE_QUEUE_ENABLED", True))
+
+
+def enqueue_deletes(items: Iterable[Tuple[str, str]], editing_key: Optional[str] = None) -> int:
+    """
+    批量入队 [(bucket, object_key)]，立即返回，由后台 worker 异步删除
+    editing_key：OnlyOffice document key；worker 删除前用 info 命令查一下，
+    还有人在编辑就推迟（最多 MINIO_DELETE_EDIT_HOLD_SECONDS），查询失败照常删除
+    返回入队数量
+    """
+    now = time.time()
+    payloads = [
+        json.dumps({
+            "bucket": bucket,
+            "key": object_key,
+            "enqueued_at": now,
+            "attempts": 0,
+            **({"editing_key": editing_key} if editing_key else {}),
+        })
+        for bucket, object_key in items
+        if bucket and object_key
+    ]
+    if not payloads:
+        return 0
+
+    _get_redis().rpush(QUEUE_KEY, *payloads)
+    logger.info(f"[DeleteQueue] ENQUEUE | count={len(payloads)}")
+    return len(payloads)
+
+
+def schedule_delete(bucket: str, object_key: str, editing_key: Optional[str] = None) -> None:
+    """
+    对外入口：删除一个 MinIO 对象
+
+    - 队列开启时只入队，不在请求里等待 MinIO
+    - 队列关闭或 Redis 不可用时退回同步删除（不做编辑检查）
+    - 失败都会记日志，不会静默吞掉
+    """
+    if is_enabled():
+        try:
+            enqueue_deletes([(bucket, object_key)], editing_key=editing_key)
+            return
+        except Exception as e:
+            logger.error(
+                f"[DeleteQueue] enqueue failed, fallback to sync delete | "
+                f"bucket={bucket} | key={object_key} | error={repr(e)}"
+            )
+
+    try:
+        minio_storage.delete_object(bucket=bucket, object_key=object_key)
+    except Exception as e:
+        logger.error(
+            f"[DeleteQueue] sync delete failed | bucket={bucket} | key={object_key} | error={repr(e)}"
+        )
+
+
+def _decode(raw: str) -> Dict[str, Any] | None:
+    try:
+        item = json.loads(raw)
+        if item.get("bucket") and item.get("key"):
+            return item
+    except Exception:
+        pass
+    logger.error(f"[DeleteQueue] drop malformed item | raw={raw!r}")
+    return None
+
+
+def _still_editing(keys: Set[str]) -> Set[str]:
+    """info 命令查询哪些 document key 还有人在编辑；Document Server 不可达时返回空集（照常删除）"""
+    if not keys or not _cfg("DOCUMENT_SERVER_COMMAND_URL"):
+        return set()
+    try:
+        results = onlyoffice_command.send_batch(
+            _cfg("DOCUMENT_SERVER_COMMAND_URL"),
+            _cfg("ONLYOFFICE_JWT_SECRET"),
+            "info",
+            keys,
+            timeout=float(_cfg("ONLYOFFICE_COMMAND_TIMEOUT", 10)),
+            max_workers=int(_cfg("ONLYOFFICE_COMMAND_WORKERS", 8)),
+        )
+    except Exception as e:
+        logger.warning(f"[DeleteQueue] editing check skipped | error={repr(e)}")
+        return set()
+    return {key for key, data in results.items() if data.get("error") == 0}
+
+
+def _batch_key(batch_id: str) -> str:
+    return f"{BATCH_KEY_PREFIX}{batch_id}"
+
+
+def _restore_stale_batches_if_due() -> None:
+    """每分钟最多扫一次：领取超过 BATCH_TIMEOUT 的批次整批放回队头（删除是幂等的，重删无害）"""
+    r = _get_redis()
+    now = time.time()
+    if not r.set(LAST_SWEEP_KEY, now, nx=True, ex=60):
+        return
+    for batch_id in r.zrangebyscore(BATCHES_KEY, 0, now - BATCH_TIMEOUT):
+        restored = r.eval(_RESTORE_SCRIPT, 3, QUEUE_KEY, _batch_key(batch_id), BATCHES_KEY, batch_id)
+        logger.warning(f"[DeleteQueue] RESTORE stale batch | batch_id={batch_id} | count={restored}")
+
+
+def drain_once() -> bool:
+    """
+    消费一批删除请求：
+
+    1. 用 Lua 脚本从队头原子地领取一批，移到这一批自己的 list（多个 gunicorn worker 可以并行消费，
+       互不重叠；处理多久都不会被别人重复领取）
+    2. 按 bucket 分组调用 remove_objects 批量删除；
+       带 editing_key 的对象先查 OnlyOffice，还在编辑的推迟到下次（不计重试次数）
+    3. 成功的直接丢弃；失败的 attempts+1 后放回队尾（指数退避），
+       超过 MINIO_DELETE_MAX_ATTEMPTS 的进入死信队列
+    4. 最后删掉这一批的 list——处理过程中进程挂掉，超过 BATCH_TIMEOUT 后由巡检整批放回队列
+
+    返回 True 表示队列里可能还有积压，worker 不用 sleep
+    """
+    r = _get_redis()
+    batch_size = min(int(_cfg("MINIO_DELETE_BATCH_SIZE", MAX_BATCH_SIZE)), MAX_BATCH_SIZE)
+    max_attempts = int(_cfg("MINIO_DELETE_MAX_ATTEMPTS", 5))
+
+    _restore_stale_batches_if_due()
+
+    batch_id = uuid.uuid4().hex
+    raw_items = r.eval(
+        _CLAIM_SCRIPT, 3, QUEUE_KEY, _batch_key(batch_id), BATCHES_KEY, batch_size, batch_id, time.time()
+    )
+    if not raw_items:
+        return False
+
+    now = time.time()
+    hold_seconds = float(_cfg("MINIO_DELETE_EDIT_HOLD_SECONDS", 3600))
+    ready: List[Dict[str, Any]] = []
+    retry: List[Dict[str, Any]] = []
+    for raw in raw_items:
+        item = _decode(raw)
+        if item is None:
+            continue
+        # 还没到重试时间的，原样放回队尾
+        if item.get("not_before", 0) > now:
+            retry.append(item)
+            continue
+        ready.append(item)
+
+    # 正在编辑的文档推迟删除；超过保留时长就不再等
+    editing = _still_editing({
+        i["editing_key"] for i in ready
+        if i.get("editing_key") and now - float(i.get("enqueued_at") or now) < hold_seconds
+    })
+    by_bucket: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for item in ready:
+        if item.get("editing_key") in editing:
+            item["not_before"] = now + EDIT_RECHECK_SECONDS
+            retry.append(item)
+            continue
+        by_bucket[item["bucket"]].append(item)
+
+    dead: List[Dict[str, Any]] = []
+    deleted = 0
+    for bucket, group in by_bucket.items():
+        try:
+            failed = dict(minio_storage.delete_objects(bucket, [i["key"] for i in group]))
+        except Exception as e:
+            logger.error(f"[DeleteQueue] batch delete failed | bucket={bucket} | error={repr(e)}")
+            failed = {i["key"]: repr(e) for i in group}
+
+        for item in group:
+            if item["key"] not in failed:
+                deleted += 1
+                continue
+            item["attempts"] = int(item.get("attempts", 0)) + 1
+            item["last_error"] = failed[item["key"]]
+            if item["attempts"] >= max_attempts:
+                dead.append(item)
+            else:
+                item["not_before"] = now + min(2 ** item["attempts"], 300)
+                retry.append(item)
+
+    pipe = r.pipeline()
+    pipe.delete(_batch_key(batch_id))
+    pipe.zrem(BATCHES_KEY, batch_id)
+    if retry:
+        pipe.rpush(QUEUE_KEY, *[json.dumps(i) for i in retry])
+    if dead:
+        pipe.rpush(DEAD_KEY, *[json.dumps(i) for i in dead])
+    pipe.set(LAST_DRAIN_KEY, now)
+    pipe.execute()
+
+    logger.info(
+        f"[DeleteQueue] DRAIN | taken={len(raw_items)} | deleted={deleted} | "
+        f"retry={len(retry)} | dead={len(dead)}"
+    )
+    # 拿满一批且没有失败，说明大概率还有积压
+    return len(raw_items) >= batch_size and not retry
+
+
+def get_queue_stats() -> Dict[str, Any]:
+    """
+    监控用：队列深度、死信数量、队头等待时长（秒）、上次消费时间
+    """
+    r = _get_redis()
+    pipe = r.pipeline()
+    pipe.llen(QUEUE_KEY)
+    pipe.llen(DEAD_KEY)
+    pipe.lindex(QUEUE_KEY, 0)
+    pipe.get(LAST_DRAIN_KEY)
+    pipe.zcard(BATCHES_KEY)
+    depth, dead, head_raw, last_drain, in_flight = pipe.execute()
+
+    lag = 0.0
+    if head_raw:
+        head = _decode(head_raw)
+        if head and head.get("enqueued_at"):
+            lag = max(0.0, time.time() - float(head["enqueued_at"]))
+
+    return {
+        "enabled": is_enabled(),
+        "depth": int(depth or 0),
+        "deadLetters": int(dead or 0),
+        "inFlightBatches": int(in_flight or 0),
+        "lagSeconds": round(lag, 3),
+        "lastDrainAt": float(last_drain) if last_drain else None,
+    }
+
+
+def start_worker(app) -> None:
+    """在当前进程启动删除队列消费线程（create_app 时调用）"""
+    if not app.config.get("MINIO_DELETE_QUEUE_ENABLED", True):
+        return
+    start_background_worker(
+        app,
+        "minio-delete-queue",
+        drain_once,
+        interval=float(app.config.get("MINIO_DELETE_POLL_INTERVAL", 2)),
+    )
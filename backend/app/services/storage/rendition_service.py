@@ -0,0 +1,444 @@
+# app/services/storage/rendition_service.py
+"""
+文档缩略图 / 预览图生成
+
+- confirm_upload 之后入队（Redis list），请求立即返回
+- 所有进程里只有拿到 rendition:consumer 锁的那一个消费队列、创建进程池
+  （gunicorn 多 worker 时不会每个进程各开一个池）
+- 取任务用 LMOVE 移到 processing 列表，生成完成后才确认删除；
+  消费进程挂掉时超过 RENDITION_VISIBILITY_TIMEOUT 的任务由下一个消费者放回队头
+- 后台线程从队列取任务，丢到进程池里生成（Pillow 缩放 / OnlyOffice 渲染首页）
+- 结果作为派生对象存到 MinIO：renditions/<doc_id>/<version>/{thumb,preview}.jpg
+- 每个文档在 Redis 里有一个 hash 索引，列表页按 id 批量查询，返回各自的预签名 URL
+"""
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from flask import current_app
+from minio import Minio
+from PIL import Image, ImageOps
+from redis.exceptions import LockError
+
+from .. import onlyoffice_service
+from ..onlyoffice_convert import request_conversion
+from . import delete_queue
+from ...models.document import Document, DocumentStatus
+from ...utils.background import start_background_worker
+from ...utils.minio_storage import generate_presigned_download_url
+from ... import extensions
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "rendition:queue"             # RPUSH 入队，从左侧取（FIFO）
+PROCESSING_KEY = "rendition:processing"   # 已取出、正在生成的任务
+CLAIMS_KEY = "rendition:claims"           # hash：job_id -> 取出时间，用于判断处理超时
+LAST_SWEEP_KEY = "rendition:last_sweep"
+CONSUMER_KEY = "rendition:consumer"       # 消费者锁：同一时间只有一个进程跑进程池
+CONSUMER_LEASE_SECONDS = 30
+MAX_ATTEMPTS = 3                          # 子进程崩溃导致的重试上限
+INDEX_KEY_PREFIX = "rendition:doc:"        # hash：version / status / thumb_key / preview_key / error
+RENDITION_PREFIX = "renditions"
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+
+# 进程池只在持有消费者锁时懒加载；_in_flight 记录已提交、还没收尾的任务（原始 JSON + 解析后的 job）
+_pool: Optional[ProcessPoolExecutor] = None
+_in_flight: Dict[Future, Tuple[str, Dict[str, Any]]] = {}
+_consumer_lock = None
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _index_key(doc_id: int) -> str:
+    return f"{INDEX_KEY_PREFIX}{doc_id}"
+
+
+def _rendition_kind(file_name: str, content_type: Optional[str]) -> Optional[str]:
+    """image：直接用 Pillow 缩放；document：先让 OnlyOffice 把首页渲染成 png"""
+    ext = os.path.splitext(file_name or "")[1].lower()
+    if ext in IMAGE_EXTS or (content_type or "").startswith("image/"):
+        return "image"
+    if ext in onlyoffice_service.ALLOWED_EXTS_MAP:
+        return "document"
+    return None
+
+
+# ============== 子进程里执行的部分（不能依赖 Flask 上下文） ==============
+
+def _fit_jpeg(image: Image.Image, max_side: int) -> bytes:
+    img = image.copy()
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def render_document(settings: Dict[str, Any], job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    进程池入口：生成一个文档的缩略图 + 预览图并上传到 MinIO
+    settings / job 都是普通 dict（可 pickle）
+    """
+    client = Minio(
+        settings["minio_endpoint"],
+        access_key=settings["minio_access_key"],
+        secret_key=settings["minio_secret_key"],
+        secure=settings["minio_secure"],
+    )
+    preview_size = int(settings["preview_size"])
+
+    if job["kind"] == "image":
+        resp = client.get_object(job["bucket"], job["object_key"])
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as tmp:
+                shutil.copyfileobj(resp, tmp, 256 * 1024)
+                tmp.seek(0)
+                image = Image.open(tmp)
+                # JPEG 可以在解码阶段直接降采样，大图省很多内存和 CPU
+                image.draft("RGB", (preview_size, preview_size))
+                image = ImageOps.exif_transpose(image)
+                image.load()
+        finally:
+            resp.close()
+            resp.release_conn()
+    else:
+        data = request_conversion(
+            settings["convert_url"],
+            settings["jwt_secret"],
+            key=f"{job['version']}_preview",
+            url=job["source_url"],
+            filetype=job["filetype"],
+            outputtype="png",
+            title=job.get("file_name"),
+            thumbnail={"aspect": 1, "first": True, "width": preview_size, "height": preview_size},
+            timeout=settings["convert_timeout"],
+        )
+        png = requests.get(data["fileUrl"], timeout=settings["convert_timeout"])
+        png.raise_for_status()
+        image = Image.open(io.BytesIO(png.content))
+        image.load()
+
+    result: Dict[str, Any] = {"status": "ready"}
+    for name, max_side in (("thumb", settings["thumb_size"]), ("preview", preview_size)):
+        payload = _fit_jpeg(image, int(max_side))
+        object_key = f"{RENDITION_PREFIX}/{job['doc_id']}/{job['version']}/{name}.jpg"
+        client.put_object(
+            job["bucket"],
+            object_key,
+            io.BytesIO(payload),
+            len(payload),
+            content_type="image/jpeg",
+        )
+        result[f"{name}_key"] = object_key
+    return result
+
+
+# ============== Web 进程里的部分 ==============
+
+def enqueue_rendition(doc: Document) -> bool:
+    """
+    为文档当前版本排队生成缩略图/预览图；不支持的类型直接标记 unsupported
+    任何异常只记日志，不影响调用方（上传确认等主流程）
+    """
+    try:
+        r = _get_redis()
+        version = onlyoffice_service.document_key(doc)
+        kind = _rendition_kind(doc.file_name, doc.content_type)
+        index_key = _index_key(doc.id)
+
+        if kind is None:
+            r.hset(index_key, mapping={"version": version, "status": "unsupported", "updated_at": time.time()})
+            return False
+
+        ext = os.path.splitext(doc.file_name or "")[1].lower()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "doc_id": doc.id,
+            "version": version,
+            "kind": kind,
+            "bucket": doc.bucket,
+            "object_key": doc.object_key,
+            "file_name": doc.file_name,
+            "filetype": ext.lstrip("."),
+            "source_url": onlyoffice_service._download_url(doc),
+        }
+        pipe = r.pipeline()
+        pipe.hset(index_key, mapping={"version": version, "status": "pending", "error": "", "updated_at": time.time()})
+        pipe.rpush(QUEUE_KEY, json.dumps(job))
+        pipe.execute()
+        logger.info(f"[Rendition] ENQUEUE | doc_id={doc.id} | version={version} | kind={kind}")
+        return True
+    except Exception as e:
+        logger.error(f"[Rendition] enqueue failed | doc_id={doc.id} | error={repr(e)}")
+        return False
+
+
+def _settings() -> Dict[str, Any]:
+    return {
+        "minio_endpoint": _cfg("MINIO_ENDPOINT"),
+        "minio_access_key": _cfg("MINIO_ACCESS_KEY"),
+        "minio_secret_key": _cfg("MINIO_SECRET_KEY"),
+        "minio_secure": _cfg("MINIO_SECURE", False),
+        "convert_url": _cfg("DOCUMENT_SERVER_CONVERT_URL"),
+        "jwt_secret": _cfg("ONLYOFFICE_JWT_SECRET"),
+        "convert_timeout": float(_cfg("ONLYOFFICE_CONVERT_TIMEOUT", 120)),
+        "thumb_size": int(_cfg("RENDITION_THUMB_SIZE", 256)),
+        "preview_size": int(_cfg("RENDITION_PREVIEW_SIZE", 1024)),
+    }
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # gunicorn worker 里有多个线程，用 spawn 避免 fork 带出锁状态
+        _pool = ProcessPoolExecutor(
+            max_workers=int(_cfg("RENDITION_WORKERS", 2)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _hold_consumer_lock() -> bool:
+    """抢占 / 续租消费者锁；返回当前进程是否是唯一的消费者"""
+    global _consumer_lock
+    if _consumer_lock is None:
+        # token 存在锁对象上而不是 thread-local：续租不依赖调用线程
+        _consumer_lock = _get_redis().lock(CONSUMER_KEY, timeout=CONSUMER_LEASE_SECONDS, thread_local=False)
+    try:
+        if _consumer_lock.owned():
+            _consumer_lock.reacquire()
+            return True
+        return _consumer_lock.acquire(blocking=False)
+    except LockError:
+        return False
+
+
+def _job_id(job: Dict[str, Any], raw: str) -> str:
+    # 旧版本入队的任务没有 job_id，用原始 JSON 代替
+    return job.get("job_id") or raw
+
+
+def _ack(raw: str, job: Dict[str, Any]) -> None:
+    pipe = _get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.hdel(CLAIMS_KEY, _job_id(job, raw))
+    pipe.execute()
+
+
+def _requeue(raw: str, job: Dict[str, Any], new_raw: Optional[str] = None) -> None:
+    """从 processing 放回队头"""
+    pipe = _get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.hdel(CLAIMS_KEY, _job_id(job, raw))
+    pipe.lpush(QUEUE_KEY, new_raw or raw)
+    pipe.execute()
+
+
+def _requeue_stale_if_due() -> None:
+    """
+    每分钟最多扫一次 processing：超过 RENDITION_VISIBILITY_TIMEOUT 还没确认的任务
+    （说明取走它的进程已经挂了）放回队头
+    """
+    r = _get_redis()
+    now = time.time()
+    if not r.set(LAST_SWEEP_KEY, now, nx=True, ex=60):
+        return
+
+    timeout = float(_cfg("RENDITION_VISIBILITY_TIMEOUT", 600))
+    local = {raw for raw, _ in _in_flight.values()}
+    for raw in r.lrange(PROCESSING_KEY, 0, -1):
+        if raw in local:
+            continue
+        try:
+            job = json.loads(raw)
+        except Exception:
+            r.lrem(PROCESSING_KEY, 1, raw)
+            continue
+
+        claimed_at = r.hget(CLAIMS_KEY, _job_id(job, raw))
+        if claimed_at is None:
+            # 取出后还没来得及登记就挂了：从现在开始计时
+            r.hsetnx(CLAIMS_KEY, _job_id(job, raw), now)
+            continue
+        if now - float(claimed_at) < timeout:
+            continue
+
+        _requeue(raw, job)
+        logger.warning(f"[Rendition] REQUEUE stale job | doc_id={job['doc_id']} | job_id={_job_id(job, raw)}")
+
+
+def _on_finished(raw: str, job: Dict[str, Any], future: Future) -> None:
+    try:
+        result = future.result()
+    except BrokenProcessPool:
+        # 子进程崩溃（OOM / 被 kill）：池里所有任务都会失败，放回队头由重建的池再跑
+        _shutdown_pool()
+        job["attempts"] = int(job.get("attempts", 0)) + 1
+        if job["attempts"] < MAX_ATTEMPTS:
+            logger.error(f"[Rendition] process died, requeue | doc_id={job['doc_id']} | attempts={job['attempts']}")
+            _requeue(raw, job, json.dumps(job))
+            return
+        logger.error(f"[Rendition] render failed | doc_id={job['doc_id']} | error=process pool broken")
+        result = {"status": "failed", "error": "rendition process crashed"}
+    except Exception as e:
+        logger.error(f"[Rendition] render failed | doc_id={job['doc_id']} | error={repr(e)}")
+        result = {"status": "failed", "error": str(e)}
+
+    r = _get_redis()
+    index_key = _index_key(job["doc_id"])
+    new_keys = [result.get("thumb_key"), result.get("preview_key")]
+
+    # 生成期间文档又更新了：这次结果作废，派生对象直接删掉
+    if r.hget(index_key, "version") != job["version"]:
+        for key in filter(None, new_keys):
+            delete_queue.schedule_delete(job["bucket"], key)
+        _ack(raw, job)
+        return
+
+    old_keys = r.hmget(index_key, "thumb_key", "preview_key")
+    r.hset(index_key, mapping={
+        "status": result["status"],
+        "thumb_key": result.get("thumb_key") or "",
+        "preview_key": result.get("preview_key") or "",
+        "error": result.get("error") or "",
+        "updated_at": time.time(),
+    })
+    for key in old_keys:
+        if key and key not in new_keys:
+            delete_queue.schedule_delete(job["bucket"], key)
+    _ack(raw, job)
+
+    logger.info(f"[Rendition] DONE | doc_id={job['doc_id']} | status={result['status']}")
+
+
+def process_once() -> bool:
+    """
+    worker 循环体：收尾已完成的任务；持有消费者锁时再按空闲进程数从队列取新任务
+    返回 True 表示这一轮有进展
+    """
+    progressed = False
+
+    for future in [f for f in _in_flight if f.done()]:
+        raw, job = _in_flight.pop(future)
+        _on_finished(raw, job, future)
+        progressed = True
+
+    if not _hold_consumer_lock():
+        # 不是消费者（或锁已被别的进程接管）：只收尾已提交的任务，空闲后释放进程池
+        if _in_flight:
+            wait(list(_in_flight), timeout=1, return_when=FIRST_COMPLETED)
+        elif _pool is not None:
+            _shutdown_pool()
+        return progressed
+
+    _requeue_stale_if_due()
+
+    r = _get_redis()
+    settings = _settings()
+    free = int(_cfg("RENDITION_WORKERS", 2)) - len(_in_flight)
+    while free > 0:
+        raw = r.lmove(QUEUE_KEY, PROCESSING_KEY, "LEFT", "RIGHT")
+        if not raw:
+            break
+        job = json.loads(raw)
+        r.hset(CLAIMS_KEY, _job_id(job, raw), time.time())
+        try:
+            future = _get_pool().submit(render_document, settings, job)
+        except BrokenProcessPool:
+            # 子进程崩溃会让整个池不可用：放回队头，下轮重建
+            logger.error("[Rendition] process pool broken, recreating")
+            _requeue(raw, job)
+            _shutdown_pool()
+            break
+        _in_flight[future] = (raw, job)
+        free -= 1
+        progressed = True
+
+    if _in_flight:
+        wait(list(_in_flight), timeout=1, return_when=FIRST_COMPLETED)
+    return progressed
+
+
+def describe_renditions(doc: Document, request=None) -> Dict[str, Any]:
+    """
+    返回文档缩略图/预览图状态；当前版本还没有生成过就顺手入队
+    """
+    if doc.status != DocumentStatus.COMPLETED:
+        return {"status": "unavailable"}
+
+    r = _get_redis()
+    info = r.hgetall(_index_key(doc.id))
+    if info.get("version") != onlyoffice_service.document_key(doc):
+        enqueue_rendition(doc)
+        return {"status": "pending"}
+
+    data: Dict[str, Any] = {"status": info.get("status")}
+    if info.get("status") == "ready":
+        ttl = timedelta(minutes=15)
+        data["thumbnailUrl"] = generate_presigned_download_url(
+            bucket=doc.bucket, object_key=info["thumb_key"], ttl=ttl,
+            download_filename=None, request=request, as_attachment=False,
+        )
+        data["previewUrl"] = generate_presigned_download_url(
+            bucket=doc.bucket, object_key=info["preview_key"], ttl=ttl,
+            download_filename=None, request=request, as_attachment=False,
+        )
+    elif info.get("error"):
+        data["error"] = info["error"]
+    return data
+
+
+def drop_renditions(doc: Document) -> None:
+    """文档删除时一并清理派生对象和索引"""
+    try:
+        r = _get_redis()
+        index_key = _index_key(doc.id)
+        for key in r.hmget(index_key, "thumb_key", "preview_key"):
+            if key:
+                delete_queue.schedule_delete(doc.bucket, key)
+        r.delete(index_key)
+    except Exception as e:
+        logger.error(f"[Rendition] drop failed | doc_id={doc.id} | error={repr(e)}")
+
+
+def start_worker(app) -> None:
+    """在当前进程启动缩略图生成线程（create_app 时调用）"""
+    if not app.config.get("RENDITION_ENABLED", True):
+        return
+    start_background_worker(app, "rendition", process_once, interval=1.0)
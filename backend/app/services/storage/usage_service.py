@@ -0,0 +1,256 @@
+# app/services/storage/usage_service.py
+"""
+按 fileType / businessId 统计存储用量（字节数 + 对象数）
+
+- object_key 形如 fileType/businessId/...，前两段即统计维度
+- document_service 在确认上传、更新、删除时增量更新 Redis 计数（HINCRBY）；
+  历史版本对象、修改记录包在产生 / 清理时同样计入
+- 后台线程定期按 MinIO 对账：逐个 fileType/businessId 前缀 list_objects，大小取 MinIO 的值；
+  上传中（还没确认）的对象不算，删除失败留下的孤儿对象照实计入并记日志；
+  已删除文档的缩略图 / 转换结果在对账时交给删除队列
+"""
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from flask import current_app
+
+from . import delete_queue
+from ...extensions import db
+from ...models.document import Document, DocumentStatus, DocumentVersion
+from ...utils import minio_storage
+from ...utils.background import start_background_worker
+from ... import extensions
+
+logger = logging.getLogger(__name__)
+
+USAGE_KEY_PREFIX = "storage_usage:"             # hash：bytes / objects
+INDEX_KEY = "storage_usage:index"               # set：所有出现过的 "fileType/businessId"
+LAST_RECONCILE_KEY = "storage_usage:last_reconcile"
+RECONCILE_LOCK_KEY = "storage_usage:reconcile_lock"
+
+# 派生对象（缩略图、转换结果等）不算在文档用量里
+DERIVED_PREFIXES = {"renditions", "conversions"}
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def prefix_of(object_key: str) -> Tuple[str, str]:
+    """fileType/businessId/... -> (fileType, businessId)"""
+    parts = (object_key or "").split("/")
+    file_type = parts[0] if len(parts) > 1 and parts[0] else "default"
+    business_id = parts[1] if len(parts) > 2 and parts[1] else "noBiz"
+    return file_type, business_id
+
+
+def _usage_key(file_type: str, business_id: str) -> str:
+    return f"{USAGE_KEY_PREFIX}{file_type}:{business_id}"
+
+
+def _apply(object_key: str, bytes_delta: int, objects_delta: int) -> None:
+    """增量更新计数；失败只记日志（对账会兜底），不影响主流程"""
+    file_type, business_id = prefix_of(object_key)
+    if file_type in DERIVED_PREFIXES:
+        return
+    try:
+        r = _get_redis()
+        key = _usage_key(file_type, business_id)
+        pipe = r.pipeline()
+        pipe.hincrby(key, "bytes", int(bytes_delta))
+        pipe.hincrby(key, "objects", int(objects_delta))
+        pipe.sadd(INDEX_KEY, f"{file_type}/{business_id}")
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"[StorageUsage] update failed | key={object_key} | error={repr(e)}")
+
+
+def record_added(object_key: str, size: Optional[int]) -> None:
+    _apply(object_key, size or 0, 1)
+
+
+def record_removed(object_key: str, size: Optional[int]) -> None:
+    _apply(object_key, -(size or 0), -1)
+
+
+def record_resized(object_key: str, old_size: Optional[int], new_size: Optional[int]) -> None:
+    """同一个 object_key 被覆盖写（对象数不变，只改字节数）"""
+    _apply(object_key, (new_size or 0) - (old_size or 0), 0)
+
+
+def get_usage(file_type: Optional[str] = None, business_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    查询用量：
+      - fileType + businessId：直接读一个 hash
+      - 只给 fileType / 都不给：按索引批量读取后汇总
+    """
+    r = _get_redis()
+    if file_type and business_id:
+        prefixes = [f"{file_type}/{business_id}"]
+    else:
+        prefixes = sorted(
+            p for p in r.smembers(INDEX_KEY)
+            if not file_type or p.split("/", 1)[0] == file_type
+        )
+
+    pipe = r.pipeline()
+    for p in prefixes:
+        ft, biz = p.split("/", 1)
+        pipe.hmget(_usage_key(ft, biz), "bytes", "objects")
+    rows = pipe.execute() if prefixes else []
+
+    items: List[Dict[str, Any]] = []
+    total_bytes = total_objects = 0
+    for p, (size, count) in zip(prefixes, rows):
+        ft, biz = p.split("/", 1)
+        size, count = int(size or 0), int(count or 0)
+        items.append({"fileType": ft, "businessId": biz, "bytes": size, "objects": count})
+        total_bytes += size
+        total_objects += count
+
+    last = r.get(LAST_RECONCILE_KEY)
+    return {
+        "items": items,
+        "totalBytes": total_bytes,
+        "totalObjects": total_objects,
+        "lastReconcileAt": float(last) if last else None,
+    }
+
+
+def _tracked_objects() -> Tuple[Set[str], Set[str]]:
+    """
+    数据库里的对象：(增量计数覆盖的 object_key, 还在上传中的 object_key)
+    前者 = COMPLETED 文档的当前对象 + 未删除文档的全部版本对象 / 修改记录包
+    """
+    tracked: Set[str] = set()
+    pending: Set[str] = set()
+    current = (
+        db.session.query(Document.object_key, Document.status)
+        .filter(Document.status.in_([DocumentStatus.COMPLETED, DocumentStatus.UPLOADING]))
+        .yield_per(1000)
+    )
+    for key, status in current:
+        if key:
+            (tracked if status == DocumentStatus.COMPLETED else pending).add(key)
+
+    versions = (
+        db.session.query(DocumentVersion.object_key, DocumentVersion.changes_key)
+        .join(Document, Document.id == DocumentVersion.document_id)
+        .filter(Document.status != DocumentStatus.DELETED)
+        .yield_per(1000)
+    )
+    for key, changes_key in versions:
+        tracked.update(k for k in (key, changes_key) if k)
+    return tracked, pending - tracked
+
+
+def _drop_orphan_derived(bucket: str) -> int:
+    """renditions/<doc_id>/...、conversions/<doc_id>/... 中文档已删除 / 不存在的派生对象交给删除队列"""
+    by_doc: Dict[int, List[str]] = defaultdict(list)
+    for prefix in DERIVED_PREFIXES:
+        for obj in minio_storage.iter_objects(bucket, f"{prefix}/"):
+            parts = obj.object_name.split("/")
+            if len(parts) > 2 and parts[1].isdigit():
+                by_doc[int(parts[1])].append(obj.object_name)
+    if not by_doc:
+        return 0
+
+    live = set()
+    ids = list(by_doc)
+    for i in range(0, len(ids), 1000):
+        live.update(
+            doc_id for (doc_id,) in db.session.query(Document.id)
+            .filter(Document.id.in_(ids[i:i + 1000]), Document.status != DocumentStatus.DELETED)
+        )
+    orphans = [(bucket, key) for doc_id, keys in by_doc.items() if doc_id not in live for key in keys]
+    if orphans:
+        delete_queue.enqueue_deletes(orphans)
+    return len(orphans)
+
+
+def reconcile() -> Dict[str, Tuple[int, int]]:
+    """
+    全量对账：按 fileType/businessId 前缀遍历 bucket，用 MinIO 的真实大小覆盖 Redis 计数
+
+    注意：遍历期间发生的增量会被这次结果覆盖掉，下次对账再校正
+    """
+    r = _get_redis()
+    bucket = _cfg("MINIO_BUCKET")
+    tracked, pending = _tracked_objects()
+    prefixes = {"/".join(prefix_of(key)) for key in tracked} | set(r.smembers(INDEX_KEY))
+
+    totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    seen = 0
+    orphans = 0
+    for p in sorted(prefixes):
+        if p.split("/", 1)[0] in DERIVED_PREFIXES:
+            continue
+        for obj in minio_storage.iter_objects(bucket, f"{p}/"):
+            key = obj.object_name
+            if key in pending:
+                continue  # 还没确认上传，确认时再计入
+            if key in tracked:
+                seen += 1
+            else:
+                orphans += 1
+            entry = totals[p]
+            entry[0] += obj.size or 0
+            entry[1] += 1
+
+    stale = r.smembers(INDEX_KEY) - set(totals)
+    pipe = r.pipeline()
+    for p in stale:
+        ft, biz = p.split("/", 1)
+        pipe.delete(_usage_key(ft, biz))
+        pipe.srem(INDEX_KEY, p)
+    for p, (size, count) in totals.items():
+        ft, biz = p.split("/", 1)
+        pipe.hset(_usage_key(ft, biz), mapping={"bytes": size, "objects": count})
+        pipe.sadd(INDEX_KEY, p)
+    pipe.set(LAST_RECONCILE_KEY, time.time())
+    pipe.execute()
+
+    derived = _drop_orphan_derived(bucket)
+    logger.info(
+        f"[StorageUsage] RECONCILE | bucket={bucket} | prefixes={len(totals)} | stale={len(stale)} | "
+        f"missing={len(tracked) - seen} | orphans={orphans} | derived_orphans={derived}"
+    )
+    return {p: (v[0], v[1]) for p, v in totals.items()}
+
+
+def reconcile_if_due() -> bool:
+    """worker 循环体：到了对账周期且拿到锁才执行（多个进程只跑一个）"""
+    r = _get_redis()
+    interval = float(_cfg("STORAGE_USAGE_RECONCILE_INTERVAL", 6 * 3600))
+    last = r.get(LAST_RECONCILE_KEY)
+    if last and time.time() - float(last) < interval:
+        return False
+
+    lock = r.lock(RECONCILE_LOCK_KEY, timeout=max(interval, 600))
+    if not lock.acquire(blocking=False):
+        return False
+    # 成功后不释放：锁在超时前一直有效，避免同一周期内被别的进程重复对账；失败则释放，下轮重试
+    try:
+        reconcile()
+    except Exception:
+        lock.release()
+        raise
+    return False
+
+
+def start_worker(app) -> None:
+    """在当前进程启动定期对账线程（create_app 时调用）"""
+    if not app.config.get("STORAGE_USAGE_RECONCILE_ENABLED", True):
+        return
+    start_background_worker(app, "storage-usage-reconcile", reconcile_if_due, interval=60)
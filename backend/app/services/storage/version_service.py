@@ -0,0 +1,204 @@
+# app/services/storage/version_service.py
+"""
+文档版本历史
+
+- 每次 OnlyOffice 保存 / 重新上传都写到新的 objectKey，旧对象保留为历史版本
+- t_document_versions 只记元数据（objectKey / size / sha256 / 修改记录包），按 document_id 建索引
+- 列表、恢复都只读写数据库：恢复 = 把 Document 指回旧版本的对象，不复制文件
+- 版本功能上线前的文档没有历史记录，第一次产生新版本时先把当前对象补记为 v1
+- 分配版本号前锁住 Document 行（SELECT ... FOR UPDATE），并发保存不会拿到同一个版本号
+- 每个文档最多保留 DOCUMENT_VERSION_KEEP 个版本，更早的版本记录删除、对象交给删除队列
+"""
+import logging
+import re
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+from flask import current_app
+
+from . import delete_queue, usage_service
+from ...extensions import db
+from ...models.document import Document, DocumentStatus, DocumentVersion
+from ...utils import minio_storage
+
+logger = logging.getLogger(__name__)
+
+
+def new_object_key(doc: Document, file_name: Optional[str] = None) -> str:
+    """
+    新版本的 objectKey：沿用原 fileType / businessId，格式同上传
+    fileType/businessId/yyyy/MM/dd/uuid_filename
+    """
+    file_type, business_id = usage_service.prefix_of(doc.object_key)
+    safe_filename = re.sub(r'[\\/:*?"<>|]', "_", file_name or doc.file_name or "unnamed")
+    date_path = datetime.now().strftime("%Y/%m/%d")
+    return f"{file_type}/{business_id}/{date_path}/{uuid.uuid4()}_{safe_filename}"
+
+
+def list_versions(document_id: int) -> List[DocumentVersion]:
+    return (
+        DocumentVersion.query
+        .filter_by(document_id=document_id)
+        .order_by(DocumentVersion.version_no.desc())
+        .all()
+    )
+
+
+def get_version(document_id: int, version_no: int) -> Optional[DocumentVersion]:
+    return DocumentVersion.query.filter_by(document_id=document_id, version_no=version_no).first()
+
+
+def _lock_document(document_id: int) -> None:
+    """锁住 Document 行直到调用方提交，同一文档的版本号分配串行执行"""
+    db.session.query(Document.id).filter(Document.id == document_id).with_for_update().first()
+
+
+def _next_version_no(document_id: int) -> int:
+    """调用方已持有 _lock_document"""
+    latest = db.session.query(db.func.max(DocumentVersion.version_no)).filter(
+        DocumentVersion.document_id == document_id
+    ).scalar()
+    return (latest or 0) + 1
+
+
+def ensure_baseline(doc: Document) -> None:
+    """文档还没有任何版本记录时，把当前对象补记为 v1（不提交）"""
+    if doc.status != DocumentStatus.COMPLETED or not doc.object_key:
+        return
+    _lock_document(doc.id)
+    if DocumentVersion.query.filter_by(document_id=doc.id).first():
+        return
+    db.session.add(DocumentVersion(
+        document_id=doc.id,
+        version_no=1,
+        file_name=doc.file_name,
+        bucket=doc.bucket,
+        object_key=doc.object_key,
+        content_type=doc.content_type,
+        size=doc.size,
+        source="upload",
+        created_at=doc.updated_at or doc.created_at,
+    ))
+    db.session.flush()
+
+
+def record_version(
+    doc: Document,
+    source: str,
+    sha256: Optional[str] = None,
+    created_by: Optional[str] = None,
+) -> DocumentVersion:
+    """把 Document 当前指向的对象记为一个新版本（不提交，由调用方和 Document 一起 commit）"""
+    _lock_document(doc.id)
+    version = DocumentVersion(
+        document_id=doc.id,
+        version_no=_next_version_no(doc.id),
+        file_name=doc.file_name,
+        bucket=doc.bucket,
+        object_key=doc.object_key,
+        content_type=doc.content_type,
+        size=doc.size,
+        sha256=sha256,
+        source=source,
+        created_by=created_by,
+    )
+    db.session.add(version)
+    db.session.flush()
+    return version
+
+
+def apply_retention(doc: Document) -> int:
+    """
+    只保留最近 DOCUMENT_VERSION_KEEP 个版本（在调用方提交新版本之后调用）：
+    更早的版本记录删掉并提交，不再被任何版本 / 当前文档引用的对象交给删除队列、扣减用量
+    返回删除的版本数；失败只记日志
+    """
+    keep = int(current_app.config.get("DOCUMENT_VERSION_KEEP", 0) or 0)
+    if keep <= 0:
+        return 0
+
+    try:
+        versions = list_versions(doc.id)
+        if len(versions) <= keep:
+            return 0
+        kept, dropped = versions[:keep], versions[keep:]
+        # 恢复到旧版本后当前对象可能是一个很早的版本：不删
+        dropped = [v for v in dropped if v.object_key != doc.object_key]
+
+        referenced = {doc.object_key}
+        for v in kept:
+            referenced.update((v.object_key, v.changes_key))
+        objects = {}
+        for v in dropped:
+            for key, size in ((v.object_key, v.size), (v.changes_key, v.changes_size)):
+                if key and key not in referenced:
+                    objects[key] = size
+            db.session.delete(v)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"[DocumentVersion] retention failed | doc_id={doc.id} | error={repr(e)}")
+        return 0
+
+    for key, size in objects.items():
+        delete_queue.schedule_delete(doc.bucket, key)
+        usage_service.record_removed(key, size)
+    if dropped:
+        logger.info(f"[DocumentVersion] PRUNE | doc_id={doc.id} | versions={len(dropped)} | objects={len(objects)}")
+    return len(dropped)
+
+
+def store_changes(doc: Document, version: DocumentVersion, changes_url: str) -> None:
+    """
+    保存 OnlyOffice 的修改记录包（changesurl），失败只记日志
+    放在文档同一 fileType/businessId 前缀下，计入用量
+    """
+    file_type, business_id = usage_service.prefix_of(doc.object_key)
+    changes_key = f"{file_type}/{business_id}/history/{doc.id}/{version.version_no}/changes.zip"
+    try:
+        size, _ = minio_storage.upload_from_url(changes_url, doc.bucket, changes_key, "application/zip")
+        usage_service.record_added(changes_key, size)
+        version.changes_key = changes_key
+        version.changes_size = size
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"[DocumentVersion] store changes failed | doc_id={doc.id} | v={version.version_no} | error={repr(e)}")
+
+
+def restore_version(doc: Document, version: DocumentVersion) -> None:
+    """把 Document 指回某个历史版本的对象（只改元数据，不提交）"""
+    doc.object_key = version.object_key
+    doc.file_name = version.file_name or doc.file_name
+    doc.content_type = version.content_type
+    doc.size = version.size
+    doc.updated_at = datetime.now()
+
+
+def version_objects(doc: Document) -> List[tuple]:
+    """
+    文档所有版本占用的对象（去重）：[(object_key, size, is_current)]，修改记录包也算在内
+    """
+    seen = {}
+    for v in list_versions(doc.id):
+        if v.object_key and v.object_key not in seen:
+            seen[v.object_key] = v.size
+        if v.changes_key and v.changes_key not in seen:
+            seen[v.changes_key] = v.changes_size
+    return [(key, size, key == doc.object_key) for key, size in seen.items()]
+
+
+def drop_versions(doc: Document) -> List[str]:
+    """
+    文档删除时：返回除当前对象外所有历史对象的 key，并删掉版本记录（不提交）
+    当前对象由调用方按原逻辑处理（删除 + 扣减用量）
+    """
+    keys = []
+    for key, size, is_current in version_objects(doc):
+        if is_current:
+            continue
+        keys.append(key)
+        usage_service.record_removed(key, size)
+    DocumentVersion.query.filter_by(document_id=doc.id).delete()
+    return keys
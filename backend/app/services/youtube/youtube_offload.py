@@ -0,0 +1,130 @@
+# backend/app/services/youtube/youtube_offload.py
+"""
+下载完成后转存 MinIO（YOUTUBE_MINIO_OFFLOAD=true 时启用）
+
+- video.mp4 / audio.m4a 按 YOUTUBE/<video_id>/<quality>/<video|audio>.<ext> 流式写入 MinIO
+  （已知长度 + MINIO_UPLOAD_PART_SIZE 分片，multipart 上传，不整体读进内存）
+- 每个文件登记一条 Document（FileType.OTHER，COMPLETED），计入 YOUTUBE/<video_id> 的用量；
+  同一 objectKey 再次转存只更新大小，不重复建记录
+- 转存后本地目录照常参与 LRU 淘汰（YOUTUBE_MINIO_DELETE_LOCAL=true 时立即删除）；
+  本地没有文件时 /api/youtube/download 按 Document 跳转到 MinIO 预签名地址
+"""
+import logging
+import mimetypes
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from flask import current_app
+
+from ..storage import usage_service, version_service
+from ...extensions import db
+from ...models.document import Document, DocumentStatus, FileType
+from ...utils import minio_storage
+
+logger = logging.getLogger(__name__)
+
+OBJECT_PREFIX = "YOUTUBE"
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _object_key(video_id: str, quality: str, file_type: str, path: str) -> str:
+    return f"{OBJECT_PREFIX}/{video_id}/{quality or 'unknown'}/{file_type}{os.path.splitext(path)[1]}"
+
+
+def _upload_file(meta: Dict[str, Any], file_type: str) -> Optional[Tuple[Dict[str, Any], Optional[int]]]:
+    """
+    上传一个本地文件并登记 Document（不提交），没有该文件返回 None
+    返回 (上传信息, 覆盖前的大小；新建时为 None)
+    """
+    path = meta.get(f"{file_type}_path")
+    if not path or not os.path.isfile(path):
+        return None
+
+    video_id = meta["video_id"]
+    bucket = _cfg("MINIO_BUCKET")
+    object_key = _object_key(video_id, meta.get("quality"), file_type, path)
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    size = os.path.getsize(path)
+
+    with open(path, "rb") as f:
+        minio_storage.upload_stream(
+            bucket=bucket,
+            object_key=object_key,
+            data=f,
+            length=size,
+            content_type=content_type,
+            part_size=int(_cfg("MINIO_UPLOAD_PART_SIZE", 10 * 1024 * 1024)),
+        )
+
+    title = re.sub(r'[\\/:*?"<>|]', "_", meta.get("title") or video_id)
+    suffix = "" if file_type == "video" else "_audio"
+    file_name = f"{title[:200]}{suffix}{os.path.splitext(path)[1]}"
+
+    doc = Document.query.filter_by(bucket=bucket, object_key=object_key).first()
+    previous_size = doc.size if doc is not None else None
+    if doc is None:
+        doc = Document(
+            file_name=file_name,
+            file_type=FileType.OTHER,
+            bucket=bucket,
+            object_key=object_key,
+            content_type=content_type,
+            size=size,
+            status=DocumentStatus.COMPLETED,
+        )
+        db.session.add(doc)
+        db.session.flush()
+        version_service.record_version(doc, "youtube")
+    else:
+        doc.file_name = file_name
+        doc.content_type = content_type
+        doc.size = size
+        doc.status = DocumentStatus.COMPLETED
+        doc.updated_at = datetime.now()
+
+    return {"documentId": doc.id, "objectKey": object_key, "size": size}, previous_size
+
+
+def offload(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把一次下载结果转存到 MinIO，返回 {"video": {...}, "audio": {...}}
+    上传失败抛异常、Document 不提交；已写进 MinIO 的对象下次转存同一 key 时覆盖
+    """
+    result = {}
+    previous = {}
+    try:
+        for file_type in ("video", "audio"):
+            uploaded = _upload_file(meta, file_type)
+            if uploaded:
+                result[file_type], previous[file_type] = uploaded
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for file_type, info in result.items():
+        if previous[file_type] is not None:
+            usage_service.record_removed(info["objectKey"], previous[file_type])
+        usage_service.record_added(info["objectKey"], info["size"])
+
+    logger.info(f"[YouTubeOffload] DONE | video_id={meta.get('video_id')} | objects={list(result)}")
+    return result
+
+
+def find_document(video_id: str, file_type: str = "video") -> Optional[Document]:
+    """本地文件已淘汰时按 objectKey 前缀找最近一次转存的 Document"""
+    escaped = re.sub(r"([\\%_])", r"\\\1", video_id)
+    return (
+        Document.query
+        .filter(
+            Document.object_key.like(f"{OBJECT_PREFIX}/{escaped}/%/{file_type}.%", escape="\\"),
+            Document.status == DocumentStatus.COMPLETED,
+        )
+        .order_by(Document.updated_at.desc())
+        .first()
+    )
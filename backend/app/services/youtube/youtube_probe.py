@@ -0,0 +1,115 @@
+# backend/app/services/youtube/youtube_probe.py
+"""
+YouTube 链接预解析（probe）
+
+- 调 yt-dlp extract_info(download=False)，把 sanitize 后的 info JSON 按 video_id 缓存到 Redis
+- 缓存带 TTL（YOUTUBE_PROBE_TTL）：info 里的流地址几个小时后会失效，不能久存
+- 前端展示标题 / 时长 / 缩略图 / 可选清晰度用 summarize 的结果；
+  下载任务开始时用 load_cached 取完整 info，省掉一次 extract_info
+"""
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from flask import current_app
+
+from ..youtube.youtube_service import parse_video_id, probe_info
+from ... import extensions
+
+logger = logging.getLogger(__name__)
+
+INFO_KEY_PREFIX = "yt_info:"
+
+# 下载用不到、体积又大的字段，不进缓存
+_DROP_KEYS = ("automatic_captions", "heatmap")
+
+QUALITY_LABELS = {360: "360p", 480: "480p", 720: "720p", 1080: "1080p", 2160: "2160p"}
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _info_key(video_id: str) -> str:
+    return f"{INFO_KEY_PREFIX}{video_id}"
+
+
+def load_cached(video_id: str) -> Optional[Dict[str, Any]]:
+    """取缓存的完整 info；没有 / Redis 出错返回 None（调用方自己 extract）"""
+    try:
+        raw = _get_redis().get(_info_key(video_id))
+    except Exception as e:
+        logger.error(f"[YouTubeProbe] load cache failed | video_id={video_id} | error={repr(e)}")
+        return None
+    return json.loads(raw) if raw else None
+
+
+def get_info(url: str, refresh: bool = False) -> Tuple[Dict[str, Any], bool]:
+    """
+    返回 (info, 是否命中缓存)
+    refresh=True 时忽略缓存重新解析
+    """
+    video_id = parse_video_id(url)
+    if video_id and not refresh:
+        cached = load_cached(video_id)
+        if cached:
+            return cached, True
+
+    info = probe_info(url)
+    for key in _DROP_KEYS:
+        info.pop(key, None)
+
+    video_id = video_id or info.get("id")
+    if video_id:
+        ttl = int(_cfg("YOUTUBE_PROBE_TTL", 1800))
+        _get_redis().set(_info_key(video_id), json.dumps(info, ensure_ascii=False), ex=ttl)
+        logger.info(f"[YouTubeProbe] CACHE | video_id={video_id} | ttl={ttl}")
+    return info, False
+
+
+def summarize(info: Dict[str, Any]) -> Dict[str, Any]:
+    """给前端展示用的精简信息"""
+    formats = []
+    heights = set()
+    for f in info.get("formats") or []:
+        vcodec = f.get("vcodec") or "none"
+        acodec = f.get("acodec") or "none"
+        if vcodec == "none" and acodec == "none":
+            continue  # storyboard 之类
+        if vcodec != "none" and f.get("height"):
+            heights.add(f["height"])
+        formats.append({
+            "format_id": f.get("format_id"),
+            "ext": f.get("ext"),
+            "height": f.get("height"),
+            "fps": f.get("fps"),
+            "vcodec": vcodec,
+            "acodec": acodec,
+            "filesize": f.get("filesize") or f.get("filesize_approx"),
+            "tbr": f.get("tbr"),
+        })
+
+    # 可选清晰度：下载时按“<= 目标高度”选流，所以只列出不超过实际最高分辨率的档位
+    max_height = max(heights) if heights else 0
+    qualities = [label for h, label in sorted(QUALITY_LABELS.items()) if h <= max_height]
+
+    return {
+        "video_id": info.get("id"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "thumbnail": info.get("thumbnail"),
+        "uploader": info.get("uploader"),
+        "upload_date": info.get("upload_date"),
+        "view_count": info.get("view_count"),
+        "qualities": qualities,
+        "formats": formats,
+    }
@@ -1,6 +1,8 @@
 # backend/app/services/youtube_service.py
 import logging
 import os
+import shutil
+import subprocess
 import uuid
 import json
 from urllib.parse import urlparse, parse_qs
@@ -13,14 +15,13 @@ from backend.app.config import Config
 logger = logging.getLogger(__name__)
 
 
-def extract_video_id(url: str) -> str:
+def parse_video_id(url: str) -> str | None:
     """
-    从 YouTube URL 中尽量提取 video_id。
+    从 YouTube URL 中提取 video_id，识别不了返回 None。
 
     支持：
       - https://www.youtube.com/watch?v=xxxx
       - https://youtu.be/xxxx
-    其余情况就生成一个随机 id，防止报错。
     """
     parsed = urlparse(url)
     qs = parse_qs(parsed.query)
@@ -31,10 +32,17 @@ def extract_video_id(url: str) -> str:
 
     # youtu.be 短链
     if "youtu.be" in parsed.netloc:
-        return parsed.path.lstrip("/")
+        return parsed.path.lstrip("/") or None
+
+    return None
+
 
+def extract_video_id(url: str) -> str:
+    """
+    从 YouTube URL 中尽量提取 video_id，其余情况就生成一个随机 id，防止报错。
+    """
     # 其他情况兜底
-    return uuid.uuid4().hex[:10]
+    return parse_video_id(url) or uuid.uuid4().hex[:10]
 
 
 def _build_video_format(quality: str) -> str:
@@ -42,9 +50,8 @@ def _build_video_format(quality: str) -> str:
     根据清晰度构造一个“尽量匹配、永远有兜底”的 format 表达式。
 
     逻辑：
-      - 有目标高度：优先选 <= 目标高度 且 mp4 的 best；
-      - 再退到 <= 目标高度 的任意容器；
-      - 再退到 mp4；
+      - 优先分轨：<= 目标高度的纯视频流（mp4 优先）+ 纯音频流（m4a 优先），一次下载两路；
+      - 没有分轨时退到 <= 目标高度的有声单文件（mp4 优先）；
       - 最后退到完全不限制的 best（几乎不可能选不到）。
     """
     height_map = {
@@ -55,76 +62,208 @@ def _build_video_format(quality: str) -> str:
         "2160p": 2160,  # 4K
     }
     target_h = height_map.get(quality)
+    h = f"[height<={target_h}]" if target_h else ""
 
-    if target_h:
-        return (
-            f"best[height<={target_h}][ext=mp4]/"  # 优先：<=目标高度的 mp4
-            f"best[height<={target_h}]/"          # 其次：<=目标高度的任意容器
-            "best[ext=mp4]/"                      # 再次：最佳的 mp4
-            "best"                                # 兜底：能下什么下什么
-        )
-    else:
-        # 没传清晰度时的兜底：优先 mp4，其次任意 best
-        return "best[ext=mp4]/best"
+    return (
+        f"bv{h}[ext=mp4]+ba[ext=m4a]/"  # 优先：mp4 视频 + m4a 音频，合并只需流复制
+        f"bv{h}+ba/"                     # 其次：任意容器的分轨
+        f"b{h}[ext=mp4]/b{h}/"           # 没有分轨：有声单文件
+        "best"                           # 兜底：能下什么下什么
+    )
 
-def _download_once(
-    url: str,
-    fmt: str,
-    outtmpl: str,
-    merge_output_format: str | None = None,
-):
-    proxy = Config.PROXY_URL
 
-    logger.info(f"[yt-dlp] Start download | url={url} | fmt={fmt} | out={outtmpl} | proxy={proxy}")
+ENGINE_OPTION_KEYS = ("concurrent_fragment_downloads", "http_chunk_size", "buffersize", "ratelimit")
+
 
-    ydl_opts: dict = {
-        "format": fmt,
-        "outtmpl": outtmpl,
+def resolve_profile(name: str | None = None) -> tuple[str, dict]:
+    """下载档位名 -> (档位名, yt-dlp 参数)；未知档位抛 ValueError"""
+    name = name or Config.YOUTUBE_DOWNLOAD_PROFILE
+    profiles = Config.YOUTUBE_DOWNLOAD_PROFILES
+    if name not in profiles:
+        raise ValueError(f"unknown download profile: {name}")
+    return name, {k: v for k, v in profiles[name].items() if k in ENGINE_OPTION_KEYS and v is not None}
+
+
+class _ThroughputMeter:
+    """yt-dlp 进度回调：累计每个文件下载完成时的字节数和耗时（不含合并 / remux）"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def __call__(self, d: dict) -> None:
+        if d.get("status") != "finished":
+            return
+        self.bytes += d.get("total_bytes") or d.get("downloaded_bytes") or 0
+        self.seconds += d.get("elapsed") or 0
+
+    def stats(self, profile: str) -> dict:
+        return {
+            "profile": profile,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "throughput_bps": int(self.bytes / self.seconds) if self.seconds > 0 else None,
+        }
+
+
+def _ydl_opts(**extra) -> dict:
+    """yt-dlp 公共参数（代理 / 静默 / 不展开播放列表 / 断点续传）"""
+    opts: dict = {
         "quiet": True,
         "noprogress": True,
         "noplaylist": True,
         "no_keep_fragments": True,
+        # 输出文件名固定（video.f<id>.<ext>），任务被中断后重跑会从 .part / .ytdl 续传
+        "continuedl": True,
+        "nopart": False,
     }
+    if Config.PROXY_URL:
+        opts["proxy"] = Config.PROXY_URL
+    opts.update(extra)
+    return opts
+
+
+def extract_info(url: str) -> dict:
+    """只解析元数据和可用格式，不下载"""
+    logger.info(f"[yt-dlp] Extract info | url={url} | proxy={Config.PROXY_URL}")
+    with YoutubeDL(_ydl_opts()) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def expand_urls(urls: list[str], max_items: int = 500) -> list[dict]:
+    """
+    把一组 URL（单个视频 / 播放列表 / 频道）展开成视频列表 [{"id", "url", "title"}]，按 video_id 去重
+    - 普通视频链接不请求网络
+    - 播放列表用 extract_flat 只拉列表，不解析每个视频的格式
+    """
+    videos: dict[str, dict] = {}
+    for url in urls:
+        if len(videos) >= max_items:
+            break
+        video_id = parse_video_id(url)
+        if video_id and "list" not in parse_qs(urlparse(url).query):
+            videos.setdefault(video_id, {"id": video_id, "url": url, "title": None})
+            continue
+
+        logger.info(f"[yt-dlp] Expand playlist | url={url}")
+        with YoutubeDL(_ydl_opts(noplaylist=False, extract_flat="in_playlist", playlistend=max_items)) as ydl:
+            info = ydl.extract_info(url, download=False)
+        entries = info.get("entries") if info.get("_type") == "playlist" else [info]
+        for entry in entries or []:
+            # 频道首页展开出来的是子列表（Videos / Shorts ...），这里只收视频
+            if not entry or entry.get("ie_key") not in (None, "Youtube") or not entry.get("id"):
+                continue
+            videos.setdefault(entry["id"], {
+                "id": entry["id"],
+                "url": f"https://www.youtube.com/watch?v={entry['id']}",
+                "title": entry.get("title"),
+            })
+            if len(videos) >= max_items:
+                break
+    return list(videos.values())
+
+
+def probe_info(url: str) -> dict:
+    """extract_info 并转成可 JSON 序列化的 dict（可放进 Redis，之后直接交给 _download_once）"""
+    return YoutubeDL.sanitize_info(extract_info(url))
 
-    if proxy:
-        ydl_opts["proxy"] = proxy
-        logger.info(f"[yt-dlp] Using proxy: {proxy}")
 
-    if merge_output_format:
-        ydl_opts["merge_output_format"] = merge_output_format
+def _download_once(
+    info: dict,
+    fmt: str,
+    outtmpl: str,
+    progress_hooks: list | None = None,
+    engine_opts: dict | None = None,
+) -> dict:
+    """
+    基于已解析的 info 下载（不再请求一次元数据），返回 yt-dlp 的下载结果（requested_downloads 里有文件路径）
 
+    - 分轨时 yt-dlp 用 ffmpeg 流复制（-c copy）合并成 mp4，keepvideo 保留原始视频 / 音频流文件
+    - 单文件不是 mp4 时只做 remux，不转码（remux 前的原文件由 download_youtube_video 删除）
+    - engine_opts：下载档位参数（分片并发数 / 分块大小 / 缓冲区 / 限速）
+    """
+    opts = _ydl_opts(
+        format=fmt,
+        outtmpl=outtmpl,
+        merge_output_format="mp4",
+        keepvideo=True,
+        postprocessors=[{"key": "FFmpegVideoRemuxer", "preferedformat": "mp4"}],
+        **(engine_opts or {}),
+    )
+    if progress_hooks:
+        opts["progress_hooks"] = progress_hooks
+
+    logger.info(f"[yt-dlp] Start download | id={info.get('id')} | fmt={fmt} | out={outtmpl}")
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filepath = ydl.prepare_filename(info)
-            logger.info(f"[yt-dlp] Download success | output={filepath}")
+        with YoutubeDL(opts) as ydl:
+            result = ydl.process_ie_result(dict(info), download=True)
     except Exception as e:
-        logger.error(f"[yt-dlp] Download failed | url={url} | error={repr(e)}")
+        logger.error(f"[yt-dlp] Download failed | id={info.get('id')} | error={repr(e)}")
         raise
+    logger.info(f"[yt-dlp] Download success | id={info.get('id')}")
+    return result
+
 
-    # 处理 mp4 合并情况
-    if merge_output_format:
-        base, ext = os.path.splitext(filepath)
-        mp4_path = base + ".mp4"
-        if ext.lower() != ".mp4" and os.path.exists(mp4_path):
-            logger.info(f"[yt-dlp] Auto-merged to MP4: {mp4_path}")
-            filepath = mp4_path
+def _download_with_fallback(
+    info: dict,
+    quality: str,
+    outtmpl: str,
+    progress_hooks: list | None = None,
+    engine_opts: dict | None = None,
+) -> dict:
+    """按清晰度表达式下载，失败再退到 best"""
+    try:
+        return _download_once(info, _build_video_format(quality), outtmpl, progress_hooks, engine_opts)
+    except DownloadError as e:
+        logger.error(f"[yt-dlp] primary format failed: {e}. Try fallback 'best' ...")
+        return _download_once(info, "best", outtmpl, progress_hooks, engine_opts)
 
-    return info, filepath
 
+def _has_video(f: dict) -> bool:
+    return (f.get("vcodec") or "none") != "none"
 
 
-def download_youtube_video(url: str, quality: str = "720p"):
+def _has_audio(f: dict) -> bool:
+    return (f.get("acodec") or "none") != "none"
+
+
+def _ffmpeg(*args: str) -> None:
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found")
+    cmd = [ffmpeg, "-y", "-hide_banner", "-loglevel", "error", *args]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {proc.stderr.strip()[-500:]}")
+
+
+def download_youtube_video(
+    url: str,
+    quality: str = "720p",
+    progress_hooks: list | None = None,
+    info: dict | None = None,
+    profile: str | None = None,
+):
     """
     下载 YouTube 视频（后端核心逻辑）：
 
     1. 解析出 video_id，为每个视频分配一个独立目录：
          <YOUTUBE_DOWNLOAD_DIR>/<video_id>/
-    2. 按清晰度偏好下载一个“有画面 + 有声音”的 mp4（若是分轨则自动合并）；
-    3. 另外再单独下载一份 bestaudio（例如 m4a），不合并，单独保存；
-    4. 将元数据写入 meta.json，方便以后重启后按 video_id 重新找到文件；
-    5. 返回一个 dict，包含绝对路径、大小等信息，供任务系统 / 接口使用。
+    2. extract_info 只调用一次；按清晰度偏好一次性拉取 纯视频流 + 纯音频流，
+       本地用 ffmpeg 流复制合成 video.mp4，原始音频流保留为 audio.m4a（音频不再单独下载第二遍）；
+       没有分轨时下载有声单文件，并从中流复制出音频轨；
+    3. 将元数据写入 meta.json，方便以后重启后按 video_id 重新找到文件；
+    4. 返回一个 dict，包含绝对路径、大小等信息，供任务系统 / 接口使用。
+
+    progress_hooks 透传给 yt-dlp（任务系统用来上报进度 / 响应取消）
+    info：已经解析好的元数据（probe 缓存），传了就不再 extract_info；
+          缓存里的流地址过期导致下载失败时重新解析一次再下
+    profile：下载档位（YOUTUBE_DOWNLOAD_PROFILES），返回值的 download 字段里带本次吞吐统计
     """
+    profile, engine_opts = resolve_profile(profile)
+    meter = _ThroughputMeter()
+    hooks = [meter, *(progress_hooks or [])]
+
     # 根目录：配置中指定，例如 /data/youtube
     root_dir = Config.YOUTUBE_DOWNLOAD_DIR
     os.makedirs(root_dir, exist_ok=True)
@@ -136,54 +275,66 @@ def download_youtube_video(url: str, quality: str = "720p"):
 
     # 固定文件名，方便前端/其他服务访问
     video_outtmpl = os.path.join(base_dir, "video.%(ext)s")
-    audio_outtmpl = os.path.join(base_dir, "audio.%(ext)s")
 
-    # ========== 第 1 步：视频（有声，有兜底） ==========
-    primary_fmt = _build_video_format(quality)
-    fallback_fmt = "best"  # 极简兜底：永远存在
+    # ========== 第 1 步：解析一次元数据（有缓存就直接用） ==========
+    vinfo = info or extract_info(url)
 
+    # ========== 第 2 步：视频 + 音频一次拉取（有兜底） ==========
     try:
-        vinfo, video_path = _download_once(
-            url,
-            fmt=primary_fmt,
-            outtmpl=video_outtmpl,
-            merge_output_format="mp4",  # 如是分轨，会用 ffmpeg 合并成 mp4
-        )
+        result = _download_with_fallback(vinfo, quality, video_outtmpl, hooks, engine_opts)
     except DownloadError as e:
-        logger.error(f"[yt-dlp] primary format failed: {e}. Try fallback 'best' ...")
-        vinfo, video_path = _download_once(
-            url,
-            fmt=fallback_fmt,
-            outtmpl=video_outtmpl,
-            merge_output_format="mp4",
-        )
-
-    # 兜一下最终的视频文件名，理论上就是 video.mp4
-    video_abs_path = video_path
-    if not os.path.basename(video_abs_path).lower().endswith(".mp4"):
-        # 如果扩展名不是 mp4，但目录下出现了 video.mp4，则优先用固定名
-        candidate = os.path.join(base_dir, "video.mp4")
-        if os.path.exists(candidate):
-            video_abs_path = candidate
+        if info is None:
+            raise
+        logger.warning(f"[yt-dlp] cached info failed: {e}. Re-extract ...")
+        vinfo = extract_info(url)
+        result = _download_with_fallback(vinfo, quality, video_outtmpl, hooks, engine_opts)
+    stats = meter.stats(profile)
+    logger.info(
+        f"[yt-dlp] Throughput | id={vinfo.get('id')} | profile={profile} | bytes={stats['bytes']} "
+        f"| seconds={stats['seconds']} | bps={stats['throughput_bps']}"
+    )
+
+    download = (result.get("requested_downloads") or [{}])[0]
+    video_abs_path = download.get("filepath") or os.path.join(base_dir, "video.mp4")
+    if not video_abs_path.lower().endswith(".mp4") and os.path.exists(os.path.join(base_dir, "video.mp4")):
+        video_abs_path = os.path.join(base_dir, "video.mp4")
+
+    # ========== 第 3 步：整理音频（保留原始音频流，删掉已合并的纯视频流） ==========
+    audio_abs_path = None
+    for part in download.get("requested_formats") or []:
+        part_path = part.get("filepath")
+        if not part_path or not os.path.exists(part_path) or part_path == video_abs_path:
+            continue
+        if _has_audio(part) and not _has_video(part) and audio_abs_path is None:
+            audio_abs_path = os.path.join(base_dir, "audio" + os.path.splitext(part_path)[1])
+            os.replace(part_path, audio_abs_path)
+        else:
+            os.remove(part_path)
+
+    # 单文件不是 mp4 时 remux 出 video.mp4；keepvideo 对 remux 也生效，原文件（如 video.webm）在这里删掉
+    pre_remux_path = download.get("_filename")
+    if (
+        not download.get("requested_formats")
+        and pre_remux_path
+        and os.path.abspath(pre_remux_path) != os.path.abspath(video_abs_path)
+        and os.path.exists(pre_remux_path)
+        and os.path.exists(video_abs_path)
+    ):
+        os.remove(pre_remux_path)
+
+    if audio_abs_path is None and os.path.exists(video_abs_path):
+        # 有声单文件：尝试把音频轨原样复制出来（编码不兼容 m4a 就放弃）
+        candidate = os.path.join(base_dir, "audio.m4a")
+        try:
+            _ffmpeg("-i", video_abs_path, "-vn", "-c:a", "copy", candidate)
+            audio_abs_path = candidate
+        except RuntimeError as e:
+            logger.error(f"[yt-dlp] extract audio failed: {e}")
 
     video_size = os.path.getsize(video_abs_path) if os.path.exists(video_abs_path) else None
+    audio_size = os.path.getsize(audio_abs_path) if audio_abs_path and os.path.exists(audio_abs_path) else None
 
-    # ========== 第 2 步：额外下载一份音频（不合并，保留） ==========
-    try:
-        ainfo, audio_path = _download_once(
-            url,
-            fmt="bestaudio[ext=m4a]/bestaudio",
-            outtmpl=audio_outtmpl,
-            merge_output_format=None,  # 音频不用合并
-        )
-        audio_abs_path = audio_path
-        audio_size = os.path.getsize(audio_abs_path) if os.path.exists(audio_abs_path) else None
-    except DownloadError as e:
-        logger.error(f"[yt-dlp] download audio failed: {e}")
-        audio_abs_path = None
-        audio_size = None
-
-    # ========== 第 3 步：写 meta.json，方便重启后用 video_id 找回 ==========
+    # ========== 第 4 步：写 meta.json，方便重启后用 video_id 找回 ==========
     meta = {
         "video_id": video_id,
         "title": vinfo.get("title"),
@@ -193,7 +344,7 @@ def download_youtube_video(url: str, quality: str = "720p"):
         "dir": base_dir,
         # 相对路径（相对 base_dir），用于将来如果要做静态挂载之类
         "video_rel_path": "video.mp4",
-        "audio_rel_path": "audio.m4a" if audio_abs_path else None,
+        "audio_rel_path": os.path.basename(audio_abs_path) if audio_abs_path else None,
         # 绝对路径（当前 send_file 用这个最方便）
         "video_path": video_abs_path,
         "audio_path": audio_abs_path,
@@ -209,5 +360,5 @@ def download_youtube_video(url: str, quality: str = "720p"):
         # 写 meta 失败不影响下载主流程，只打个日志
         logger.error(f"[yt-dlp] write meta.json failed: {e}")
 
-    # ========== 第 4 步：返回信息给调用方（任务系统 / API） ==========
-    return meta
+    # ========== 第 5 步：返回信息给调用方（任务系统 / API），吞吐统计不写进 meta.json ==========
+    return {**meta, "download": stats}
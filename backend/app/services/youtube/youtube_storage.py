@@ -0,0 +1,183 @@
+# backend/app/services/youtube/youtube_storage.py
+"""
+YouTube 下载目录的容量控制
+
+- 每个视频一个目录 <YOUTUBE_DOWNLOAD_DIR>/<video_id>/，淘汰以整个目录为单位
+- 最近访问时间记在 Redis zset（score = 时间戳）：/api/youtube/download 和任务完成时更新；
+  没有记录的目录（旧数据 / Redis 清空过）按目录 mtime 算
+- 新任务开始下载前：当前占用 + 预留空间 > YOUTUBE_DISK_QUOTA_BYTES 时按 LRU 删目录，
+  正在下载的目录（持有 video 锁）和一天内留有 .part / .ytdl 的目录（等待续传）不删
+- YOUTUBE_DISK_QUOTA_BYTES = 0 表示不限制
+- lookup_file：video_id -> 文件绝对路径，优先查 Redis 索引，没有再读 meta.json 并回填
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from ... import extensions
+
+logger = logging.getLogger(__name__)
+
+ACCESS_KEY = "yt_video_access"              # zset：video_id -> 最近访问时间
+VIDEO_INDEX_PREFIX = "yt_video:"            # hash yt_video:<video_id>，field = 清晰度，value = meta JSON
+VIDEO_LOCK_PREFIX = "yt_video_lock:"        # 每个 video 目录一把锁（下载中）
+EVICT_LOCK_KEY = "yt_video_evict:lock"
+PARTIAL_KEEP_SECONDS = 24 * 3600            # 未完成下载的续传窗口（同任务 TTL）
+PARTIAL_SUFFIXES = (".part", ".ytdl")
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def _get_redis():
+    rc = extensions.redis_client
+    if rc is None:
+        raise RuntimeError(
+            "redis_client is not initialized. Did you call init_extensions(app)?"
+        )
+    return rc
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def read_meta(video_id: str) -> Optional[Dict[str, Any]]:
+    """读 <video_id>/meta.json，不存在或损坏返回 None"""
+    meta_file = os.path.join(_cfg("YOUTUBE_DOWNLOAD_DIR"), video_id, "meta.json")
+    try:
+        # 指定 encoding='utf-8'，避免 Windows 默认 gbk 导致 UnicodeDecodeError
+        with open(meta_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def lookup_file(video_id: str, file_type: str = "video") -> Optional[str]:
+    """
+    video_id + video|audio -> 文件绝对路径；找不到 / 文件已被清理返回 None
+    只返回下载目录内的路径（video_id 来自请求参数）
+    """
+    if not _VIDEO_ID_RE.match(video_id or ""):
+        return None
+
+    r = _get_redis()
+    index_key = f"{VIDEO_INDEX_PREFIX}{video_id}"
+    raws = r.hvals(index_key)
+    meta = json.loads(raws[0]) if raws else None
+    if meta is None:
+        meta = read_meta(video_id)
+        if meta is None:
+            return None
+        r.hset(index_key, meta.get("quality") or "unknown", json.dumps(meta))
+
+    path = meta.get(f"{file_type}_path")
+    if not path:
+        return None
+
+    # 防御性处理：统一斜杠 & 相对路径（相对该 video_id 的目录）
+    root_dir = os.path.abspath(_cfg("YOUTUBE_DOWNLOAD_DIR"))
+    path = path.replace("\\", os.sep)
+    if not os.path.isabs(path):
+        path = os.path.join(root_dir, video_id, path.lstrip("\\/"))
+    path = os.path.abspath(path)
+
+    if os.path.commonpath([root_dir, path]) != root_dir or not os.path.isfile(path):
+        r.delete(index_key)
+        return None
+    return path
+
+
+def touch(video_id: str) -> None:
+    """记录一次访问；失败只记日志，不影响下载"""
+    try:
+        _get_redis().zadd(ACCESS_KEY, {video_id: time.time()})
+    except Exception as e:
+        logger.error(f"[YouTubeStorage] touch failed | video_id={video_id} | error={repr(e)}")
+
+
+def _dir_stat(path: str) -> Tuple[int, float]:
+    """(目录总字节数, 最近一个未完成下载文件的 mtime；没有为 0)"""
+    total = 0
+    partial_mtime = 0.0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue  # 下载线程可能正在改名 / 删除临时文件
+            total += st.st_size
+            if name.endswith(PARTIAL_SUFFIXES):
+                partial_mtime = max(partial_mtime, st.st_mtime)
+    return total, partial_mtime
+
+
+def _scan() -> List[Tuple[float, str, int, float]]:
+    """下载目录下所有视频目录：[(最近访问时间, video_id, 字节数, 未完成文件 mtime)]"""
+    root_dir = _cfg("YOUTUBE_DOWNLOAD_DIR")
+    r = _get_redis()
+    entries = []
+    try:
+        it = os.scandir(root_dir)
+    except FileNotFoundError:
+        return entries
+    with it:
+        for entry in it:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            last_access = r.zscore(ACCESS_KEY, entry.name)
+            if last_access is None:
+                last_access = entry.stat(follow_symlinks=False).st_mtime
+            entries.append((last_access, entry.name, *_dir_stat(entry.path)))
+    return entries
+
+
+def evict(video_id: str) -> None:
+    """删除一个视频目录及其索引"""
+    path = os.path.join(_cfg("YOUTUBE_DOWNLOAD_DIR"), video_id)
+    shutil.rmtree(path, ignore_errors=True)
+    r = _get_redis()
+    r.zrem(ACCESS_KEY, video_id)
+    r.delete(f"{VIDEO_INDEX_PREFIX}{video_id}")
+
+
+def ensure_space(reserve_bytes: Optional[int] = None, keep: Optional[str] = None) -> int:
+    """
+    为即将开始的下载腾出空间，返回释放的字节数
+    reserve_bytes：本次下载预计占用，默认 YOUTUBE_DOWNLOAD_RESERVE_BYTES
+    keep：不参与淘汰的 video_id（当前任务自己的目录）
+    """
+    quota = int(_cfg("YOUTUBE_DISK_QUOTA_BYTES", 0) or 0)
+    if quota <= 0:
+        return 0
+    if reserve_bytes is None:
+        reserve_bytes = int(_cfg("YOUTUBE_DOWNLOAD_RESERVE_BYTES", 0) or 0)
+
+    r = _get_redis()
+    # 多个下载线程同时开始时串行淘汰，避免按同一份快照重复删除
+    with r.lock(EVICT_LOCK_KEY, timeout=120, blocking_timeout=30):
+        entries = sorted(_scan())
+        used = sum(size for _, _, size, _ in entries)
+        freed = 0
+        now = time.time()
+        for _, vid, size, partial_mtime in entries:
+            if used - freed + reserve_bytes <= quota:
+                break
+            if vid == keep or r.exists(f"{VIDEO_LOCK_PREFIX}{vid}"):
+                continue
+            if partial_mtime and now - partial_mtime < PARTIAL_KEEP_SECONDS:
+                continue
+            evict(vid)
+            freed += size
+            logger.info(f"[YouTubeStorage] EVICT | video_id={vid} | size={size}")
+
+    if used - freed + reserve_bytes > quota:
+        logger.warning(
+            f"[YouTubeStorage] quota still exceeded | used={used - freed} | reserve={reserve_bytes} | quota={quota}"
+        )
+    return freed
@@ -1,17 +1,73 @@
 # backend/app/services/youtube_tasks.py
+"""
+YouTube 下载任务
+
+- create_task 只把 task_id 放进 Redis 队列（LPUSH），不再每个请求起一个线程
+- 下载线程池从队列取任务执行；全局并发由 YOUTUBE_MAX_CONCURRENCY 个“槽位锁”限制，
+  跨 gunicorn worker / 独立 worker 进程都生效（槽位锁带超时，进程挂掉后自动释放）
+- 线程池可以跑在 Web 进程里（YOUTUBE_WORKER_MODE=embedded），
+  也可以跑在独立进程里（YOUTUBE_WORKER_MODE=external + python youtube_worker.py）
+- 支持查询排队位置、取消任务（排队中直接移出队列；运行中通过 yt-dlp 进度回调中断）
+- yt-dlp 进度回调上报已下载字节 / 速度 / ETA，每个任务最多每 YOUTUBE_PROGRESS_INTERVAL 秒写一次 Redis
+  （只 HSET 进度字段，不改 status）
+- 去重：同一 video_id + 清晰度已下载过（Redis 索引 / meta.json）直接返回结果；
+  正在下载的相同请求挂到同一个任务上；同一个 video 目录同时只允许一个任务写
+- 开始下载前按 YOUTUBE_DISK_QUOTA_BYTES 做 LRU 淘汰（见 youtube_storage）
+- probe 接口缓存的 info 直接交给下载，不再重复 extract_info（见 youtube_probe）
+- 每个任务可选下载档位（profile），结果里带本次吞吐；各档位累计吞吐记在 yt_profile_stats:<profile>
+- YOUTUBE_MINIO_OFFLOAD=true 时下载完成后转存 MinIO 并登记 Document（见 youtube_offload）
+- 批量任务：播放列表 / 多个 URL 展开成父任务 + 子任务；每个批次同时在队列里的子任务不超过
+  YOUTUBE_BATCH_CONCURRENCY，其余放在 backlog，子任务结束（或查询批次）时补齐
+- 任务存成 hash（每个字段一个 JSON 值，None 字段不存），另有按创建时间 / 按状态的 zset 索引，
+  列表接口直接按索引分页，不用 KEYS 扫描
+- 租约：worker 用 BLMOVE 把任务移进 yt_task:claiming（出队和占租约之间的窗口里恢复巡检不会动它），
+  随即写 yt_task:lease:<task_id>（带 TTL）再移出 claiming，执行期间随心跳续期；
+  进程被杀后租约过期，恢复巡检把 running / 已出队的 pending 任务放回队头，
+  yt-dlp 按固定文件名续传 .part，不从零开始；超过 YOUTUBE_TASK_MAX_ATTEMPTS 次记为失败
+"""
+import os
 import logging
+import socket
 import threading
+import time
 import uuid
 import json
-from typing import Dict, Any, Optional
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from flask import current_app
+from redis.exceptions import ResponseError
+from yt_dlp.utils import DownloadCancelled
 
-from ..youtube.youtube_service import download_youtube_video
+from ..youtube import youtube_offload, youtube_probe, youtube_storage
+from ..youtube.youtube_service import download_youtube_video, parse_video_id
+from ..youtube.youtube_storage import VIDEO_INDEX_PREFIX, VIDEO_LOCK_PREFIX
+from ...utils.background import start_background_worker
 from ... import extensions
 
 logger = logging.getLogger(__name__)
 
 TASK_KEY_PREFIX = "yt_task:"
 TASK_TTL_SECONDS = 24 * 3600  # 任务信息保留 24 小时，可按需调整
+QUEUE_KEY = "yt_task:queue"                 # LPUSH 入队，RPOP 出队（右端是队头）
+CLAIMING_KEY = "yt_task:claiming"           # 已出队、租约还没写上的任务
+CLAIMS_KEY = "yt_task:claims"               # hash：claiming 里的 task_id -> 巡检第一次看到的时间
+CANCEL_KEY_PREFIX = "yt_task:cancel:"       # 运行中任务的取消标记
+SLOT_KEY_PREFIX = "yt_worker:slot:"         # 全局并发槽位锁
+SLOT_TIMEOUT_SECONDS = 60
+INFLIGHT_PREFIX = "yt_inflight:"            # yt_inflight:<video_id>:<quality> -> 正在执行的 task_id
+PROFILE_STATS_PREFIX = "yt_profile_stats:"  # hash：downloads / bytes / seconds
+BATCH_BACKLOG_PREFIX = "yt_batch:backlog:"  # list：批次里还没提交的子任务 URL
+BATCH_LOCK_PREFIX = "yt_batch:lock:"
+LEASE_KEY_PREFIX = "yt_task:lease:"                  # 任务租约（值为 worker 标识）
+RECOVER_LOCK_KEY = "yt_task:recover_lock"
+INDEX_CREATED_KEY = "yt_task:index:created"         # zset：task_id -> created_at
+INDEX_STATUS_PREFIX = "yt_task:index:status:"       # zset（每个状态一个）：task_id -> created_at
+TASK_STATUSES = ("pending", "running", "finished", "error", "cancelled")
+
+
+class TaskCancelled(DownloadCancelled):
+    msg = "Task cancelled"
 
 
 def _get_redis():
@@ -23,32 +79,150 @@ def _get_redis():
     return rc
 
 
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
 def _task_key(task_id: str) -> str:
     return f"{TASK_KEY_PREFIX}{task_id}"
 
 
-def _load_task(task_id: str) -> Optional[Dict[str, Any]]:
-    """从 Redis 读取任务"""
-    r = _get_redis()
-    raw = r.get(_task_key(task_id))
+def _decode_task(task_id: str, raw) -> Optional[Dict[str, Any]]:
+    """hash -> dict；兼容升级前整个任务一个 JSON 字符串的旧格式"""
     if not raw:
         return None
     try:
+        if isinstance(raw, dict):
+            return {k: json.loads(v) for k, v in raw.items()}
         return json.loads(raw)
     except Exception as e:
-        logger.error(f"[Task] decode task json failed | task_id={task_id} | error={repr(e)}")
+        logger.error(f"[Task] decode task failed | task_id={task_id} | error={repr(e)}")
         return None
 
 
+def _load_task(task_id: str) -> Optional[Dict[str, Any]]:
+    """从 Redis 读取任务"""
+    r = _get_redis()
+    try:
+        raw = r.hgetall(_task_key(task_id))
+    except ResponseError:
+        # WRONGTYPE：升级前写入的 JSON 字符串
+        raw = r.get(_task_key(task_id))
+    return _decode_task(task_id, raw)
+
+
 def _save_task(task_id: str, data: Dict[str, Any]) -> None:
-    """把任务写回 Redis，并设置 TTL"""
+    """
+    把任务写回 Redis（hash，值为 None 的字段删除），设置 TTL，并更新状态 / 创建时间索引
+    """
+    key = _task_key(task_id)
+    fields = {k: json.dumps(v) for k, v in data.items() if v is not None}
+    empty = [k for k, v in data.items() if v is None]
+    created_at = data.get("created_at") or time.time()
+    status = data.get("status")
+
+    r = _get_redis()
+
+    def _write():
+        pipe = r.pipeline()
+        if empty:
+            pipe.hdel(key, *empty)
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, TASK_TTL_SECONDS)
+        pipe.zadd(INDEX_CREATED_KEY, {task_id: created_at})
+        for s in TASK_STATUSES:
+            if s == status:
+                pipe.zadd(f"{INDEX_STATUS_PREFIX}{s}", {task_id: created_at})
+            else:
+                pipe.zrem(f"{INDEX_STATUS_PREFIX}{s}", task_id)
+        pipe.execute()
+
+    try:
+        _write()
+    except ResponseError:
+        # WRONGTYPE：升级前的 JSON 字符串，删掉后整体改写成 hash
+        r.delete(key)
+        _write()
+
+
+def _update_fields(task_id: str, data: Dict[str, Any]) -> None:
+    """
+    只改任务 hash 的部分字段（不读旧值、不碰 status 和索引），
+    并发的取消 / 状态变更不会被覆盖回去；任务已过期或是旧格式则跳过
+    """
+    key = _task_key(task_id)
+    fields = {k: json.dumps(v) for k, v in data.items() if v is not None}
+    empty = [k for k, v in data.items() if v is None]
     r = _get_redis()
-    r.set(_task_key(task_id), json.dumps(data), ex=TASK_TTL_SECONDS)
+    try:
+        if not r.exists(key):
+            return
+        pipe = r.pipeline()
+        if empty:
+            pipe.hdel(key, *empty)
+        if fields:
+            pipe.hset(key, mapping=fields)
+        pipe.execute()
+    except ResponseError:
+        pass  # WRONGTYPE：升级前的 JSON 字符串，进度下次整体写入时再更新
+
+
+def _index_key(video_id: str) -> str:
+    return f"{VIDEO_INDEX_PREFIX}{video_id}"
+
+
+def _inflight_key(video_id: str, quality: str) -> str:
+    return f"{INFLIGHT_PREFIX}{video_id}:{quality}"
 
 
-def create_task(url: str, quality: str = "720p") -> str:
-    """创建任务，启动后台线程执行下载，返回 task_id"""
+def find_cached(video_id: str, quality: str) -> Optional[Dict[str, Any]]:
+    """
+    已下载结果：先查 Redis 索引，没有再看磁盘上的 meta.json（重启 / 索引丢失时回填）
+    文件已不在（被清理）时返回 None 并删掉索引
+    """
+    r = _get_redis()
+    raw = r.hget(_index_key(video_id), quality)
+    meta = json.loads(raw) if raw else None
+
+    if meta is None:
+        meta = youtube_storage.read_meta(video_id)
+        if meta is None or meta.get("quality") != quality:
+            return None
+
+    if not meta.get("video_path") or not os.path.exists(meta["video_path"]):
+        r.hdel(_index_key(video_id), quality)
+        return None
+
+    if raw is None:
+        r.hset(_index_key(video_id), quality, json.dumps(meta))
+    return meta
+
+
+def _index_result(video_id: str, quality: str, meta: Dict[str, Any]) -> None:
+    """同一目录下的 video.mp4 会被其他清晰度覆盖，所以只保留最新这一条"""
+    r = _get_redis()
+    pipe = r.pipeline()
+    pipe.delete(_index_key(video_id))
+    pipe.hset(_index_key(video_id), quality, json.dumps(meta))
+    pipe.execute()
+
+
+def create_task(
+    url: str,
+    quality: str = "720p",
+    profile: Optional[str] = None,
+    batch_id: Optional[str] = None,
+) -> str:
+    """
+    创建任务并放入下载队列，返回 task_id
+    profile：下载档位，None 用 YOUTUBE_DOWNLOAD_PROFILE（调用方负责校验）
+    batch_id：所属批次（子任务结束时补齐该批次的 backlog）
+    - 已下载过：直接生成一个 finished 任务（不入队）
+    - 相同 video_id + 清晰度正在排队 / 下载：返回那个任务的 task_id
+    """
+    r = _get_redis()
     task_id = uuid.uuid4().hex
+    video_id = parse_video_id(url)
     task_data: Dict[str, Any] = {
         "status": "pending",
         "progress": 0,
@@ -56,44 +230,246 @@ def create_task(url: str, quality: str = "720p") -> str:
         "error": None,
         "url": url,
         "quality": quality,
+        "video_id": video_id,
+        "profile": profile,
+        "batch_id": batch_id,
+        "created_at": time.time(),
     }
 
+    if video_id:
+        cached = find_cached(video_id, quality)
+        if cached:
+            task_data.update({"status": "finished", "progress": 100, "result": cached, "cached": True})
+            _save_task(task_id, task_data)
+            logger.info(f"[Task] CACHED | task_id={task_id} | video_id={video_id} | quality={quality}")
+            return task_id
+
+        inflight_key = _inflight_key(video_id, quality)
+        if not r.set(inflight_key, task_id, nx=True, ex=TASK_TTL_SECONDS):
+            existing_id = r.get(inflight_key)
+            existing = _load_task(existing_id) if existing_id else None
+            if existing and existing["status"] in ("pending", "running"):
+                logger.info(f"[Task] ATTACH | task_id={existing_id} | video_id={video_id} | quality={quality}")
+                return existing_id
+            # 上一个任务已结束但标记没清掉：接管
+            r.set(inflight_key, task_id, ex=TASK_TTL_SECONDS)
+
     _save_task(task_id, task_data)
+    r.lpush(QUEUE_KEY, task_id)
     logger.info(f"[Task] CREATE | task_id={task_id} | url={url} | quality={quality}")
-
-    t = threading.Thread(
-        target=_run_task,
-        args=(task_id, url, quality),
-        daemon=True,
-    )
-    t.start()
     return task_id
 
 
+def get_queue_position(task_id: str) -> Optional[int]:
+    """排队位置（1 表示下一个执行）；不在队列里返回 None"""
+    r = _get_redis()
+    index = r.lpos(QUEUE_KEY, task_id)
+    if index is None:
+        return None
+    return r.llen(QUEUE_KEY) - index
+
+
+def cancel_task(task_id: str) -> Optional[str]:
+    """
+    取消任务，返回取消后的状态：
+      - 排队中：移出队列，直接 cancelled
+      - 运行中：打上取消标记，下载线程在下一次进度回调时中断，状态随后变为 cancelled
+      - 已结束：原样返回当前状态
+    任务不存在返回 None
+    """
+    task = _load_task(task_id)
+    if not task:
+        return None
+    if task.get("type") == "batch":
+        return cancel_batch(task_id)
+
+    r = _get_redis()
+    if task["status"] == "pending" and r.lrem(QUEUE_KEY, 0, task_id):
+        task.update({"status": "cancelled", "error": None})
+        _save_task(task_id, task)
+        logger.info(f"[Task] CANCEL queued | task_id={task_id}")
+        return "cancelled"
+
+    if task["status"] in ("pending", "running"):
+        # pending 但已不在队列里：刚被 worker 取走，同样靠标记中断
+        r.set(f"{CANCEL_KEY_PREFIX}{task_id}", 1, ex=TASK_TTL_SECONDS)
+        logger.info(f"[Task] CANCEL requested | task_id={task_id}")
+        return "cancelling"
+
+    return task["status"]
+
+
+def _is_cancelled(task_id: str) -> bool:
+    return bool(_get_redis().exists(f"{CANCEL_KEY_PREFIX}{task_id}"))
+
+
+class _ProgressReporter:
+    """
+    yt-dlp progress hook：
+
+    - 按文件累计已下载 / 总字节（视频、音频分轨各算一个文件），整体进度 = 已下载 / 总量，只增不减
+    - 写 Redis（顺带检查取消标记）按时间节流；某个文件下载完成时立即写一次
+    - 合并等后处理阶段没有回调，进度停在 99，任务结束时由 _run_task 置 100
+    """
+
+    def __init__(self, task_id: str, interval: float):
+        self.task_id = task_id
+        self.interval = interval
+        self.files: Dict[str, list] = {}     # filename -> [downloaded, total]
+        self.progress = 0
+        self.last_flush = 0.0
+
+    def __call__(self, d: Dict[str, Any]) -> None:
+        status = d.get("status")
+        if status not in ("downloading", "finished"):
+            return
+
+        total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+        downloaded = d.get("downloaded_bytes") or 0
+        if status == "finished":
+            downloaded = total = downloaded or total
+        self.files[d.get("filename") or ""] = [downloaded, total]
+
+        now = time.monotonic()
+        if status == "downloading" and now - self.last_flush < self.interval:
+            return
+        self.last_flush = now
+
+        if _is_cancelled(self.task_id):
+            raise TaskCancelled()
+
+        sum_done = sum(v[0] for v in self.files.values())
+        sum_total = sum(v[1] for v in self.files.values())
+        if sum_total:
+            self.progress = max(self.progress, min(99, int(sum_done * 100 / sum_total)))
+
+        _update_fields(self.task_id, {
+            "progress": self.progress,
+            "downloaded_bytes": sum_done,
+            "total_bytes": sum_total or None,
+            "speed": d.get("speed") if status == "downloading" else None,
+            "eta": d.get("eta") if status == "downloading" else None,
+            "updated_at": time.time(),
+        })
+
+
+def _record_throughput(stats: Optional[Dict[str, Any]]) -> None:
+    """累计各下载档位的吞吐，失败只记日志"""
+    if not stats or not stats.get("bytes"):
+        return
+    try:
+        key = f"{PROFILE_STATS_PREFIX}{stats['profile']}"
+        pipe = _get_redis().pipeline()
+        pipe.hincrby(key, "downloads", 1)
+        pipe.hincrby(key, "bytes", int(stats["bytes"]))
+        pipe.hincrbyfloat(key, "seconds", float(stats["seconds"] or 0))
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"[Task] record throughput failed | error={repr(e)}")
+
+
+def get_profile_stats() -> Dict[str, Dict[str, Any]]:
+    """各下载档位累计吞吐：{profile: {downloads, bytes, seconds, throughput_bps}}"""
+    r = _get_redis()
+    result = {}
+    for name in _cfg("YOUTUBE_DOWNLOAD_PROFILES", {}):
+        raw = r.hgetall(f"{PROFILE_STATS_PREFIX}{name}")
+        downloads = int(raw.get("downloads", 0))
+        total_bytes = int(raw.get("bytes", 0))
+        seconds = float(raw.get("seconds", 0))
+        result[name] = {
+            "downloads": downloads,
+            "bytes": total_bytes,
+            "seconds": round(seconds, 3),
+            "throughput_bps": int(total_bytes / seconds) if seconds > 0 else None,
+        }
+    return result
+
+
+def _offload(task_id: str, info: Dict[str, Any]) -> bool:
+    """
+    转存 MinIO，结果写进 info["minio"]；失败只记在 info["minio_error"]，不影响任务成功
+    返回本地目录是否已删除
+    """
+    _update_fields(task_id, {"stage": "uploading"})
+    try:
+        info["minio"] = youtube_offload.offload(info)
+    except Exception as e:
+        logger.error(f"[Task] offload failed | task_id={task_id} | error={repr(e)}")
+        info["minio_error"] = str(e)
+        return False
+
+    if _cfg("YOUTUBE_MINIO_DELETE_LOCAL", False):
+        youtube_storage.evict(info["video_id"])
+        return True
+    return False
+
+
 def _run_task(task_id: str, url: str, quality: str):
-    """真正跑下载的后台线程"""
+    """在下载线程里执行一个任务"""
     logger.info(f"[Task] RUN | task_id={task_id}")
 
+    if _is_cancelled(task_id):
+        task = _load_task(task_id) or {}
+        task.update({"status": "cancelled"})
+        _save_task(task_id, task)
+        return
+
     task = _load_task(task_id) or {}
     task.update({
         "status": "running",
         "progress": 0,
+        "started_at": time.time(),
     })
     _save_task(task_id, task)
 
+    reporter = _ProgressReporter(task_id, float(_cfg("YOUTUBE_PROGRESS_INTERVAL", 1.0)))
+    video_id = task.get("video_id")
+    batch_id = task.get("batch_id")
+
     try:
-        info = download_youtube_video(url, quality)
+        # 排队期间别的任务可能已经下好了同一个视频
+        info = find_cached(video_id, quality) if video_id else None
+        if info is None:
+            try:
+                youtube_storage.ensure_space(keep=video_id)
+            except Exception as e:
+                logger.error(f"[Task] ensure space failed | task_id={task_id} | error={repr(e)}")
+            # probe 接口缓存过 info 就直接用，省一次 extract_info
+            probed = youtube_probe.load_cached(video_id) if video_id else None
+            info = download_youtube_video(
+                url, quality, progress_hooks=[reporter], info=probed, profile=task.get("profile")
+            )
+            stats = info.pop("download", None)
+            local_deleted = False
+            if _cfg("YOUTUBE_MINIO_OFFLOAD", False) and info.get("video_id"):
+                local_deleted = _offload(task_id, info)
+            if video_id and not local_deleted:
+                _index_result(video_id, quality, info)
+            _record_throughput(stats)
+            info = {**info, "download": stats}
+        if info.get("video_id") and os.path.exists(info.get("video_path") or ""):
+            youtube_storage.touch(info["video_id"])
         logger.info(f"[Task] SUCCESS | task_id={task_id}")
 
         task = _load_task(task_id) or {}
         task.update({
             "status": "finished",
+            "stage": None,
             "progress": 100,
+            "speed": None,
+            "eta": None,
             "result": info,
             "error": None,
         })
         _save_task(task_id, task)
 
+    except TaskCancelled:
+        logger.info(f"[Task] CANCELLED | task_id={task_id}")
+        task = _load_task(task_id) or {}
+        task.update({"status": "cancelled"})
+        _save_task(task_id, task)
+
     except Exception as e:
         logger.error(f"[Task] ERROR | task_id={task_id} | error={repr(e)}")
         task = _load_task(task_id) or {}
@@ -103,7 +479,398 @@ def _run_task(task_id: str, url: str, quality: str):
         })
         _save_task(task_id, task)
 
+    finally:
+        r = _get_redis()
+        r.delete(f"{CANCEL_KEY_PREFIX}{task_id}")
+        if video_id and r.get(_inflight_key(video_id, quality)) == task_id:
+            r.delete(_inflight_key(video_id, quality))
+        if batch_id:
+            try:
+                _fill_batch(batch_id)
+            except Exception as e:
+                logger.error(f"[Batch] fill failed | batch_id={batch_id} | error={repr(e)}")
+
 
 def get_task(task_id: str) -> Optional[Dict[str, Any]]:
     """查询任务信息"""
     return _load_task(task_id)
+
+
+# ============== 租约 / 崩溃恢复 ==============
+
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _renew_lease(r, task_id: str, lease_seconds: int) -> None:
+    """
+    写 / 续期任务租约；心跳线程里没有 app context，
+    redis 客户端和租约时长由调用方在 worker 线程里取好传进来
+    """
+    r.set(
+        f"{LEASE_KEY_PREFIX}{task_id}",
+        f"{_WORKER_ID}:{threading.get_ident()}",
+        ex=lease_seconds,
+    )
+
+
+def _release_lease(task_id: str) -> None:
+    _get_redis().delete(f"{LEASE_KEY_PREFIX}{task_id}")
+
+
+def _recover_one(task_id: str, task: Dict[str, Any]) -> None:
+    """租约已过期的任务：放回队头重跑（续传），次数用完记为失败"""
+    r = _get_redis()
+    if r.get(f"{CANCEL_KEY_PREFIX}{task_id}"):
+        task.update({"status": "cancelled"})
+        _save_task(task_id, task)
+        r.delete(f"{CANCEL_KEY_PREFIX}{task_id}")
+        return
+
+    attempts = int(task.get("attempts") or 0) + 1
+    if attempts > int(_cfg("YOUTUBE_TASK_MAX_ATTEMPTS", 3)):
+        task.update({"status": "error", "error": "worker lost too many times", "attempts": attempts})
+        _save_task(task_id, task)
+        logger.error(f"[Task] RECOVER give up | task_id={task_id} | attempts={attempts}")
+        return
+
+    task.update({"status": "pending", "attempts": attempts, "speed": None, "eta": None})
+    _save_task(task_id, task)
+    r.rpush(QUEUE_KEY, task_id)   # 右端是队头，优先续跑
+    logger.info(f"[Task] RECOVER requeue | task_id={task_id} | attempts={attempts}")
+
+
+def recover_expired() -> bool:
+    """
+    恢复巡检（worker 启动时立即执行一次，之后每个租约周期一次；多进程靠锁只跑一份）
+    - running 且没有租约：执行它的进程已经没了
+    - pending 但不在队列里、不在 claiming 里、也没有租约、创建超过一个租约周期：出队后进程就挂了
+    - claiming 里停留超过一个租约周期的（出队后、写租约前进程就挂了）：移出 claiming，按上一条处理
+    """
+    r = _get_redis()
+    lease_seconds = int(_cfg("YOUTUBE_TASK_LEASE_SECONDS", 60))
+    lock = r.lock(RECOVER_LOCK_KEY, timeout=lease_seconds)
+    if not lock.acquire(blocking=False):
+        return False
+
+    try:
+        now = time.time()
+        claiming = set()
+        for task_id in r.lrange(CLAIMING_KEY, 0, -1):
+            claimed_at = r.hget(CLAIMS_KEY, task_id)
+            if claimed_at is None:
+                # 正常情况下 worker 写完租约马上就移出去了：从现在开始计时
+                r.hsetnx(CLAIMS_KEY, task_id, now)
+                claiming.add(task_id)
+            elif now - float(claimed_at) < lease_seconds:
+                claiming.add(task_id)
+            else:
+                pipe = r.pipeline()
+                pipe.lrem(CLAIMING_KEY, 0, task_id)
+                pipe.hdel(CLAIMS_KEY, task_id)
+                pipe.execute()
+
+        candidates = r.zrange(f"{INDEX_STATUS_PREFIX}running", 0, -1)
+        candidates += r.zrangebyscore(f"{INDEX_STATUS_PREFIX}pending", "-inf", now - lease_seconds)
+        for task_id, task in zip(candidates, _load_tasks(candidates)):
+            if not task or task.get("type") == "batch":
+                continue
+            if task["status"] not in ("pending", "running"):
+                continue
+            if task_id in claiming or r.exists(f"{LEASE_KEY_PREFIX}{task_id}"):
+                continue
+            if task["status"] == "pending" and r.lpos(QUEUE_KEY, task_id) is not None:
+                continue
+            _recover_one(task_id, task)
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+    return False
+
+
+def list_tasks(status: Optional[str] = None, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+    """
+    按创建时间倒序分页列出任务（可按状态过滤），直接走 zset 索引：ZCARD + ZREVRANGE
+    超过 TTL 的索引项顺手清掉（任务 hash 已过期）
+    """
+    r = _get_redis()
+    index_key = f"{INDEX_STATUS_PREFIX}{status}" if status else INDEX_CREATED_KEY
+    r.zremrangebyscore(index_key, "-inf", time.time() - TASK_TTL_SECONDS)
+
+    start = (page - 1) * page_size
+    task_ids = r.zrevrange(index_key, start, start + page_size - 1)
+    items = []
+    for task_id, task in zip(task_ids, _load_tasks(task_ids)):
+        if not task:
+            continue
+        result = task.get("result") or {}
+        items.append({
+            "task_id": task_id,
+            "type": task.get("type", "video"),
+            "status": task.get("status"),
+            "progress": 100 if task.get("status") == "finished" else task.get("progress", 0),
+            "url": task.get("url"),
+            "video_id": task.get("video_id"),
+            "quality": task.get("quality"),
+            "title": result.get("title"),
+            "error": task.get("error"),
+            "batch_id": task.get("batch_id"),
+            "total": task.get("total"),
+            "created_at": task.get("created_at"),
+        })
+    return {"total": r.zcard(index_key), "page": page, "page_size": page_size, "items": items}
+
+
+# ============== 批量任务 ==============
+
+def create_batch(videos: List[Dict[str, Any]], quality: str = "720p", profile: Optional[str] = None) -> str:
+    """
+    videos：expand_urls 的结果（已按 video_id 去重）
+    父任务和普通任务存在同一个 key 空间里（type=batch），子任务 id 按提交顺序记在 children
+    """
+    batch_id = uuid.uuid4().hex
+    _save_task(batch_id, {
+        "type": "batch",
+        "status": "running",
+        "quality": quality,
+        "profile": profile,
+        "total": len(videos),
+        "children": [],
+        "created_at": time.time(),
+    })
+
+    r = _get_redis()
+    backlog_key = f"{BATCH_BACKLOG_PREFIX}{batch_id}"
+    if videos:
+        r.rpush(backlog_key, *[v["url"] for v in videos])
+        r.expire(backlog_key, TASK_TTL_SECONDS)
+    logger.info(f"[Batch] CREATE | batch_id={batch_id} | total={len(videos)} | quality={quality}")
+
+    _fill_batch(batch_id)
+    return batch_id
+
+
+def _fill_batch(batch_id: str) -> None:
+    """
+    把 backlog 里的 URL 提交成子任务，直到本批次排队 / 下载中的子任务达到 YOUTUBE_BATCH_CONCURRENCY
+    已下载过的视频 create_task 直接返回 finished，不占名额，所以会连续提交
+    """
+    r = _get_redis()
+    with r.lock(f"{BATCH_LOCK_PREFIX}{batch_id}", timeout=60, blocking_timeout=10):
+        batch = _load_task(batch_id)
+        if not batch or batch["status"] != "running":
+            return
+
+        limit = int(_cfg("YOUTUBE_BATCH_CONCURRENCY", 2))
+        children = batch["children"]
+        active = sum(
+            1 for child in _load_tasks(children)
+            if child and child["status"] in ("pending", "running")
+        )
+        backlog_key = f"{BATCH_BACKLOG_PREFIX}{batch_id}"
+        while active < limit:
+            url = r.lpop(backlog_key)
+            if url is None:
+                break
+            child_id = create_task(url, batch["quality"], batch.get("profile"), batch_id=batch_id)
+            children.append(child_id)
+            child = _load_task(child_id)
+            if child and child["status"] in ("pending", "running"):
+                active += 1
+
+        if active == 0 and not r.llen(backlog_key):
+            batch["status"] = "finished"
+            batch["finished_at"] = time.time()
+            logger.info(f"[Batch] FINISHED | batch_id={batch_id} | total={batch['total']}")
+        _save_task(batch_id, batch)
+
+
+def _load_tasks(task_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """批量读任务（一次 pipeline）"""
+    if not task_ids:
+        return []
+    pipe = _get_redis().pipeline()
+    for task_id in task_ids:
+        pipe.hgetall(_task_key(task_id))
+    raws = pipe.execute(raise_on_error=False)
+    return [
+        _load_task(task_id) if isinstance(raw, ResponseError) else _decode_task(task_id, raw)
+        for task_id, raw in zip(task_ids, raws)
+    ]
+
+
+def get_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    """
+    批次汇总：各状态计数 + 总进度（未提交的子任务按 0 计）+ 子任务列表
+    顺带补齐 backlog（子任务被单独取消 / 挂到别的任务上时，靠查询推进）
+    """
+    batch = _load_task(batch_id)
+    if not batch or batch.get("type") != "batch":
+        return None
+    if batch["status"] == "running":
+        _fill_batch(batch_id)
+        batch = _load_task(batch_id) or batch
+
+    counts = {"pending": 0, "running": 0, "finished": 0, "error": 0, "cancelled": 0}
+    progress_sum = 0
+    items = []
+    for child_id, child in zip(batch["children"], _load_tasks(batch["children"])):
+        status = child["status"] if child else "expired"
+        counts[status] = counts.get(status, 0) + 1
+        progress = 100 if status == "finished" else (child or {}).get("progress", 0)
+        progress_sum += progress
+        items.append({
+            "task_id": child_id,
+            "video_id": (child or {}).get("video_id"),
+            "status": status,
+            "progress": progress,
+            "cached": bool((child or {}).get("cached")),
+        })
+
+    total = batch["total"]
+    counts["queued"] = total - len(items)   # 还在 backlog 里没提交的
+    return {
+        "batch_id": batch_id,
+        "status": batch["status"],
+        "total": total,
+        "progress": int(progress_sum / total) if total else 100,
+        "counts": counts,
+        "children": items,
+    }
+
+
+def cancel_batch(batch_id: str) -> Optional[str]:
+    """取消批次：清空 backlog，取消已提交但未结束的子任务"""
+    batch = _load_task(batch_id)
+    if not batch or batch.get("type") != "batch":
+        return None
+    if batch["status"] != "running":
+        return batch["status"]
+
+    r = _get_redis()
+    with r.lock(f"{BATCH_LOCK_PREFIX}{batch_id}", timeout=60, blocking_timeout=10):
+        r.delete(f"{BATCH_BACKLOG_PREFIX}{batch_id}")
+        batch = _load_task(batch_id) or batch
+        batch["status"] = "cancelled"
+        _save_task(batch_id, batch)
+
+    for child_id, child in zip(batch["children"], _load_tasks(batch["children"])):
+        # 只取消属于本批次的子任务；挂到别的请求上的同一视频不动
+        if child and child.get("batch_id") == batch_id and child["status"] in ("pending", "running"):
+            cancel_task(child_id)
+    logger.info(f"[Batch] CANCEL | batch_id={batch_id}")
+    return "cancelled"
+
+
+# ============== 下载线程池 ==============
+
+def _acquire_slot():
+    """抢一个全局并发槽位；都被占用时返回 None"""
+    r = _get_redis()
+    for i in range(int(_cfg("YOUTUBE_MAX_CONCURRENCY", 2))):
+        # thread_local=False：心跳线程要用同一个 token 续期
+        lock = r.lock(f"{SLOT_KEY_PREFIX}{i}", timeout=SLOT_TIMEOUT_SECONDS, thread_local=False)
+        if lock.acquire(blocking=False):
+            return lock
+    return None
+
+
+@contextmanager
+def _hold_locks(*locks, task_id: Optional[str] = None, lease_seconds: int = 60):
+    """
+    任务执行期间定时续期槽位锁 / 目录锁 / 任务租约；进程挂掉则全部超时自动释放
+    """
+    locks = [lock for lock in locks if lock is not None]
+    stop = threading.Event()
+    r = _get_redis()
+
+    def _heartbeat():
+        while not stop.wait(min(SLOT_TIMEOUT_SECONDS, lease_seconds) / 3):
+            for lock in locks:
+                try:
+                    lock.reacquire()
+                except Exception as e:
+                    logger.error(f"[Task] lock heartbeat failed | lock={lock.name} | error={repr(e)}")
+            if task_id:
+                try:
+                    _renew_lease(r, task_id, lease_seconds)
+                except Exception as e:
+                    logger.error(f"[Task] lease heartbeat failed | task_id={task_id} | error={repr(e)}")
+
+    t = threading.Thread(target=_heartbeat, name="yt-lock-heartbeat", daemon=True)
+    t.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        for lock in locks:
+            try:
+                lock.release()
+            except Exception:
+                pass
+        if task_id:
+            _release_lease(task_id)
+
+
+def process_one() -> bool:
+    """
+    下载线程循环体：先占槽位再取任务，保证全局同时运行的下载不超过 YOUTUBE_MAX_CONCURRENCY
+    """
+    slot = _acquire_slot()
+    if slot is None:
+        return False
+
+    r = _get_redis()
+    try:
+        # 出队即进 claiming：写租约之前恢复巡检也不会把它当成丢失的任务
+        task_id = r.blmove(QUEUE_KEY, CLAIMING_KEY, 5, "RIGHT", "LEFT")
+    except Exception:
+        slot.release()
+        raise
+    if not task_id:
+        slot.release()
+        return False
+
+    lease_seconds = int(_cfg("YOUTUBE_TASK_LEASE_SECONDS", 60))
+    # 占上租约再移出 claiming，进程在这之后挂掉由租约过期被恢复巡检发现
+    _renew_lease(r, task_id, lease_seconds)
+    pipe = r.pipeline()
+    pipe.lrem(CLAIMING_KEY, 1, task_id)
+    pipe.hdel(CLAIMS_KEY, task_id)
+    pipe.execute()
+    task = _load_task(task_id)
+    if not task:
+        _release_lease(task_id)
+        slot.release()
+        return True
+
+    # 同一个 video 目录已有任务在写（例如另一个清晰度）：放回队尾稍后再试
+    video_lock = None
+    if task.get("video_id"):
+        video_lock = r.lock(f"{VIDEO_LOCK_PREFIX}{task['video_id']}", timeout=SLOT_TIMEOUT_SECONDS, thread_local=False)
+        if not video_lock.acquire(blocking=False):
+            r.lpush(QUEUE_KEY, task_id)
+            _release_lease(task_id)
+            slot.release()
+            return False
+
+    with _hold_locks(slot, video_lock, task_id=task_id, lease_seconds=lease_seconds):
+        _run_task(task_id, task["url"], task.get("quality", "720p"))
+    return True
+
+
+def start_workers(app, force: bool = False) -> None:
+    """
+    启动下载线程（create_app 时调用；独立 worker 进程传 force=True）
+    YOUTUBE_WORKER_MODE=external 时 Web 进程不消费队列
+    """
+    if not force and app.config.get("YOUTUBE_WORKER_MODE", "embedded") != "embedded":
+        return
+    threads = int(app.config.get("YOUTUBE_WORKER_THREADS") or app.config.get("YOUTUBE_MAX_CONCURRENCY", 2))
+    for i in range(threads):
+        start_background_worker(app, f"youtube-download-{i}", process_one, interval=1.0)
+    start_background_worker(
+        app, "youtube-recover", recover_expired,
+        interval=float(app.config.get("YOUTUBE_TASK_LEASE_SECONDS", 60)),
+    )
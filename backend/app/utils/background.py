@@ -0,0 +1,48 @@
+# app/utils/background.py
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_workers: Dict[str, threading.Thread] = {}
+_workers_lock = threading.Lock()
+
+
+def start_background_worker(
+    app,
+    name: str,
+    loop_fn: Callable[[], bool],
+    interval: float = 1.0,
+) -> bool:
+    """
+    在当前进程里启动一个守护线程，反复执行 loop_fn()（自动带 app_context）。
+
+    - 同名 worker 在一个进程里只会启动一次（gunicorn 每个 worker 进程各自一份）
+    - loop_fn 返回 True 表示“还有活没干完”，立即进入下一轮；否则 sleep interval 秒
+    - loop_fn 抛异常只记日志，sleep 后继续，线程不会退出
+
+    返回 True 表示本次真正启动了线程
+    """
+    with _workers_lock:
+        t = _workers.get(name)
+        if t is not None and t.is_alive():
+            return False
+
+        def _run():
+            logger.info(f"[Worker] START | name={name}")
+            while True:
+                busy = False
+                try:
+                    with app.app_context():
+                        busy = bool(loop_fn())
+                except Exception as e:
+                    logger.error(f"[Worker] loop failed | name={name} | error={repr(e)}")
+                if not busy:
+                    time.sleep(interval)
+
+        t = threading.Thread(target=_run, name=f"bg-{name}", daemon=True)
+        _workers[name] = t
+        t.start()
+        return True
@@ -1,8 +1,11 @@
 # app/utils/minio_storage.py
+import hashlib
 import logging
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 
+import requests
 from minio import Minio
+from minio.deleteobjects import DeleteObject
 from datetime import timedelta
 from typing import Union, Optional
 from flask import current_app, Request
@@ -154,9 +157,11 @@ def generate_presigned_download_url(
     download_filename: Optional[str],
     request: Optional[Request],
     as_attachment: bool = True,   # ⭐ 新增，默认还是附件下载
+    public_url: bool = True,
 ) -> str:
     """
     生成下载预签名 URL，对应 Java 的 generatePresignedDownloadUrl。
+    public_url=False 时返回 MinIO 内部地址（给内网服务 / nginx 内部转发用，不做公网改写）
     """
     client = get_minio_client()
 
@@ -185,6 +190,9 @@ def generate_presigned_download_url(
     except S3Error as e:
         raise RuntimeError("Failed to generate presigned download URL") from e
 
+    if not public_url:
+        return raw_url
+
     dynamic_public_base = _build_dynamic_public_base(request)
     return _rewrite_to_public_url(raw_url, dynamic_public_base)
 
@@ -201,38 +209,148 @@ def delete_object(bucket: str, object_key: str) -> None:
     except S3Error as e:
         raise RuntimeError("Failed to delete object from MinIO") from e
 
+def delete_objects(bucket: str, object_keys: List[str]) -> List[Tuple[str, str]]:
+    """
+    批量删除对象（S3 Multi-Object Delete，一次请求最多 1000 个 key）
+    返回删除失败的 [(object_key, 错误信息)]，全部成功返回空列表
+    """
+    client = get_minio_client()
+    delete_list = [DeleteObject(key) for key in object_keys]
+    try:
+        # remove_objects 是惰性的，必须把返回的错误迭代器消费完才会真正发请求
+        errors = client.remove_objects(bucket_name=bucket, delete_object_list=delete_list)
+        return [(err.name, f"{err.code}: {err.message}") for err in errors]
+    except S3Error as e:
+        raise RuntimeError(f"Failed to delete objects from MinIO: bucket={bucket}") from e
+
+def iter_objects(bucket: str, prefix: Optional[str] = None):
+    """
+    递归遍历 bucket（可按前缀），逐个返回 minio.datatypes.Object（object_name / size / etag）
+    """
+    client = get_minio_client()
+    try:
+        yield from client.list_objects(bucket_name=bucket, prefix=prefix, recursive=True)
+    except S3Error as e:
+        raise RuntimeError(f"Failed to list objects: bucket={bucket} prefix={prefix}") from e
+
 # app/utils/minio_storage.py
 # (保留你原有的 import 和函数，在文件末尾添加以下内容)
 
 # ... (上面的代码保持不变: get_minio_client, generate_presigned_url 等) ...
 
-def get_object_stream(bucket: str, object_key: str):
+def stat_object(bucket: str, object_key: str):
+    """
+    获取对象元数据（HEAD 请求，不下载内容）
+    返回: minio.datatypes.Object，包含 size / etag / last_modified / content_type
+    """
+    client = get_minio_client()
+    try:
+        return client.stat_object(bucket_name=bucket, object_name=object_key)
+    except S3Error as e:
+        raise RuntimeError(f"Failed to stat object: {object_key}") from e
+
+
+def get_object_stream(
+    bucket: str,
+    object_key: str,
+    offset: int = 0,
+    length: int = 0,
+    match_etag: Optional[str] = None,
+):
     """
     【新增】直接获取 MinIO 文件流（用于 Flask 代理下载）
+    offset / length: 只读取对象的一段（HTTP Range），length=0 表示读到末尾
+    match_etag: 只读这个 ETag 的内容（If-Match），对象已被覆盖时 MinIO 返回 412 → RuntimeError
     返回: MinIO 的 response 对象 (类似 file-like object)
     """
     client = get_minio_client()
     try:
         # get_object 返回的是 urllib3.response.HTTPResponse
-        # 它可以被 Flask 的 send_file 直接使用
-        return client.get_object(bucket_name=bucket, object_name=object_key)
+        # 用完必须 close() + release_conn()，否则连接不会回到连接池
+        return client.get_object(
+            bucket_name=bucket,
+            object_name=object_key,
+            offset=offset,
+            length=length,
+            request_headers={"If-Match": f'"{match_etag}"'} if match_etag else None,
+        )
     except S3Error as e:
         raise RuntimeError(f"Failed to get object stream: {object_key}") from e
 
-def upload_stream(bucket: str, object_key: str, data, length: int, content_type: str = "application/octet-stream"):
+class HashingReader:
+    """
+    包装一个 file-like 对象：put_object 每 read 一次，就顺便累加字节数和 sha256
+    用于长度未知的流式上传，上传完成后直接拿到 size / sha256，无需再读一遍
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n: int = -1) -> bytes:
+        chunk = self._raw.read(n)
+        if chunk:
+            self.size += len(chunk)
+            self._sha256.update(chunk)
+        return chunk
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+
+def upload_stream(
+    bucket: str,
+    object_key: str,
+    data,
+    length: int = -1,
+    content_type: str = "application/octet-stream",
+    part_size: int = 0,
+):
     """
     【新增】直接上传流数据到 MinIO（用于回调保存）
-    data: bytes 或 file-like object
+    data: file-like object
+    length: 已知长度直接传；-1 表示长度未知，按 part_size 分片做 multipart 上传，
+            内存里最多只有几个分片，不会缓存整个文件
     """
     client = get_minio_client()
     _ensure_bucket_exists(client, bucket)
+    if length < 0 and not part_size:
+        part_size = int(current_app.config.get("MINIO_UPLOAD_PART_SIZE", 10 * 1024 * 1024))
     try:
-        client.put_object(
+        return client.put_object(
             bucket_name=bucket,
             object_name=object_key,
             data=data,
             length=length,
-            content_type=content_type
+            content_type=content_type,
+            part_size=part_size,
         )
     except S3Error as e:
-        raise RuntimeError(f"Failed to upload stream: {object_key}") from e
\ No newline at end of file
+        raise RuntimeError(f"Failed to upload stream: {object_key}") from e
+
+
+def upload_from_url(
+    url: str,
+    bucket: str,
+    object_key: str,
+    content_type: Optional[str] = None,
+    timeout: float = 60,
+) -> Tuple[int, str]:
+    """
+    从 HTTP 地址（如 Document Server 生成的文件链接）下载，并直接流式写入 MinIO
+    不落内存、不落盘；返回 (size, sha256)
+    """
+    with requests.get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        reader = HashingReader(r.raw)
+        upload_stream(
+            bucket=bucket,
+            object_key=object_key,
+            data=reader,
+            length=-1,
+            content_type=content_type or "application/octet-stream",
+        )
+    return reader.size, reader.sha256
@@ -0,0 +1,313 @@
+# app/utils/object_cache.py
+"""
+MinIO 热点对象的本地磁盘读穿缓存（LRU，按总字节数淘汰）
+
+- key = (bucket, object_key, etag)，对象被覆盖后 etag 变化，旧缓存自然失效并被淘汰
+- 命中时 touch 一下 mtime，mtime 即 LRU 时钟（atime 在 noatime 挂载下不可靠）
+- 未命中时由后台线程（MINIO_CACHE_FILL_WORKERS 个）整份拉取，边拉边写 <缓存文件>.part，完成后改名；
+  完整下载的请求跟读 .part（follow_fill），不再单独回源，首字节不用等整份拉完；
+  Range 请求直接从 MinIO 拉需要的那一段
+- 同一对象并发 miss 只回源一次：进程内去重 + 线程锁 + 跨进程 flock（gunicorn 多 worker），
+  其他进程的请求同样跟读那个 .part
+- 回源带 If-Match 固定 ETag，并核对返回的 ETag / 字节数，对象被覆盖时不会把新内容缓存到旧 key 下
+- 总大小记在进程内索引里（path -> size），淘汰时只 stat 索引里的文件，不再每次 os.walk；
+  其他 worker 写入 / 淘汰的文件靠每 MINIO_CACHE_RESCAN_INTERVAL 秒一次全量扫描补齐
+- 命中返回本地路径，由调用方用 send_file 输出（gunicorn 会走 os.sendfile 零拷贝）
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set
+
+from flask import current_app
+
+from . import minio_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发：只做进程内合并
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_locks_guard = threading.Lock()
+_key_locks: Dict[str, list] = {}   # name -> [Lock, 引用计数]
+
+_fill_guard = threading.Lock()
+_fill_pool: Optional[ThreadPoolExecutor] = None
+_filling: Set[str] = set()         # 已提交后台回源、还没完成的缓存文件
+
+FOLLOW_START_SECONDS = 2.0         # 等 .part 出现的最长时间，超时调用方自己从 MinIO 出流
+FOLLOW_STALL_SECONDS = 15.0        # .part 这么久没有增长，认为回源已失败
+
+_index_lock = threading.Lock()
+_index: Dict[str, int] = {}        # 缓存文件 -> 字节数
+_index_total = 0
+_index_scanned_at = 0.0
+
+
+def _cfg(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def is_enabled() -> bool:
+    return bool(_cfg("MINIO_CACHE_ENABLED", True))
+
+
+def _cache_dir() -> str:
+    return _cfg("MINIO_CACHE_DIR") or os.path.join(os.getcwd(), "cache", "minio")
+
+
+def _entry_path(bucket: str, object_key: str, etag: str) -> str:
+    name = hashlib.sha256(f"{bucket}\0{object_key}\0{etag}".encode("utf-8")).hexdigest()
+    return os.path.join(_cache_dir(), name[:2], name)
+
+
+def _part_path(path: str) -> str:
+    return f"{path}.part"
+
+
+def _touch(path: str) -> bool:
+    """命中则刷新 mtime 并返回 True；文件不存在（或刚被淘汰）返回 False"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+@contextmanager
+def _single_flight(path: str):
+    """
+    同一个缓存文件同时只允许一个线程 / 进程去回源
+    跨进程用 256 个分片锁文件（按文件名前两位），锁文件数量有上限
+    """
+    with _locks_guard:
+        entry = _key_locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+
+    try:
+        with entry[0]:
+            if fcntl is None:
+                yield
+                return
+            lock_path = os.path.join(_cache_dir(), "locks", os.path.basename(path)[:2] + ".lock")
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            with open(lock_path, "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                _key_locks.pop(path, None)
+
+
+def _scan_locked() -> None:
+    """全量扫描缓存目录重建索引（调用方持有 _index_lock）"""
+    global _index_total, _index_scanned_at
+    _index.clear()
+    for root, dirs, files in os.walk(_cache_dir()):
+        dirs[:] = [d for d in dirs if d != "locks"]
+        for fname in files:
+            if fname.endswith((".lock", ".tmp", ".part")):
+                continue
+            fpath = os.path.join(root, fname)
+            try:
+                _index[fpath] = os.stat(fpath).st_size
+            except FileNotFoundError:
+                continue
+    _index_total = sum(_index.values())
+    _index_scanned_at = time.monotonic()
+
+
+def _index_add(path: str, size: int) -> None:
+    global _index_total
+    with _index_lock:
+        _index_total += size - _index.get(path, 0)
+        _index[path] = size
+
+
+def _evict(incoming: int) -> None:
+    """总大小 + 即将写入的大小超过上限时，按 mtime 从旧到新删除（只看索引，不遍历目录）"""
+    global _index_total
+    max_bytes = int(_cfg("MINIO_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+    rescan = float(_cfg("MINIO_CACHE_RESCAN_INTERVAL", 300))
+
+    with _index_lock:
+        if not _index_scanned_at or time.monotonic() - _index_scanned_at > rescan:
+            _scan_locked()
+        if _index_total + incoming <= max_bytes:
+            return
+
+        entries = []
+        for fpath, size in list(_index.items()):
+            try:
+                entries.append((os.stat(fpath).st_mtime, size, fpath))
+            except FileNotFoundError:
+                # 被别的 worker 淘汰了
+                _index_total -= _index.pop(fpath)
+
+        entries.sort()
+        for _, size, fpath in entries:
+            if _index_total + incoming <= max_bytes:
+                break
+            try:
+                os.remove(fpath)
+                logger.info(f"[ObjectCache] EVICT | path={fpath} | size={size}")
+            except FileNotFoundError:
+                pass
+            _index_total -= _index.pop(fpath, 0)
+
+
+def _fill(bucket: str, object_key: str, etag: str, size: int, path: str) -> None:
+    """从 MinIO 整份拉取指定 ETag 的对象写入缓存（后台线程里执行），写入过程中可被 follow_fill 跟读"""
+    part_path = _part_path(path)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _single_flight(path):
+            # 等锁期间别人可能已经拉好了
+            if _touch(path):
+                return
+
+            _evict(size)
+            chunk_size = int(_cfg("MINIO_STREAM_CHUNK_SIZE", 256 * 1024))
+            stream = minio_storage.get_object_stream(bucket, object_key, match_etag=etag)
+            written = 0
+            try:
+                fetched = (stream.headers.get("ETag") or "").strip('"')
+                if fetched != etag:
+                    raise RuntimeError(f"etag changed: expected={etag} fetched={fetched}")
+                with open(part_path, "wb") as f:
+                    for chunk in stream.stream(chunk_size):
+                        f.write(chunk)
+                        f.flush()  # 跟读的请求要能立即读到
+                        written += len(chunk)
+            finally:
+                stream.close()
+                stream.release_conn()
+            if written != size:
+                raise RuntimeError(f"size mismatch: expected={size} fetched={written}")
+            os.replace(part_path, path)
+            _index_add(path, size)
+            logger.info(f"[ObjectCache] FILL | key={object_key} | size={size}")
+    except Exception as e:
+        logger.error(f"[ObjectCache] fill failed | key={object_key} | error={repr(e)}")
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            pass
+
+
+def _fill_in_background(app, bucket: str, object_key: str, etag: str, size: int, path: str) -> None:
+    try:
+        with app.app_context():
+            _fill(bucket, object_key, etag, size, path)
+    finally:
+        with _fill_guard:
+            _filling.discard(path)
+
+
+def _schedule_fill(bucket: str, object_key: str, etag: str, size: int, path: str) -> None:
+    """提交后台回源；同一文件已在回源或排队太多时跳过（下次 miss 再提交）"""
+    global _fill_pool
+    workers = max(1, int(_cfg("MINIO_CACHE_FILL_WORKERS", 2)))
+    with _fill_guard:
+        if path in _filling or len(_filling) >= workers * 8:
+            return
+        if _fill_pool is None:
+            _fill_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="minio-cache-fill")
+        _filling.add(path)
+    try:
+        _fill_pool.submit(
+            _fill_in_background, current_app._get_current_object(), bucket, object_key, etag, size, path
+        )
+    except Exception:
+        with _fill_guard:
+            _filling.discard(path)
+        raise
+
+
+def get_cached_path(bucket: str, object_key: str, etag: str, size: int) -> Optional[str]:
+    """
+    返回对象在本地缓存里的路径；未命中返回 None 并提交后台回源
+    （完整下载再调 follow_fill 跟读回源中的文件，Range 请求直接从 MinIO 出流）
+
+    不缓存的情况：缓存关闭、没有 etag、对象超过单对象上限
+    """
+    if not is_enabled() or not etag:
+        return None
+    if size > int(_cfg("MINIO_CACHE_MAX_OBJECT_BYTES", 256 * 1024 * 1024)):
+        return None
+
+    path = _entry_path(bucket, object_key, etag)
+    if _touch(path):
+        return path
+
+    try:
+        _schedule_fill(bucket, object_key, etag, size, path)
+    except Exception as e:
+        logger.error(f"[ObjectCache] schedule fill failed | key={object_key} | error={repr(e)}")
+    return None
+
+
+def _follow(f, path: str, size: int, chunk_size: int) -> Iterator[bytes]:
+    """逐块读正在写入的 .part，读满 size 字节为止"""
+    part_path = _part_path(path)
+    sent = 0
+    stalled_at = None
+    try:
+        while sent < size:
+            chunk = f.read(min(chunk_size, size - sent))
+            if chunk:
+                sent += len(chunk)
+                stalled_at = None
+                yield chunk
+                continue
+            # 读到当前末尾：回源失败（.part 被删、也没有改名成缓存文件）或太久没增长就放弃
+            if not os.path.exists(part_path) and not os.path.exists(path):
+                raise RuntimeError(f"cache fill aborted: {path}")
+            now = time.monotonic()
+            stalled_at = stalled_at or now
+            if now - stalled_at > FOLLOW_STALL_SECONDS:
+                raise RuntimeError(f"cache fill stalled: {path}")
+            time.sleep(0.05)
+    finally:
+        f.close()
+
+
+def follow_fill(bucket: str, object_key: str, etag: str, size: int) -> Optional[Iterator[bytes]]:
+    """
+    miss 后跟读正在回源的缓存文件（本进程或其他 worker 写的都行），返回分块迭代器；
+    回源没有在 FOLLOW_START_SECONDS 内开始（排队太多 / 不缓存）返回 None，调用方自己从 MinIO 出流
+    """
+    if not is_enabled() or not etag:
+        return None
+    if size > int(_cfg("MINIO_CACHE_MAX_OBJECT_BYTES", 256 * 1024 * 1024)):
+        return None
+
+    path = _entry_path(bucket, object_key, etag)
+    part_path = _part_path(path)
+    deadline = time.monotonic() + FOLLOW_START_SECONDS
+    while True:
+        for candidate in (part_path, path):
+            try:
+                f = open(candidate, "rb")
+            except FileNotFoundError:
+                continue
+            # 崩溃留下的旧 .part 没人在写，不跟
+            if candidate == part_path and time.time() - os.fstat(f.fileno()).st_mtime > FOLLOW_STALL_SECONDS:
+                f.close()
+                continue
+            return _follow(f, path, size, int(_cfg("MINIO_STREAM_CHUNK_SIZE", 256 * 1024)))
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(0.05)
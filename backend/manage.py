@@ -2,7 +2,7 @@
 # backend/manage.py
 from flask import Flask
 from flask_migrate import Migrate
-from app import create_app
+from app import create_app, start_background_workers
 from app.extensions import db
 from app.models import *  # noqa
 
@@ -13,4 +13,6 @@ migrate = Migrate(app, db)
 
 if __name__ == "__main__":
     # 这样你可以：python manage.py run / flask --app manage.py db migrate
+    # 只有本地运行 Web 服务时才起后台线程，flask db 等命令不起
+    start_background_workers(app)
     app.run(host="0.0.0.0", port=5000, debug=True)
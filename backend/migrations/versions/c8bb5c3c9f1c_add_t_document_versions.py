@@ -0,0 +1,49 @@
+"""add t_document_versions
+
+Revision ID: c8bb5c3c9f1c
+Revises: 
+Create Date: 2026-10-19 12:05:37.671183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8bb5c3c9f1c'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 之前靠 db.create_all() 建过表的环境直接跳过
+    if sa.inspect(op.get_bind()).has_table("t_document_versions"):
+        return
+    op.create_table(
+        "t_document_versions",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("document_id", sa.BigInteger(), nullable=False),
+        sa.Column("version_no", sa.Integer(), nullable=False),
+        sa.Column("file_name", sa.String(length=255), nullable=True),
+        sa.Column("bucket", sa.String(length=128), nullable=True),
+        sa.Column("object_key", sa.String(length=512), nullable=False),
+        sa.Column("content_type", sa.String(length=255), nullable=True),
+        sa.Column("size", sa.BigInteger(), nullable=True),
+        sa.Column("sha256", sa.String(length=64), nullable=True),
+        sa.Column("changes_key", sa.String(length=512), nullable=True),
+        sa.Column("changes_size", sa.BigInteger(), nullable=True),
+        sa.Column("source", sa.String(length=32), nullable=True),
+        sa.Column("created_by", sa.String(length=64), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("document_id", "version_no", name="uk_document_version"),
+    )
+    op.create_index(
+        op.f("ix_t_document_versions_document_id"), "t_document_versions", ["document_id"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_t_document_versions_document_id"), table_name="t_document_versions")
+    op.drop_table("t_document_versions")
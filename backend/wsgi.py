@@ -3,7 +3,7 @@ from app import create_app
 
 env = os.getenv("APP_ENV", "dev")
 print(f"🔧 Flask using environment: {env}")
-app = create_app(env)
+app = create_app(env, start_workers=True)
 
 
 @app.get("/healthz")
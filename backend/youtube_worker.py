@@ -0,0 +1,25 @@
+# backend/youtube_worker.py
+"""
+YouTube 下载 worker（独立进程）
+
+Web 进程配置 YOUTUBE_WORKER_MODE=external 时，由这个进程消费下载队列：
+    python youtube_worker.py
+全局并发仍由 YOUTUBE_MAX_CONCURRENCY 控制，多开几个容器也不会超
+这个进程只跑下载线程和崩溃恢复巡检；删除队列 / 缩略图 / 用量对账 / OnlyOffice 保存由 Web 进程负责
+"""
+import os
+import time
+
+from app import create_app
+from app.services.youtube import youtube_tasks
+
+env = os.getenv("APP_ENV", "dev")
+# start_workers=False：不起 Web 进程的那一组后台线程，下面只启动 YouTube 消费者
+app = create_app(env, start_workers=False)
+
+
+if __name__ == "__main__":
+    youtube_tasks.start_workers(app, force=True)
+    print(f"🎬 YouTube worker started | env={env} | concurrency={app.config.get('YOUTUBE_MAX_CONCURRENCY')}")
+    while True:
+        time.sleep(3600)